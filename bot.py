@@ -4,48 +4,170 @@ import sqlite3
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile, LabeledPrice
-from openai import OpenAI
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import ClientSession, TCPConnector
+import certifi
+import ssl
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 import asyncio
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+import numpy as np
 import io
 import hashlib
 from urllib.parse import urlencode
-from flask import Flask, request, render_template, redirect, url_for, session
+from flask import Flask, request, render_template, stream_template, redirect, url_for, session, jsonify, Response
 import threading
 import os
 import logging
 import traceback
 import re
+import time
+import math
+import base64
+import csv
+from utils.downsample import lttb
+from utils.llm_router import LLMRouter, LLMUnavailable, LLMDeadlineExceeded
+from utils.prompts import TRAINING_SYSTEM, FOOD_SYSTEM, TRAINING_USER_TEMPLATE, FOOD_USER_TEMPLATE, profile_values
+from utils.prompts import CHAT_SYSTEM, CHAT_SUMMARY_SYSTEM, CHAT_CONTEXT_TEMPLATE, CHAT_SUMMARY_TEMPLATE
+from utils.prompts import PROFILE_TEMPLATE, estimate_tokens, DIET_SYSTEM, DIET_USER_TEMPLATE
+from utils.nutrition import FoodIndex, analyze_meals, daily_targets
+from utils.logging_setup import setup_logging, log_context, bind_log_context
+from utils.send_queue import SendScheduler, SendQueueMiddleware, bulk_sends, GLOBAL_BURST
+from utils.sharding import shard_for, update_user_id
+from utils.backup import BackupError, create_backup, list_backups
+from utils.profiler import LoopWatchdog, sample_stacks, MAX_PROFILE_SECONDS, MIN_INTERVAL, MAX_INTERVAL
+from utils.progress_dashboard import PROGRESS_METRICS, render_dashboard
+from utils.training_parser import parse_training
+from utils.difficulty import WINDOW_SIZE as DIFFICULTY_WINDOW, compute_difficulty
+from utils.text_compression import SEED_DICTIONARY, train_dictionary, compress_text, decompress_text, dictionary_id
+from collections import OrderedDict
 
 # --- Импортируем конфигурацию ---
 try:
     from config import API_TOKEN, OPENROUTER_API_KEY, YOOMONEY_PROVIDER_TOKEN, WEBHOOK_URL, ADMIN_PASSWORD, ADMIN_IDS
+    from config import TELEGRAM_API_URL, DB_PATH, ARCHIVE_DB_PATH
+    from config import LLM_MODELS, LLM_HEDGE, FOODS_PATH, LLM_DAILY_TOKENS_FREE, LLM_DAILY_TOKENS_SUBSCRIBER
+    from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_RATE_LIMIT, SLOW_CALLBACK_MS
+    from config import TELEGRAM_RATE_LIMIT, TELEGRAM_POOL_SIZE, BOT_WORKERS, WORKER_INDEX
+    from config import BACKUP_DIR, BACKUP_KEEP
 except ImportError:
     print("❌ Файл config.py не найден или не содержит всех необходимых переменных.")
     exit(1)
 
 # --- Настройка логирования ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Обработчики только кладут запись в очередь, пишет фоновый поток (utils/logging_setup.py)
+setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_RATE_LIMIT, LOG_FILE)
 logger = logging.getLogger(__name__)
 
 # --- Инициализация ---
-bot = Bot(token=API_TOKEN)
+# Несколько процессов (front.py): этот — обработчик WORKER_INDEX из WORKER_COUNT.
+# Нулевой (или единственный) процесс ведёт админку и фоновые задачи.
+WORKER_COUNT = BOT_WORKERS if WORKER_INDEX >= 0 else 1
+IS_PRIMARY = WORKER_INDEX <= 0
+
+# Одна сессия с пулом keep-alive соединений на все запросы к Bot API
+class KeepAliveSession(AiohttpSession):
+    """Сессия aiogram со своим TCPConnector: aiogram не пробрасывает его параметры,
+    а соединения держим дольше стандартных 15 с, чтобы между всплесками не открывать TLS заново."""
+
+    def __init__(self, limit, keepalive_timeout=75, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.client_session = None
+
+    async def create_session(self):
+        if self.client_session is None or self.client_session.closed:
+            connector = TCPConnector(ssl=ssl.create_default_context(cafile=certifi.where()), limit=self.limit,
+                                     ttl_dns_cache=3600, keepalive_timeout=self.keepalive_timeout)
+            self.client_session = ClientSession(connector=connector)
+        return self.client_session
+
+    async def close(self):
+        if self.client_session is not None and not self.client_session.closed:
+            await self.client_session.close()
+            # Даём SSL-соединениям закрыться, как это делает AiohttpSession
+            await asyncio.sleep(0.25)
+
+if TELEGRAM_API_URL:
+    # Свой Bot API сервер (локальный telegram-bot-api или заглушка из loadtest/)
+    telegram_session = KeepAliveSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL), limit=TELEGRAM_POOL_SIZE)
+else:
+    telegram_session = KeepAliveSession(limit=TELEGRAM_POOL_SIZE)
+# Все исходящие запросы проходят через планировщик с приоритетами (utils/send_queue.py);
+# лимит Telegram общий на бота, поэтому делится между процессами — и скорость, и запас
+# на всплеск (меньше одного токена ведро не выдаст ни одного разрешения)
+send_scheduler = SendScheduler(rate=TELEGRAM_RATE_LIMIT / WORKER_COUNT,
+                               burst=max(1, GLOBAL_BURST / WORKER_COUNT))
+telegram_session.middleware(SendQueueMiddleware(send_scheduler))
+bot = Bot(token=API_TOKEN, session=telegram_session)
 dp = Dispatcher()
 
-# --- OpenAI клиент ---
-client = OpenAI(
-    api_key=OPENROUTER_API_KEY,
-    base_url='https://openrouter.ai/api/v1/' # <-- Исправлено, слэш в конце важен
-)
-
-MODEL = "microsoft/wizardlm-2-8x22b"
+# --- Контекст логов: update_id, user_id и имя обработчика в каждой записи ---
+@dp.update.outer_middleware()
+async def update_log_context(handler, event, data):
+    user = data.get("event_from_user")
+    token = bind_log_context(update_id=event.update_id, user_id=user.id if user else None)
+    try:
+        return await handler(event, data)
+    finally:
+        log_context.reset(token)
+
+async def handler_log_context(handler, event, data):
+    handler_object = data.get("handler")
+    if handler_object is None:
+        return await handler(event, data)
+    token = bind_log_context(handler=handler_object.callback.__name__)
+    try:
+        return await handler(event, data)
+    finally:
+        log_context.reset(token)
+
+for observer in (dp.message, dp.callback_query):
+    observer.middleware(handler_log_context)
+
+# --- LLM: асинхронные клиенты OpenAI-совместимых API и выбор модели ---
+# Список моделей — LLM_MODELS в key.env; роутер берёт самую быструю исправную
+# и при медленном ответе дублирует запрос следующей (utils/llm_router.py)
+llm_router = LLMRouter.from_config(LLM_MODELS, OPENROUTER_API_KEY, hedge=LLM_HEDGE)
+
+# Сколько секунд пользователь готов ждать генерацию (включая запасные модели)
+TRAINING_LLM_DEADLINE = 60
+FOOD_LLM_DEADLINE = 45
+CHAT_LLM_DEADLINE = 30
+DIET_LLM_DEADLINE = 30
+
+def llm_error_text(error, what):
+    """Ответ пользователю, если генерация не удалась."""
+    if isinstance(error, LLMUnavailable):
+        minutes = max(1, round(error.retry_after / 60))
+        return f"⏳ Сервис генерации сейчас недоступен. Попробуй через {minutes} мин."
+    if isinstance(error, LLMDeadlineExceeded):
+        return f"⌛ Генерация {what} заняла слишком много времени. Попробуй ещё раз чуть позже."
+    if isinstance(error, LLMQuotaExceeded):
+        return "📊 Дневной лимит генераций исчерпан. Он обновится завтра."
+    return f"❌ Ошибка при генерации {what}. Попробуй позже."
 
 # --- Подключение к SQLite ---
-conn = sqlite3.connect('trainer_bot.db', check_same_thread=False)
+conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 cur = conn.cursor()
+# Для новой базы: освобождённые страницы (после архивации) можно вернуть ОС
+cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+# WAL: читатели (экспорт, админка) не блокируют запись из обработчиков бота
+cur.execute("PRAGMA journal_mode=WAL")
+
+def attach_archive(connection):
+    """Подключает архив старых тренировок как схему archive."""
+    connection.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+
+attach_archive(conn)
 
 # --- Создание/обновление таблиц ---
 cur.execute("""
@@ -74,7 +196,7 @@ CREATE TABLE IF NOT EXISTS weights (
     user_id INTEGER,
     weight REAL,
     date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
 );
 """)
 
@@ -85,7 +207,7 @@ CREATE TABLE IF NOT EXISTS trainings (
     content TEXT,
     date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status TEXT DEFAULT 'pending',  -- 'pending', 'completed', 'missed'
-    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
 );
 """)
 
@@ -106,7 +228,7 @@ CREATE TABLE IF NOT EXISTS progress (
     squat REAL,
     bench REAL,
     deadlift REAL,
-    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
 );
 """)
 
@@ -116,7 +238,7 @@ CREATE TABLE IF NOT EXISTS achievements (
     user_id INTEGER,
     name TEXT,
     date_achieved TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
 );
 """)
 
@@ -125,7 +247,7 @@ CREATE TABLE IF NOT EXISTS training_schedule (
     id INTEGER PRIMARY KEY,
     user_id INTEGER UNIQUE,
     schedule TEXT, -- JSON строка: {"days_per_week": 3, "days": ["Mon", "Wed", "Fri"]}
-    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
 );
 """)
 
@@ -134,9 +256,420 @@ CREATE TABLE IF NOT EXISTS subscriptions (
     id INTEGER PRIMARY KEY,
     user_id INTEGER UNIQUE,
     expires_at TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
 );
 """)
+
+# --- Миграция: ON DELETE CASCADE для зависимых таблиц ---
+# SQLite не умеет менять внешний ключ у существующей таблицы, поэтому старые
+# таблицы один раз пересобираются. Индексы и триггеры создаются ниже заново.
+CASCADE_TABLES = ["weights", "trainings", "progress", "achievements", "training_schedule", "subscriptions"]
+
+def migrate_cascade_foreign_keys():
+    for table in CASCADE_TABLES:
+        fks = cur.execute(f"PRAGMA foreign_key_list({table})").fetchall()
+        # (id, seq, table, from, to, on_update, on_delete, match)
+        if not fks or all(fk[6] == 'CASCADE' for fk in fks):
+            continue
+        sql = cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        new_sql = re.sub(r"^CREATE TABLE\s+\"?\w+\"?", f"CREATE TABLE {table}_new", sql)
+        new_sql = new_sql.replace("REFERENCES users (user_id)", "REFERENCES users (user_id) ON DELETE CASCADE")
+        logger.info(f"Миграция: пересобираем таблицу {table} с ON DELETE CASCADE")
+        cur.executescript(f"""
+            BEGIN;
+            {new_sql};
+            INSERT INTO {table}_new SELECT * FROM {table};
+            DROP TABLE {table};
+            ALTER TABLE {table}_new RENAME TO {table};
+            COMMIT;
+        """)
+
+migrate_cascade_foreign_keys()
+cur.execute("CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements (user_id)")
+
+# --- Архив текста старых тренировок ---
+# В основной базе у старых тренировок остаются дата и статус (archived = 1,
+# content = NULL), сам текст переезжает в archive.trainings_content.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS archive.trainings_content (
+    id INTEGER PRIMARY KEY,  -- = trainings.id
+    user_id INTEGER,
+    content TEXT
+);
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_trainings_content_user ON trainings_content (user_id)")
+if "archived" not in [col[1] for col in cur.execute("PRAGMA table_info(trainings)").fetchall()]:
+    cur.execute("ALTER TABLE trainings ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_trainings_hot_date ON trainings (date) WHERE archived = 0")
+
+# --- Сжатие текста тренировок ---
+# content хранится как BLOB: 2 байта id словаря + deflate с этим словарём
+# (см. utils/text_compression.py). Старые строки остаются TEXT, пока их не
+# пережмёт compress_stored_trainings(). Словарь № 0 встроен в код, обученные
+# словари лежат здесь и никогда не меняются — по id всегда можно распаковать.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS compression_dicts (
+    id INTEGER PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    samples INTEGER,
+    data BLOB NOT NULL
+);
+""")
+compression_dicts = {0: SEED_DICTIONARY}
+compression_dicts.update(cur.execute("SELECT id, data FROM compression_dicts").fetchall())
+
+# --- Упражнения из текста тренировок ---
+# Разбираются из ответа модели при сохранении тренировки (utils/training_parser.py):
+# объём, частота упражнений и недавние упражнения для следующего промпта
+# считаются по этой таблице, без распаковки и разбора старых текстов.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS training_exercises (
+    id INTEGER PRIMARY KEY,
+    training_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    section TEXT,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,  -- нижний регистр, «ё» -> «е», без пояснений в скобках
+    sets INTEGER,
+    reps INTEGER,
+    duration_sec INTEGER,
+    weight REAL,
+    note TEXT,
+    FOREIGN KEY (training_id) REFERENCES trainings (id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+);
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_training_exercises_training ON training_exercises (training_id)")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_training_exercises_user_name ON training_exercises (user_id, name_key)")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_training_exercises_user_training ON training_exercises (user_id, training_id)")
+if "exercises_parsed" not in [col[1] for col in cur.execute("PRAGMA table_info(trainings)").fetchall()]:
+    cur.execute("ALTER TABLE trainings ADD COLUMN exercises_parsed INTEGER NOT NULL DEFAULT 0")
+# Ещё не разобранные тренировки (после заполнения индекс пустой)
+cur.execute("CREATE INDEX IF NOT EXISTS idx_trainings_unparsed ON trainings (id) WHERE exercises_parsed = 0")
+
+# --- Недельные итоги тренировок для /report ---
+# Одна строка на пользователя и неделю (week_start — понедельник), счётчики
+# поддерживаются триггерами на trainings. Отчёт за год читает 52 строки по
+# первичному ключу вместо пересчёта всех тренировок.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS training_weekly (
+    user_id INTEGER,
+    week_start TEXT,  -- YYYY-MM-DD, понедельник
+    completed INTEGER NOT NULL DEFAULT 0,
+    missed INTEGER NOT NULL DEFAULT 0,
+    pending INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, week_start)
+) WITHOUT ROWID;
+""")
+
+cur.execute("CREATE INDEX IF NOT EXISTS idx_trainings_user_date ON trainings (user_id, date)")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_weights_user_date ON weights (user_id, date)")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_progress_user ON progress (user_id)")
+
+# date(X, 'weekday 0', '-6 days') — понедельник недели, в которую попадает X
+SQL_WEEK_OF_NEW = "date(NEW.date, 'weekday 0', '-6 days')"
+SQL_WEEK_OF_OLD = "date(OLD.date, 'weekday 0', '-6 days')"
+
+cur.executescript(f"""
+CREATE TRIGGER IF NOT EXISTS training_weekly_insert AFTER INSERT ON trainings
+BEGIN
+    INSERT INTO training_weekly (user_id, week_start, completed, missed, pending)
+    VALUES (NEW.user_id, {SQL_WEEK_OF_NEW},
+            NEW.status = 'completed', NEW.status = 'missed', NEW.status = 'pending')
+    ON CONFLICT(user_id, week_start) DO UPDATE SET
+        completed = completed + excluded.completed,
+        missed = missed + excluded.missed,
+        pending = pending + excluded.pending;
+END;
+
+CREATE TRIGGER IF NOT EXISTS training_weekly_delete AFTER DELETE ON trainings
+BEGIN
+    UPDATE training_weekly SET
+        completed = completed - (OLD.status = 'completed'),
+        missed = missed - (OLD.status = 'missed'),
+        pending = pending - (OLD.status = 'pending')
+    WHERE user_id = OLD.user_id AND week_start = {SQL_WEEK_OF_OLD};
+END;
+
+CREATE TRIGGER IF NOT EXISTS training_weekly_update AFTER UPDATE OF status, date, user_id ON trainings
+BEGIN
+    UPDATE training_weekly SET
+        completed = completed - (OLD.status = 'completed'),
+        missed = missed - (OLD.status = 'missed'),
+        pending = pending - (OLD.status = 'pending')
+    WHERE user_id = OLD.user_id AND week_start = {SQL_WEEK_OF_OLD};
+    INSERT INTO training_weekly (user_id, week_start, completed, missed, pending)
+    VALUES (NEW.user_id, {SQL_WEEK_OF_NEW},
+            NEW.status = 'completed', NEW.status = 'missed', NEW.status = 'pending')
+    ON CONFLICT(user_id, week_start) DO UPDATE SET
+        completed = completed + excluded.completed,
+        missed = missed + excluded.missed,
+        pending = pending + excluded.pending;
+END;
+""")
+
+# Первичное заполнение для уже существующей базы (один раз)
+cur.execute("""
+INSERT INTO training_weekly (user_id, week_start, completed, missed, pending)
+SELECT user_id, date(date, 'weekday 0', '-6 days'),
+       SUM(status = 'completed'), SUM(status = 'missed'), SUM(status = 'pending')
+FROM trainings
+WHERE NOT EXISTS (SELECT 1 FROM training_weekly)
+GROUP BY user_id, date(date, 'weekday 0', '-6 days')
+""")
+
+# --- Учёт вызовов LLM ---
+# Одна строка на вызов генерации: токены, задержка, модель. По этой таблице
+# считаются бюджеты max_tokens для каждой команды.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    user_id INTEGER,
+    command TEXT NOT NULL,  -- 'training', 'food', ...
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    max_tokens INTEGER,
+    finish_reason TEXT,
+    latency_ms INTEGER,
+    error TEXT  -- NULL — успешный вызов
+);
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_command ON llm_calls (command, id)")
+
+# Дневные итоги по пользователю и команде (день — местная дата), поддерживаются
+# триггером на llm_calls. По ним проверяются квоты и строится страница
+# расхода в админке — без чтения сырого журнала.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS llm_usage_daily (
+    day TEXT,  -- YYYY-MM-DD
+    user_id INTEGER,
+    command TEXT,
+    calls INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL DEFAULT 0,  -- сумма, среднее = latency_ms / calls
+    PRIMARY KEY (day, user_id, command)
+) WITHOUT ROWID;
+""")
+cur.execute("""
+CREATE TRIGGER IF NOT EXISTS llm_usage_daily_insert AFTER INSERT ON llm_calls
+BEGIN
+    INSERT INTO llm_usage_daily (day, user_id, command, calls, errors, prompt_tokens, completion_tokens, latency_ms)
+    VALUES (date(NEW.created_at, 'localtime'), COALESCE(NEW.user_id, 0), NEW.command, 1, NEW.error IS NOT NULL,
+            COALESCE(NEW.prompt_tokens, 0), COALESCE(NEW.completion_tokens, 0), COALESCE(NEW.latency_ms, 0))
+    ON CONFLICT(day, user_id, command) DO UPDATE SET
+        calls = calls + 1,
+        errors = errors + excluded.errors,
+        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+        completion_tokens = completion_tokens + excluded.completion_tokens,
+        latency_ms = latency_ms + excluded.latency_ms;
+END;
+""")
+# Первичное заполнение по уже записанным вызовам (один раз)
+cur.execute("""
+INSERT INTO llm_usage_daily (day, user_id, command, calls, errors, prompt_tokens, completion_tokens, latency_ms)
+SELECT date(created_at, 'localtime'), COALESCE(user_id, 0), command, COUNT(*), COUNT(error),
+       COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(latency_ms), 0)
+FROM llm_calls
+WHERE NOT EXISTS (SELECT 1 FROM llm_usage_daily)
+GROUP BY 1, 2, 3
+""")
+
+# Дневные лимиты токенов, заданные админкой отдельным пользователям
+cur.execute("""
+CREATE TABLE IF NOT EXISTS llm_quotas (
+    user_id INTEGER PRIMARY KEY,
+    daily_tokens INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+""")
+
+# --- Чат с ИИ-тренером ---
+# chat_messages — ещё не свёрнутые в выжимку сообщения (после свёртки удаляются),
+# chat_summaries — выжимка всего, что было раньше. Промпт = профиль + выжимка +
+# последние сообщения в пределах бюджета токенов, поэтому его размер не растёт
+# с длиной переписки.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,  -- 'user' / 'assistant'
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+);
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_user ON chat_messages (user_id, id)")
+cur.execute("""
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    user_id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+);
+""")
+
+# --- Периодический обход: пропущенные тренировки и окончание подписок ---
+# Ожидающие тренировки ищутся по частичному индексу: отмеченная как пропущенная
+# строка из него выпадает, поэтому каждая порция — короткий диапазон с начала индекса.
+cur.execute("CREATE INDEX IF NOT EXISTS idx_trainings_pending_date ON trainings (date) WHERE status = 'pending'")
+# Водяные знаки обхода: до какого момента события уже обработаны
+cur.execute("""
+CREATE TABLE IF NOT EXISTS sweeper_state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+""")
+
+# --- Состояние адаптивной сложности в users ---
+# training_window — исходы последних тренировок, новые первыми ('c'/'m'),
+# training_streak — выполнено подряд. Поддерживаются триггерами, поэтому их
+# обновляет любой, кто меняет статус: кнопка «Выполнил», отметка пропусков,
+# вставка уже завершённой тренировки. /training читает только строку users.
+user_columns = [col[1] for col in cur.execute("PRAGMA table_info(users)").fetchall()]
+if "training_window" not in user_columns:
+    cur.execute("ALTER TABLE users ADD COLUMN training_window TEXT")
+if "training_streak" not in user_columns:
+    cur.execute("ALTER TABLE users ADD COLUMN training_streak INTEGER NOT NULL DEFAULT 0")
+
+SQL_TRAINING_STATE_UPDATE = f"""
+    UPDATE users SET
+        training_window = substr(
+            CASE NEW.status WHEN 'completed' THEN 'c' ELSE 'm' END || COALESCE(training_window, ''),
+            1, {DIFFICULTY_WINDOW}),
+        training_streak = CASE NEW.status WHEN 'completed' THEN training_streak + 1 ELSE 0 END
+    WHERE user_id = NEW.user_id;
+"""
+
+cur.executescript(f"""
+CREATE TRIGGER IF NOT EXISTS training_state_insert AFTER INSERT ON trainings
+WHEN NEW.status IN ('completed', 'missed')
+BEGIN
+    {SQL_TRAINING_STATE_UPDATE}
+END;
+
+CREATE TRIGGER IF NOT EXISTS training_state_update AFTER UPDATE OF status ON trainings
+WHEN NEW.status IN ('completed', 'missed') AND NEW.status IS NOT OLD.status
+BEGIN
+    {SQL_TRAINING_STATE_UPDATE}
+END;
+""")
+
+# Первичное заполнение: для новых пользователей (окно ещё NULL) и для уже существующей базы
+cur.execute(f"""
+UPDATE users SET
+    training_window = COALESCE((
+        SELECT group_concat(outcome, '') FROM (
+            SELECT CASE status WHEN 'completed' THEN 'c' ELSE 'm' END AS outcome
+            FROM trainings t
+            WHERE t.user_id = users.user_id AND t.status IN ('completed', 'missed')
+            ORDER BY t.date DESC LIMIT {DIFFICULTY_WINDOW}
+        )
+    ), ''),
+    training_streak = (
+        SELECT COUNT(*) FROM trainings t
+        WHERE t.user_id = users.user_id AND t.status = 'completed'
+          AND t.date > COALESCE((
+              SELECT MAX(m.date) FROM trainings m WHERE m.user_id = users.user_id AND m.status = 'missed'
+          ), '')
+    )
+WHERE training_window IS NULL
+""")
+
+# --- Статистика для админки ---
+# Счётчики поддерживаются триггерами, поэтому главная страница админки читает
+# готовые числа, а не считает пользователей и подписчиков при каждом открытии.
+cur.execute("""
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name TEXT PRIMARY KEY,  -- 'users', 'active_subscribers'
+    value INTEGER NOT NULL DEFAULT 0
+);
+""")
+
+cur.execute("""
+CREATE TABLE IF NOT EXISTS stats_daily (
+    day TEXT PRIMARY KEY,  -- YYYY-MM-DD (локальное время)
+    users INTEGER DEFAULT 0,
+    active_subscribers INTEGER DEFAULT 0,
+    signups INTEGER DEFAULT 0,
+    trials_granted INTEGER DEFAULT 0,
+    expirations INTEGER DEFAULT 0
+);
+""")
+
+cur.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_expires_at ON subscriptions (expires_at)")
+# --- Поисковый индекс пользователей для админки (FTS5, rowid = user_id) ---
+cur.execute("""
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    name,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+""")
+# Первичное заполнение индекса для уже существующей базы
+cur.execute("""
+INSERT INTO users_fts (rowid, name)
+SELECT user_id, replace(replace(name, 'ё', 'е'), 'Ё', 'Е') FROM users
+WHERE NOT EXISTS (SELECT 1 FROM users_fts) AND name IS NOT NULL
+""")
+
+# Ключи keyset-пагинации списка пользователей в админке
+cur.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at, user_id)")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users (name, user_id)")
+
+# Текущее время в формате datetime.isoformat(), которым пишется expires_at
+SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+SQL_TODAY = "date('now', 'localtime')"
+
+cur.executescript(f"""
+CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+    INSERT INTO stats_daily (day, signups) VALUES ({SQL_TODAY}, 1)
+        ON CONFLICT(day) DO UPDATE SET signups = signups + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_trial_granted AFTER UPDATE OF trial_granted ON users
+WHEN NEW.trial_granted = 1 AND COALESCE(OLD.trial_granted, 0) = 0
+BEGIN
+    INSERT INTO stats_daily (day, trials_granted) VALUES ({SQL_TODAY}, 1)
+        ON CONFLICT(day) DO UPDATE SET trials_granted = trials_granted + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_subscriptions_insert AFTER INSERT ON subscriptions
+WHEN NEW.expires_at > {SQL_NOW}
+BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE name = 'active_subscribers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_subscriptions_update AFTER UPDATE OF expires_at ON subscriptions
+BEGIN
+    UPDATE stats_counters
+    SET value = value + (NEW.expires_at > {SQL_NOW}) - (OLD.expires_at > {SQL_NOW})
+    WHERE name = 'active_subscribers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_subscriptions_delete AFTER DELETE ON subscriptions
+WHEN OLD.expires_at > {SQL_NOW}
+BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE name = 'active_subscribers';
+END;
+""")
+
+# Первичное заполнение для уже существующей базы (один раз)
+cur.execute("INSERT OR IGNORE INTO stats_counters (name, value) SELECT 'users', COUNT(*) FROM users")
+cur.execute(f"INSERT OR IGNORE INTO stats_counters (name, value) SELECT 'active_subscribers', COUNT(*) FROM subscriptions WHERE expires_at > {SQL_NOW}")
 conn.commit()
 
 # --- Глобальные переменные ---
@@ -150,70 +683,954 @@ def is_admin(user_id):
     return user_id in ADMIN_IDS
 
 def get_user_count():
-    cur.execute("SELECT COUNT(*) FROM users")
-    return cur.fetchone()[0]
+    row = conn.execute("SELECT value FROM stats_counters WHERE name = 'users'").fetchone()
+    return row[0] if row else 0
 
 def get_subscribed_users():
     cur.execute("SELECT user_id FROM subscriptions WHERE expires_at > ?", (datetime.now().isoformat(),))
     return [row[0] for row in cur.fetchall()]
 
-def get_users_list():
-    cur.execute("""
-        SELECT u.user_id, u.name, u.created_at, s.expires_at
-        FROM users u
-        LEFT JOIN subscriptions s ON u.user_id = s.user_id
-        ORDER BY u.created_at DESC
-    """)
-    raw_users = cur.fetchall()
-    processed_users = []
-    now = datetime.now()
-    for user in raw_users:
-        user_id, name, created_at, expires_at = user
-        sub_status = "Нет подписки"
-        if expires_at:
-            expires_dt = datetime.fromisoformat(expires_at)
-            if expires_dt > now:
-                sub_status = f"Активна до: {expires_dt.strftime('%Y-%m-%d')}"
-            else:
-                sub_status = f"Просрочена (до: {expires_dt.strftime('%Y-%m-%d')})"
-        # Возвращаем кортеж с дополнительным элементом - статусом подписки
-        processed_users.append((user_id, name, created_at, sub_status))
-    return processed_users
+# --- Список пользователей для админки (keyset-пагинация) ---
+USERS_PAGE_SIZE = 50
+USERS_PAGE_MAX = 500
+USERS_SORT_COLUMNS = {"created": "u.created_at", "id": "u.user_id", "name": "u.name"}
+USERS_STATUS_FILTERS = {
+    "active": "s.expires_at > :now",
+    "expired": "s.expires_at <= :now",
+    "none": "s.user_id IS NULL",
+}
+
+def encode_page_cursor(sort_value, user_id):
+    raw = json.dumps([sort_value, user_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_page_cursor(cursor):
+    """Возвращает (значение сортировки, user_id); ValueError при битом курсоре."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, user_id = json.loads(raw)
+        return sort_value, int(user_id)
+    except Exception:
+        raise ValueError("Неверный курсор страницы")
+
+class UsersPage:
+    """Одна страница списка пользователей.
+
+    Страница листается по ключу (колонка сортировки, user_id), а не через OFFSET,
+    так что время ответа не зависит от номера страницы и общего числа
+    пользователей. Статус подписки считается в SQL. Строки отдаются
+    итератором прямо из курсора — шаблон можно рендерить потоком.
+    """
+
+    def __init__(self, status="all", sort="created", order="desc", after=None, limit=USERS_PAGE_SIZE):
+        if sort not in USERS_SORT_COLUMNS:
+            raise ValueError(f"Неизвестная сортировка: {sort}")
+        if status != "all" and status not in USERS_STATUS_FILTERS:
+            raise ValueError(f"Неизвестный статус: {status}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Неизвестный порядок: {order}")
+        self.status = status
+        self.sort = sort
+        self.order = order
+        self.after = decode_page_cursor(after) if after else None
+        self.limit = max(1, min(int(limit), USERS_PAGE_MAX))
+        self.has_more = False
+        self._last_key = None
+
+    def _query(self):
+        column = USERS_SORT_COLUMNS[self.sort]
+        direction = "DESC" if self.order == "desc" else "ASC"
+        params = {"now": datetime.now().isoformat(), "limit": self.limit + 1}
+        where = []
+        if self.status != "all":
+            where.append(USERS_STATUS_FILTERS[self.status])
+        if self.after:
+            where.append(f"({column}, u.user_id) {'<' if self.order == 'desc' else '>'} (:after_key, :after_id)")
+            params["after_key"], params["after_id"] = self.after
+        sql = f"""
+            SELECT u.user_id, u.name, u.created_at,
+                   CASE
+                       WHEN s.expires_at IS NULL THEN 'Нет подписки'
+                       WHEN s.expires_at > :now THEN 'Активна до: ' || substr(s.expires_at, 1, 10)
+                       ELSE 'Просрочена (до: ' || substr(s.expires_at, 1, 10) || ')'
+                   END AS sub_status,
+                   {column} AS sort_key
+            FROM users u
+            LEFT JOIN subscriptions s ON s.user_id = u.user_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {column} {direction}, u.user_id {direction}
+            LIMIT :limit
+        """
+        return sql, params
+
+    def __iter__(self):
+        sql, params = self._query()
+        for i, row in enumerate(conn.execute(sql, params)):
+            if i == self.limit:
+                self.has_more = True
+                break
+            self._last_key = (row[4], row[0])
+            yield row[:4]
+
+    @property
+    def next_cursor(self):
+        """Курсор следующей страницы; доступен после того, как строки прочитаны."""
+        if not self.has_more or self._last_key is None:
+            return None
+        return encode_page_cursor(*self._last_key)
+
+# --- Поиск пользователей для админки ---
+USER_SEARCH_LIMIT = 10
+USER_ID_MAX_DIGITS = 15
+
+def normalize_search_text(text):
+    # unicode61 не сводит «ё» к «е» — делаем это сами и в индексе, и в запросе
+    return (text or "").replace('ё', 'е').replace('Ё', 'Е')
+
+def _search_users_by_id_prefix(prefix, limit):
+    """Пользователи, чей ID начинается с prefix. Для каждой возможной длины ID
+    это диапазон по уникальному индексу user_id, а не LIKE по всей таблице."""
+    if prefix.startswith("0"):
+        # ID не начинаются с нуля; для «0…» диапазоны ниже пересекались бы
+        return []
+    results = []
+    base = int(prefix)
+    for extra in range(0, USER_ID_MAX_DIGITS - len(prefix) + 1):
+        scale = 10 ** extra
+        rows = conn.execute(
+            "SELECT user_id, name, created_at FROM users WHERE user_id BETWEEN ? AND ? ORDER BY user_id LIMIT ?",
+            (base * scale, (base + 1) * scale - 1, limit - len(results))
+        ).fetchall()
+        results.extend(rows)
+        if len(results) >= limit:
+            break
+    return results
+
+def search_users(query, limit=USER_SEARCH_LIMIT):
+    """Поиск по префиксу ID и по словам имени (FTS5, префиксный поиск).
+    Возвращает список (user_id, name, created_at)."""
+    query = (query or "").strip()
+    if not query:
+        return []
+    results = []
+    # isdigit() верно и для надстрочных цифр вроде «²», а int() их не примет
+    if query.isascii() and query.isdigit():
+        results = _search_users_by_id_prefix(query, limit)
+    terms = re.findall(r"\w+", normalize_search_text(query))
+    if terms and len(results) < limit:
+        match = " ".join(f'"{t}"*' for t in terms)
+        rows = conn.execute("""
+            SELECT u.user_id, u.name, u.created_at
+            FROM users_fts f
+            JOIN users u ON u.user_id = f.rowid
+            WHERE users_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ?
+        """, (match, limit)).fetchall()
+        seen = {r[0] for r in results}
+        results.extend(r for r in rows if r[0] not in seen)
+    return results[:limit]
+
+# --- Удаление пользователей (каскадом) и массовая чистка неактивных ---
+# Отдельное соединение с включёнными внешними ключами: каскадное удаление
+# работает только при PRAGMA foreign_keys=ON. На основном соединении ключи
+# не включаем — /weight, /subscribe и т.п. пишут данные и до анкеты, когда
+# строки в users ещё нет.
+maint_conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+maint_conn.execute("PRAGMA foreign_keys=ON")
+attach_archive(maint_conn)
+maint_lock = threading.Lock()
+
+PURGE_CHUNK_SIZE = 500
+PURGE_PAUSE_SECONDS = 0.05  # пауза между порциями, чтобы обработчики бота успевали писать
+PURGE_DEFAULT_INACTIVE_DAYS = 180
+
+purge_status = {"running": False}
+
+def delete_users_cascade(user_ids):
+    """Удаляет пользователей одной короткой транзакцией. Остальное — каскадом;
+    вручную только таблицы без внешнего ключа (поисковый индекс, недельные итоги,
+    архив тренировок, личные лимиты LLM)."""
+    if not user_ids:
+        return 0
+    placeholders = ", ".join("?" for _ in user_ids)
+    with maint_lock, maint_conn:
+        deleted = maint_conn.execute(f"DELETE FROM users WHERE user_id IN ({placeholders})", user_ids).rowcount
+        maint_conn.execute(f"DELETE FROM users_fts WHERE rowid IN ({placeholders})", user_ids)
+        maint_conn.execute(f"DELETE FROM training_weekly WHERE user_id IN ({placeholders})", user_ids)
+        maint_conn.execute(f"DELETE FROM archive.trainings_content WHERE user_id IN ({placeholders})", user_ids)
+        maint_conn.execute(f"DELETE FROM llm_quotas WHERE user_id IN ({placeholders})", user_ids)
+    return deleted
+
+# --- Архивация старых тренировок ---
+TRAININGS_ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_CHUNK_SIZE = 500
+ARCHIVE_PAUSE_SECONDS = 0.05
+
+def archive_old_trainings(older_than_days=TRAININGS_ARCHIVE_AFTER_DAYS):
+    """Переносит текст тренировок старше older_than_days в архив порциями.
+    Сначала текст пишется в архив, потом очищается в основной базе — если
+    процесс прервётся между шагами, повторный запуск просто перезапишет архив."""
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+    moved = 0
+    while True:
+        with maint_lock:
+            ids = [row[0] for row in maint_conn.execute(
+                "SELECT id FROM trainings WHERE archived = 0 AND date < ? ORDER BY date LIMIT ?",
+                (cutoff, ARCHIVE_CHUNK_SIZE)
+            ).fetchall()]
+            if not ids:
+                break
+            placeholders = ", ".join("?" for _ in ids)
+            with maint_conn:
+                maint_conn.execute(f"""
+                    INSERT OR REPLACE INTO archive.trainings_content (id, user_id, content)
+                    SELECT id, user_id, content FROM main.trainings WHERE id IN ({placeholders})
+                """, ids)
+            with maint_conn:
+                maint_conn.execute(f"UPDATE main.trainings SET content = NULL, archived = 1 WHERE id IN ({placeholders})", ids)
+        moved += len(ids)
+        time.sleep(ARCHIVE_PAUSE_SECONDS)
+    if moved:
+        with maint_lock:
+            # Возвращает ОС освободившиеся страницы (для баз с auto_vacuum=INCREMENTAL)
+            maint_conn.execute("PRAGMA main.incremental_vacuum")
+    logger.info(f"Архивация тренировок: перенесено {moved}")
+    return moved
+
+async def archive_old_trainings_job():
+    try:
+        await asyncio.to_thread(archive_old_trainings)
+    except Exception as e:
+        logger.error(f"Ошибка при архивации тренировок: {e}")
+
+# --- Резервные копии ---
+# Копия делается на отдельном соединении порциями страниц (utils/backup.py),
+# обработчики бота в это время пишут как обычно
+backup_status = {"running": False}
+
+def run_backup():
+    backup_status.update({
+        "running": True, "path": None, "error": None,
+        "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "finished_at": None,
+    })
+    try:
+        backup_status["path"] = create_backup(DB_PATH, ARCHIVE_DB_PATH, BACKUP_DIR, BACKUP_KEEP)
+    except BackupError as e:
+        logger.error(str(e))
+        backup_status["error"] = str(e)
+    finally:
+        backup_status["running"] = False
+        backup_status["finished_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def start_backup():
+    if backup_status.get("running"):
+        return False
+    backup_status["running"] = True
+    threading.Thread(target=run_backup, daemon=True).start()
+    return True
+
+async def backup_job():
+    if backup_status.get("running"):
+        return
+    backup_status["running"] = True
+    await asyncio.to_thread(run_backup)
+
+def get_training_content(training_id, user_id=None):
+    """Текст тренировки: из основной базы или, если она в архиве, из архива.
+    Если передан user_id — только тренировка этого пользователя."""
+    row = conn.execute("SELECT content, archived, user_id FROM trainings WHERE id = ?", (training_id,)).fetchone()
+    if not row or (user_id is not None and row[2] != user_id):
+        return None
+    if not row[1]:
+        return decode_training_content(row[0])
+    archived = conn.execute("SELECT content FROM archive.trainings_content WHERE id = ?", (training_id,)).fetchone()
+    return decode_training_content(archived[0]) if archived else None
+
+# --- Сжатие текста тренировок: чтение, запись, миграция ---
+DICT_TRAIN_MIN_SAMPLES = 50
+DICT_TRAIN_SAMPLES = 1000
+COMPRESS_CHUNK_SIZE = 500
+COMPRESS_PAUSE_SECONDS = 0.05
+
+def encode_training_content(text):
+    """Текст -> BLOB, сжатый последним обученным словарём."""
+    dict_id = max(compression_dicts)
+    return compress_text(text, dict_id, compression_dicts[dict_id])
+
+def decode_training_content(value):
+    """BLOB -> текст. TEXT (ещё не пережатые строки) и NULL возвращаются как есть."""
+    if not isinstance(value, bytes):
+        return value
+    dict_id = dictionary_id(value)
+    if dict_id not in compression_dicts:
+        # Словарь обучили в другом процессе (например, админка отдельно от бота)
+        row = conn.execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+        compression_dicts[dict_id] = row[0]
+    return decompress_text(value, compression_dicts[dict_id])
+
+def train_compression_dictionary():
+    """Обучает словарь на последних тренировках, если обученного ещё нет
+    и набралось достаточно текстов. Возвращает id словаря или None."""
+    if max(compression_dicts) > 0:
+        return None
+    # Сначала самые новые из основной базы; архива касаемся, только если их не хватило
+    with maint_lock:
+        rows = maint_conn.execute(
+            "SELECT content FROM trainings WHERE content IS NOT NULL ORDER BY id DESC LIMIT ?",
+            (DICT_TRAIN_SAMPLES,)
+        ).fetchall()
+        if len(rows) < DICT_TRAIN_SAMPLES:
+            rows += maint_conn.execute(
+                "SELECT content FROM archive.trainings_content WHERE content IS NOT NULL ORDER BY id DESC LIMIT ?",
+                (DICT_TRAIN_SAMPLES - len(rows),)
+            ).fetchall()
+    if len(rows) < DICT_TRAIN_MIN_SAMPLES:
+        return None
+    data = train_dictionary(decode_training_content(r[0]) for r in rows)
+    with maint_lock, maint_conn:
+        dict_id = maint_conn.execute(
+            "INSERT INTO compression_dicts (samples, data) VALUES (?, ?)", (len(rows), data)
+        ).lastrowid
+    compression_dicts[dict_id] = data
+    logger.info(f"Обучен словарь сжатия № {dict_id}: {len(data)} байт по {len(rows)} текстам")
+    return dict_id
+
+def compress_stored_trainings():
+    """Разовая миграция: обучает словарь и пережимает тренировки, которые ещё
+    хранятся текстом (и в основной базе, и в архиве). Порциями по id, между
+    порциями пауза; повторный запуск продолжает с непережатых строк."""
+    train_compression_dictionary()
+    compressed = 0
+    for table in ("main.trainings", "archive.trainings_content"):
+        last_id = 0
+        while True:
+            with maint_lock:
+                rows = maint_conn.execute(
+                    f"SELECT id, content FROM {table} WHERE id > ? AND typeof(content) = 'text' ORDER BY id LIMIT ?",
+                    (last_id, COMPRESS_CHUNK_SIZE)
+                ).fetchall()
+                if not rows:
+                    break
+                with maint_conn:
+                    maint_conn.executemany(
+                        f"UPDATE {table} SET content = ? WHERE id = ?",
+                        [(encode_training_content(content), row_id) for row_id, content in rows]
+                    )
+            compressed += len(rows)
+            last_id = rows[-1][0]
+            time.sleep(COMPRESS_PAUSE_SECONDS)
+    if compressed:
+        with maint_lock:
+            maint_conn.execute("PRAGMA main.incremental_vacuum")
+    logger.info(f"Сжатие тренировок: пережато {compressed}")
+    return compressed
+
+async def compress_stored_trainings_job():
+    try:
+        await asyncio.to_thread(compress_stored_trainings)
+    except Exception as e:
+        logger.error(f"Ошибка при сжатии тренировок: {e}")
+
+# --- Упражнения тренировок: запись, заполнение, статистика ---
+EXERCISE_COLUMNS = ["position", "section", "name", "name_key", "sets", "reps", "duration_sec", "weight", "note"]
+PARSE_CHUNK_SIZE = 200
+RECENT_EXERCISES_TRAININGS = 3
+RECENT_EXERCISES_LIMIT = 10
+
+def save_training_exercises(connection, training_id, user_id, text):
+    """Разбирает текст и пишет упражнения; вызывается внутри транзакции вставки тренировки."""
+    exercises = parse_training(text)
+    connection.executemany(
+        f"INSERT INTO training_exercises (training_id, user_id, {', '.join(EXERCISE_COLUMNS)}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in EXERCISE_COLUMNS)})",
+        [(training_id, user_id, *(e[c] for c in EXERCISE_COLUMNS)) for e in exercises]
+    )
+    connection.execute("UPDATE trainings SET exercises_parsed = 1 WHERE id = ?", (training_id,))
+    return len(exercises)
+
+def backfill_training_exercises():
+    """Разовое заполнение для тренировок, сохранённых до появления разбора.
+    Порциями по id; текст берётся из основной базы или из архива."""
+    parsed = 0
+    while True:
+        with maint_lock:
+            rows = maint_conn.execute("""
+                SELECT t.id, t.user_id, COALESCE(t.content, a.content)
+                FROM trainings t LEFT JOIN archive.trainings_content a ON a.id = t.id
+                WHERE t.exercises_parsed = 0
+                ORDER BY t.id LIMIT ?
+            """, (PARSE_CHUNK_SIZE,)).fetchall()
+            if not rows:
+                break
+            with maint_conn:
+                for training_id, user_id, content in rows:
+                    maint_conn.execute("DELETE FROM training_exercises WHERE training_id = ?", (training_id,))
+                    save_training_exercises(maint_conn, training_id, user_id, decode_training_content(content) or "")
+        parsed += len(rows)
+        time.sleep(COMPRESS_PAUSE_SECONDS)
+    logger.info(f"Разбор упражнений: обработано тренировок {parsed}")
+    return parsed
+
+async def backfill_training_exercises_job():
+    try:
+        await asyncio.to_thread(backfill_training_exercises)
+    except Exception as e:
+        logger.error(f"Ошибка при разборе упражнений: {e}")
+
+def get_exercise_stats(user_id, days=30, limit=10):
+    """Упражнения выполненных тренировок за days дней: сколько раз, подходы,
+    повторы и тоннаж (подходы × повторы × вес), самые частые первыми."""
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    return conn.execute("""
+        SELECT MIN(e.name), COUNT(*), SUM(e.sets), SUM(e.sets * e.reps),
+               SUM(e.sets * e.reps * e.weight), MAX(e.weight)
+        FROM trainings t JOIN training_exercises e ON e.training_id = t.id
+        WHERE t.user_id = ? AND t.date >= ? AND t.status = 'completed'
+        GROUP BY e.name_key
+        ORDER BY COUNT(*) DESC, SUM(e.sets) DESC
+        LIMIT ?
+    """, (user_id, since, limit)).fetchall()
+
+def get_recent_exercises(user_id, trainings=RECENT_EXERCISES_TRAININGS, limit=RECENT_EXERCISES_LIMIT):
+    """Упражнения последних тренировок для промпта: без повторов, у каждого —
+    самое свежее назначение. Читает только training_exercises (id тренировок растут со временем)."""
+    rows = conn.execute("""
+        SELECT name_key, name, sets, reps, duration_sec, weight
+        FROM training_exercises
+        WHERE user_id = ? AND training_id >= (
+            SELECT MIN(training_id) FROM (
+                SELECT DISTINCT training_id FROM training_exercises
+                WHERE user_id = ? ORDER BY training_id DESC LIMIT ?
+            )
+        )
+        ORDER BY training_id DESC, position
+    """, (user_id, user_id, trainings)).fetchall()
+    recent = {}
+    for name_key, *exercise in rows:
+        recent.setdefault(name_key, exercise)
+    return list(recent.values())[:limit]
+
+def format_exercise(name, sets, reps, duration_sec, weight):
+    amount = f"{reps}" if reps else (f"{duration_sec} с" if duration_sec else "")
+    text = f"{name} {sets}×{amount}" if sets and amount else name
+    return f"{text}, {weight:g} кг" if weight else text
+
+def find_inactive_users(after_user_id, cutoff, include_subscribed=False, limit=PURGE_CHUNK_SIZE):
+    """Следующая порция (по user_id) пользователей без активности с cutoff:
+    зарегистрированы раньше, нет тренировок, веса и замеров позже cutoff
+    и (если не include_subscribed) нет действующей подписки."""
+    cutoff_str = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+    sql = """
+        SELECT u.user_id FROM users u
+        WHERE u.user_id > :after AND u.created_at < :cutoff
+          AND NOT EXISTS (SELECT 1 FROM trainings t WHERE t.user_id = u.user_id AND t.date >= :cutoff)
+          AND NOT EXISTS (SELECT 1 FROM weights w WHERE w.user_id = u.user_id AND w.date >= :cutoff)
+          AND NOT EXISTS (SELECT 1 FROM progress p WHERE p.user_id = u.user_id AND p.date >= :cutoff)
+    """
+    if not include_subscribed:
+        sql += " AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = u.user_id AND s.expires_at > :now)"
+    sql += " ORDER BY u.user_id LIMIT :limit"
+    with maint_lock:
+        rows = maint_conn.execute(sql, {
+            "after": after_user_id, "cutoff": cutoff_str, "now": datetime.now().isoformat(), "limit": limit
+        }).fetchall()
+    return [row[0] for row in rows]
+
+def purge_inactive_users(inactive_days=PURGE_DEFAULT_INACTIVE_DAYS, include_subscribed=False, dry_run=False):
+    """Массовая чистка порциями. Прогресс пишется в purge_status для админки."""
+    cutoff = datetime.now() - timedelta(days=inactive_days)
+    purge_status.update({
+        "running": True, "dry_run": dry_run, "inactive_days": inactive_days,
+        "include_subscribed": include_subscribed, "found": 0, "deleted": 0,
+        "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "finished_at": None, "error": None,
+    })
+    try:
+        last_id = 0
+        while True:
+            user_ids = find_inactive_users(last_id, cutoff, include_subscribed)
+            if not user_ids:
+                break
+            purge_status["found"] += len(user_ids)
+            last_id = user_ids[-1]
+            if not dry_run:
+                purge_status["deleted"] += delete_users_cascade(user_ids)
+                for uid in user_ids:
+                    publish_invalidation(uid, forget=True)
+                time.sleep(PURGE_PAUSE_SECONDS)
+        logger.info(f"Чистка неактивных завершена: найдено {purge_status['found']}, удалено {purge_status['deleted']}")
+    except Exception as e:
+        logger.error(f"Ошибка при чистке неактивных пользователей: {e}")
+        purge_status["error"] = str(e)
+    finally:
+        purge_status["running"] = False
+        purge_status["finished_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def start_purge(**criteria):
+    if purge_status.get("running"):
+        return False
+    purge_status["running"] = True
+    threading.Thread(target=purge_inactive_users, kwargs=criteria, daemon=True).start()
+    return True
+
+# --- Чат с ИИ-тренером: окно истории и выжимка ---
+CHAT_WINDOW_TOKENS = 1200       # последние сообщения, которые идут в промпт дословно
+CHAT_SUMMARY_BATCH_TOKENS = 800  # сворачиваем, когда за окном накопилось столько
+CHAT_MAX_MESSAGES = 60          # предел чтения, даже если выжимка отстаёт
+CHAT_MAX_MESSAGE_CHARS = 2000
+
+chat_summarizing = set()  # user_id, для которых выжимка уже обновляется
+
+# Ссылки на фоновые задачи: цикл держит только слабые, без них задачу может
+# собрать сборщик мусора посреди работы
+background_tasks = set()
+
+def start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def add_chat_message(user_id, role, content):
+    with conn:
+        conn.execute(
+            "INSERT INTO chat_messages (user_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+            (user_id, role, content, estimate_tokens(content))
+        )
+
+def get_chat_summary(user_id):
+    row = conn.execute("SELECT summary FROM chat_summaries WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+def get_chat_window(user_id, budget=CHAT_WINDOW_TOKENS):
+    """Последние сообщения в пределах budget токенов, в хронологическом порядке."""
+    rows = conn.execute(
+        "SELECT role, content, tokens FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, CHAT_MAX_MESSAGES)
+    ).fetchall()
+    window = []
+    used = 0
+    for role, content, tokens in rows:
+        if window and used + tokens > budget:
+            break
+        window.append({"role": role, "content": content})
+        used += tokens
+    return window[::-1]
+
+def chat_messages_to_summarize(user_id):
+    """Старые сообщения за пределами окна, если их накопилось на порцию, иначе []."""
+    rows = conn.execute(
+        "SELECT id, role, content, tokens FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, CHAT_MAX_MESSAGES * 2)
+    ).fetchall()
+    used = 0
+    for i, (_, _, _, tokens) in enumerate(rows):
+        used += tokens
+        if used > CHAT_WINDOW_TOKENS:
+            older = rows[i:]
+            if sum(r[3] for r in older) >= CHAT_SUMMARY_BATCH_TOKENS:
+                return older[::-1]
+            break
+    return []
+
+async def update_chat_summary(user_id):
+    """Сворачивает вышедшие из окна сообщения в выжимку (фоном, после ответа)."""
+    if user_id in chat_summarizing:
+        return
+    chat_summarizing.add(user_id)
+    try:
+        older = chat_messages_to_summarize(user_id)
+        if not older:
+            return
+        transcript = "\n".join(
+            f"{'Пользователь' if role == 'user' else 'Тренер'}: {content}" for _, role, content, _ in older
+        )
+        prompt = CHAT_SUMMARY_TEMPLATE.format(summary=get_chat_summary(user_id) or "нет", messages=transcript)
+        summary, _ = await generate("chat_summary", user_id, prompt)
+        with conn:
+            conn.execute("""
+                INSERT INTO chat_summaries (user_id, summary, tokens, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    summary = excluded.summary, tokens = excluded.tokens, updated_at = excluded.updated_at
+            """, (user_id, summary, estimate_tokens(summary)))
+            conn.execute("DELETE FROM chat_messages WHERE user_id = ? AND id <= ?", (user_id, older[-1][0]))
+    except Exception as e:
+        # Не страшно: сообщения останутся и свернутся в следующий раз
+        logger.error(f"Ошибка при обновлении выжимки чата {user_id}: {e}")
+    finally:
+        chat_summarizing.discard(user_id)
+
+def reset_chat(user_id):
+    with conn:
+        conn.execute("DELETE FROM chat_messages WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM chat_summaries WHERE user_id = ?", (user_id,))
+
+# --- Очередь уведомлений ---
+# Уведомления из фоновых задач и рассылки не отправляются сразу, а кладутся
+# в очередь; один отправитель выбирает их по одному. Скорость и RetryAfter —
+# забота планировщика (utils/send_queue.py): у рассылок низший приоритет
+# и только часть общего лимита, поэтому ответы пользователям их обгоняют.
+# Очередь ограничена: при большой рассылке обход ждёт отправителя, а не копит
+# сотни тысяч сообщений в памяти.
+NOTIFY_QUEUE_SIZE = 10000
+
+notification_queue = None  # asyncio.Queue, создаётся в main()
+
+async def enqueue_notification(user_id, text):
+    if not owns_user(user_id):
+        # Отправит процесс-владелец пользователя: у каждого своя доля лимита
+        shard_bus.put(("notify", user_id, text))
+        return
+    await notification_queue.put((user_id, text))
+
+async def enqueue_broadcast(user_ids, text):
+    for user_id in user_ids:
+        await enqueue_notification(user_id, text)
+    logger.info(f"Рассылка: {len(user_ids)} сообщений поставлено в очередь")
+
+def publish_broadcast(user_ids, text):
+    """Рассылка из потока админки: при нескольких процессах фронт делит
+    получателей между владельцами, иначе — в свою очередь."""
+    if shard_bus is not None:
+        shard_bus.put(("broadcast", user_ids, text))
+    else:
+        asyncio.run_coroutine_threadsafe(enqueue_broadcast(user_ids, text), loop)
+
+# --- Несколько процессов: владение пользователями и обмен через фронт ---
+shard_bus = None  # multiprocessing.Queue к фронту (utils/sharding.py); None — процесс один
+worker_stop = None  # asyncio.Event, создаётся в main() обработчика
+user_update_tails = {}  # {user_id: future окончания последнего апдейта пользователя}
+
+def owns_user(user_id):
+    return shard_for(user_id, WORKER_COUNT) == max(WORKER_INDEX, 0)
+
+def invalidate_user(user_id):
+    """Сбрасывает кеши пользователя в этом процессе."""
+    subscription_cache.pop(user_id, None)
+
+def forget_user(user_id):
+    """Пользователь удалён: убираем и его состояние в памяти."""
+    invalidate_user(user_id)
+    user_states.pop(user_id, None)
+    progress_dashboard_cache.pop(user_id, None)
+
+def publish_invalidation(user_id, forget=False):
+    """Данные пользователя изменены: сбросить кеши у процесса-владельца."""
+    if owns_user(user_id):
+        (forget_user if forget else invalidate_user)(user_id)
+    else:
+        shard_bus.put(("forget" if forget else "invalidate", user_id))
+
+async def feed_update_ordered(update, user_id):
+    """Апдейты одного пользователя обрабатываются строго по очереди,
+    разных пользователей — параллельно."""
+    previous = user_update_tails.get(user_id)
+    done = asyncio.get_running_loop().create_future()
+    user_update_tails[user_id] = done
+    try:
+        if previous is not None:
+            await previous
+        await dp.feed_update(bot, update)
+    finally:
+        done.set_result(None)
+        if user_update_tails.get(user_id) is done:
+            del user_update_tails[user_id]
+
+async def feed_worker_update(raw):
+    error = None
+    try:
+        await feed_update_ordered(types.Update.model_validate(raw), update_user_id(raw))
+    except Exception as e:
+        error = str(e)
+        logger.error(f"Ошибка при обработке апдейта {raw.get('update_id')}: {e}")
+    finally:
+        shard_bus.put(("done", WORKER_INDEX, raw.get("update_id"), error))
+
+def handle_shard_message(message):
+    kind = message[0]
+    if kind == "invalidate":
+        invalidate_user(message[1])
+    elif kind == "forget":
+        forget_user(message[1])
+    elif kind == "notify":
+        start_background_task(enqueue_notification(message[1], message[2]))
+    elif kind == "broadcast":
+        start_background_task(enqueue_broadcast(message[1], message[2]))
+
+def inbox_reader(inbox):
+    """Поток обработчика: читает очередь от фронта и передаёт в цикл бота."""
+    while True:
+        message = inbox.get()
+        if message is None:
+            loop.call_soon_threadsafe(worker_stop.set)
+            return
+        if message[0] == "update":
+            asyncio.run_coroutine_threadsafe(feed_worker_update(json.loads(message[1])), loop)
+        else:
+            loop.call_soon_threadsafe(handle_shard_message, message)
+
+def run_worker(inbox, bus):
+    """Запуск процесса-обработчика (см. utils/sharding.py: worker_main)."""
+    global shard_bus
+    shard_bus = bus
+    asyncio.run(main(inbox=inbox))
+
+async def notification_sender():
+    bulk_sends()
+    while True:
+        user_id, text = await notification_queue.get()
+        try:
+            await bot.send_message(user_id, text)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или чат не найден — не повторяем
+            logger.info(f"Уведомление пользователю {user_id} не доставлено: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке уведомления {user_id}: {e}")
+        finally:
+            notification_queue.task_done()
+
+# --- Обход: пропущенные тренировки и подписки ---
+SWEEP_INTERVAL_MINUTES = 15
+SWEEP_CHUNK_SIZE = 1000
+SWEEP_PAUSE_SECONDS = 0.05
+TRAINING_MISSED_AFTER_HOURS = 48
+SUBSCRIPTION_REMIND_DAYS = 3
+
+MISSED_TRAINING_TEXT = "😔 Похоже, ты пропустил тренировку. Ничего страшного — получи новую: /training"
+EXPIRING_SOON_TEXT = "⏳ Твоя подписка закончится {date}. Продлить: /subscribe"
+EXPIRED_TEXT = "🔒 Твоя подписка закончилась. Оформить снова: /subscribe"
+
+def get_sweeper_mark(name, default):
+    row = conn.execute("SELECT value FROM sweeper_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else default
+
+def set_sweeper_mark(name, value):
+    with maint_lock, maint_conn:
+        maint_conn.execute(
+            "INSERT INTO sweeper_state (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value)
+        )
+
+def mark_missed_trainings_chunk(cutoff, limit=SWEEP_CHUNK_SIZE):
+    """Отмечает порцию просроченных ожидающих тренировок как пропущенные.
+    Возвращает user_id (с повторами, по одному на тренировку)."""
+    with maint_lock:
+        rows = maint_conn.execute(
+            "SELECT id, user_id FROM trainings WHERE status = 'pending' AND date < ? ORDER BY date LIMIT ?",
+            (cutoff, limit)
+        ).fetchall()
+        if rows:
+            placeholders = ", ".join("?" for _ in rows)
+            with maint_conn:
+                maint_conn.execute(
+                    f"UPDATE trainings SET status = 'missed' WHERE id IN ({placeholders})", [r[0] for r in rows]
+                )
+    return [r[1] for r in rows]
+
+def subscriptions_in_range_chunk(start, end, after=("", 0), limit=SWEEP_CHUNK_SIZE):
+    """Порция подписок с expires_at в (start, end], keyset по (expires_at, id)."""
+    return conn.execute("""
+        SELECT id, user_id, expires_at FROM subscriptions
+        WHERE expires_at > ? AND expires_at <= ? AND (expires_at, id) > (?, ?)
+        ORDER BY expires_at, id LIMIT ?
+    """, (start, end, after[0], after[1], limit)).fetchall()
+
+async def sweep_missed_trainings():
+    cutoff = (datetime.now() - timedelta(hours=TRAINING_MISSED_AFTER_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+    marked = 0
+    notified = set()  # одно напоминание на пользователя за обход, даже если пропусков несколько
+    while True:
+        user_ids = await asyncio.to_thread(mark_missed_trainings_chunk, cutoff)
+        if not user_ids:
+            break
+        marked += len(user_ids)
+        for user_id in dict.fromkeys(user_ids):
+            if user_id not in notified:
+                notified.add(user_id)
+                await enqueue_notification(user_id, MISSED_TRAINING_TEXT)
+        await asyncio.sleep(SWEEP_PAUSE_SECONDS)
+    return marked
+
+async def sweep_subscriptions(now):
+    """Напоминания о подписках, у которых с прошлого обхода наступил момент
+    «осталось SUBSCRIPTION_REMIND_DAYS дней» или которые закончились.
+    Каждая подписка попадает в окно один раз — без таблицы «кому уже отправили»."""
+    remind = timedelta(days=SUBSCRIPTION_REMIND_DAYS)
+    default_mark = (now - timedelta(minutes=SWEEP_INTERVAL_MINUTES)).isoformat()
+    last = datetime.fromisoformat(get_sweeper_mark("subscriptions", default_mark))
+    windows = [
+        ((last + remind).isoformat(), (now + remind).isoformat(), EXPIRING_SOON_TEXT),
+        (last.isoformat(), now.isoformat(), EXPIRED_TEXT),
+    ]
+    notified = 0
+    for start, end, text in windows:
+        after = ("", 0)
+        while True:
+            rows = await asyncio.to_thread(subscriptions_in_range_chunk, start, end, after)
+            if not rows:
+                break
+            for _, user_id, expires_at in rows:
+                date = datetime.fromisoformat(expires_at).strftime('%d.%m.%Y %H:%M')
+                await enqueue_notification(user_id, text.format(date=date))
+            notified += len(rows)
+            after = (rows[-1][2], rows[-1][0])
+            await asyncio.sleep(SWEEP_PAUSE_SECONDS)
+    await asyncio.to_thread(set_sweeper_mark, "subscriptions", now.isoformat())
+    return notified
+
+async def sweep_job():
+    try:
+        now = datetime.now()
+        missed = await sweep_missed_trainings()
+        notified = await sweep_subscriptions(now)
+        logger.info(f"Обход: отмечено пропущенных тренировок {missed}, напоминаний о подписке {notified}")
+    except Exception as e:
+        logger.error(f"Ошибка при обходе тренировок и подписок: {e}")
+
+# --- Экспорт данных для админки ---
+# Таблицы читаются порциями по первичному ключу через отдельное read-only
+# соединение: каждая порция — короткий самостоятельный запрос, поэтому экспорт
+# не держит блокировку и расход памяти не зависит от размера базы.
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_TABLES = {
+    "users": ["user_id", "name", "age", "gender", "height", "weight", "goal", "training_location", "level",
+              "last_training_date", "next_training_date", "reminder_time", "created_at", "trial_granted"],
+    "weights": ["user_id", "weight", "date"],
+    "progress": ["user_id", "date"] + list(PROGRESS_METRICS),
+    "trainings": ["user_id", "date", "status", "content"],
+    "training_exercises": ["user_id", "training_id"] + EXERCISE_COLUMNS,
+    "subscriptions": ["user_id", "expires_at"],
+    "chat_messages": ["user_id", "role", "content", "tokens", "created_at"],
+    "chat_summaries": ["user_id", "summary", "tokens", "updated_at"],
+}
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Таблицы, строки которых собираются не из одной таблицы: FROM-часть и выражения колонок
+EXPORT_SOURCES = {
+    "trainings": (
+        "trainings t LEFT JOIN archive.trainings_content a ON a.id = t.id",
+        {"content": "COALESCE(t.content, a.content)"},
+        "t",
+    ),
+}
+
+# Колонки, которые хранятся в базе не в том виде, в каком их отдаёт экспорт
+EXPORT_DECODERS = {
+    "trainings": {"content": decode_training_content},
+}
+
+def open_read_connection():
+    read_conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    read_conn.execute("ATTACH DATABASE ? AS archive", (f"file:{ARCHIVE_DB_PATH}?mode=ro",))
+    return read_conn
+
+def iter_table_rows(table, user_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Строки таблицы как dict, порциями по rowid (у таблиц с колонкой id это она же,
+    у chat_summaries — user_id). Открывает своё соединение."""
+    columns = EXPORT_TABLES[table]
+    source, expressions, alias = EXPORT_SOURCES.get(table, (table, {}, table))
+    select = ", ".join(expressions.get(c, f"{alias}.{c}") for c in columns)
+    read_conn = open_read_connection()
+    try:
+        last_id = 0
+        while True:
+            sql = f"SELECT {alias}.rowid, {select} FROM {source} WHERE {alias}.rowid > ?"
+            params = [last_id]
+            if user_id is not None:
+                sql += f" AND {alias}.user_id = ?"
+                params.append(user_id)
+            rows = read_conn.execute(sql + f" ORDER BY {alias}.rowid LIMIT ?", params + [chunk_size]).fetchall()
+            if not rows:
+                break
+            decoders = EXPORT_DECODERS.get(table, {})
+            for row in rows:
+                item = dict(zip(columns, row[1:]))
+                for column, decode in decoders.items():
+                    item[column] = decode(item[column])
+                yield item
+            last_id = rows[-1][0]
+    finally:
+        read_conn.close()
+
+def stream_ndjson(rows):
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(buffer) >= EXPORT_CHUNK_SIZE:
+            yield "\n".join(buffer) + "\n"
+            buffer = []
+    if buffer:
+        yield "\n".join(buffer) + "\n"
+
+def stream_csv(rows, columns):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([row[c] for c in columns])
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+def iter_user_export(user_id):
+    """Все данные одного пользователя (запрос на выгрузку своих данных)."""
+    for table in EXPORT_TABLES:
+        for row in iter_table_rows(table, user_id=user_id):
+            yield {"table": table, **row}
 
 def get_user_by_id(user_id):
     cur.execute("SELECT user_id, name FROM users WHERE user_id = ?", (user_id,))
     return cur.fetchone()
 
 def delete_user_from_db(user_id):
-    # Удаляем зависимости
-    cur.execute("DELETE FROM weights WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM trainings WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM progress WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM achievements WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM training_schedule WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
-    # Удаляем самого пользователя
-    cur.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-    conn.commit()
+    # Зависимые таблицы чистятся каскадом (ON DELETE CASCADE)
+    delete_users_cascade([user_id])
+    publish_invalidation(user_id, forget=True)
     logger.info(f"Пользователь {user_id} удалён из базы данных.")
 
 def save_user_profile(user_id, profile):
+    # UPSERT вместо INSERT OR REPLACE: повторная анкета не сбрасывает created_at,
+    # trial_granted и прочие поля, которых нет в анкете
     cur.execute("""
-        INSERT OR REPLACE INTO users (user_id, name, age, gender, height, weight, goal, training_location, level)
+        INSERT INTO users (user_id, name, age, gender, height, weight, goal, training_location, level)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            name = excluded.name, age = excluded.age, gender = excluded.gender, height = excluded.height,
+            weight = excluded.weight, goal = excluded.goal, training_location = excluded.training_location,
+            level = excluded.level
     """, (user_id, profile['name'], profile['age'], profile['gender'], profile['height'], profile['weight'], profile['goal'], profile.get('training_location', ''), profile.get('level', '')))
+    # Поисковый индекс для админки
+    cur.execute("DELETE FROM users_fts WHERE rowid = ?", (user_id,))
+    cur.execute("INSERT INTO users_fts (rowid, name) VALUES (?, ?)", (user_id, normalize_search_text(profile['name'])))
     conn.commit()
 
 def save_weight(user_id, weight):
     cur.execute("INSERT INTO weights (user_id, weight) VALUES (?, ?)", (user_id, weight))
     conn.commit()
 
-def get_weights(user_id):
-    cur.execute("SELECT weight, date FROM weights WHERE user_id = ? ORDER BY date", (user_id,))
+def get_weights(user_id, limit=None, since=None):
+    """История веса по возрастанию даты. limit — только последние N записей,
+    since (datetime) — только записи не старше этой даты. Оба фильтра в SQL."""
+    sql = "SELECT weight, date FROM weights WHERE user_id = ?"
+    params = [user_id]
+    if since is not None:
+        sql += " AND date >= ?"
+        params.append(since.strftime('%Y-%m-%d %H:%M:%S'))
+    if limit is not None:
+        # Последние N записей по индексу (user_id, date), затем разворачиваем
+        cur.execute(sql + " ORDER BY date DESC LIMIT ?", params + [limit])
+        return cur.fetchall()[::-1]
+    cur.execute(sql + " ORDER BY date", params)
     return cur.fetchall()
 
 def get_user_profile(user_id):
-    cur.execute("SELECT name, age, gender, height, weight, goal, training_location, level, next_training_date, reminder_time FROM users WHERE user_id = ?", (user_id,))
+    cur.execute("""
+        SELECT name, age, gender, height, weight, goal, training_location, level, next_training_date, reminder_time,
+               training_window, training_streak
+        FROM users WHERE user_id = ?
+    """, (user_id,))
     row = cur.fetchone()
     if row:
         return {
@@ -226,37 +1643,52 @@ def get_user_profile(user_id):
             "training_location": row[6],
             "level": row[7],
             "next_training_date": row[8],
-            "reminder_time": row[9]
+            "reminder_time": row[9],
+            "training_window": row[10] or "",
+            "training_streak": row[11] or 0
         }
     return None
 
+# Срок подписки проверяется на каждую платную команду. Пользователь всегда
+# обслуживается одним процессом, поэтому кеш локальный; изменения из других
+# мест (админка, платёж) сбрасывают его через publish_invalidation
+SUBSCRIPTION_CACHE_SIZE = 100000
+subscription_cache = {}  # {user_id: datetime окончания или None}
+
 def is_subscribed(user_id):
-    cur.execute("SELECT expires_at FROM subscriptions WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    if row:
-        expires_at = datetime.fromisoformat(row[0])
-        return datetime.now() < expires_at
-    return False
+    if user_id not in subscription_cache:
+        cur.execute("SELECT expires_at FROM subscriptions WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+        if len(subscription_cache) >= SUBSCRIPTION_CACHE_SIZE:
+            subscription_cache.clear()
+        subscription_cache[user_id] = datetime.fromisoformat(row[0]) if row else None
+    expires_at = subscription_cache[user_id]
+    return expires_at is not None and datetime.now() < expires_at
 
 def add_subscription(user_id, months=1):
     expires_at = datetime.now() + timedelta(days=30 * months)
     cur.execute("""
-        INSERT OR REPLACE INTO subscriptions (user_id, expires_at)
+        INSERT INTO subscriptions (user_id, expires_at)
         VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET expires_at = excluded.expires_at
     """, (user_id, expires_at.isoformat()))
     conn.commit()
+    publish_invalidation(user_id)
 
 def grant_subscription(user_id, days=7):
     expires_at = datetime.now() + timedelta(days=days)
     cur.execute("""
-        INSERT OR REPLACE INTO subscriptions (user_id, expires_at)
+        INSERT INTO subscriptions (user_id, expires_at)
         VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET expires_at = excluded.expires_at
     """, (user_id, expires_at.isoformat()))
     conn.commit()
+    publish_invalidation(user_id)
 
 def revoke_subscription(user_id):
     cur.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
     conn.commit()
+    publish_invalidation(user_id)
 
 def has_trial_granted(user_id):
     cur.execute("SELECT trial_granted FROM users WHERE user_id = ?", (user_id,))
@@ -269,6 +1701,214 @@ def mark_trial_granted(user_id):
     cur.execute("UPDATE users SET trial_granted = 1 WHERE user_id = ?", (user_id,))
     conn.commit()
 
+# --- Статистика для админки ---
+STATS_REFRESH_MINUTES = 10
+STATS_HISTORY_DAYS = 30
+
+def refresh_stats():
+    """Сверяет счётчик активных подписчиков (подписки истекают сами, без записи
+    в БД) и обновляет снимок за сегодня. Оба запроса — диапазоны по индексу
+    idx_subscriptions_expires_at."""
+    now = datetime.now()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    active = conn.execute("SELECT COUNT(*) FROM subscriptions WHERE expires_at > ?", (now.isoformat(),)).fetchone()[0]
+    expired_today = conn.execute(
+        "SELECT COUNT(*) FROM subscriptions WHERE expires_at > ? AND expires_at <= ?",
+        (day_start.isoformat(), now.isoformat())
+    ).fetchone()[0]
+    with conn:
+        conn.execute("UPDATE stats_counters SET value = ? WHERE name = 'active_subscribers'", (active,))
+        conn.execute("""
+            INSERT INTO stats_daily (day, users, active_subscribers, expirations)
+            VALUES (?, (SELECT value FROM stats_counters WHERE name = 'users'), ?, ?)
+            ON CONFLICT(day) DO UPDATE SET
+                users = excluded.users,
+                active_subscribers = excluded.active_subscribers,
+                expirations = excluded.expirations
+        """, (now.strftime('%Y-%m-%d'), active, expired_today))
+
+# --- Бюджет токенов и учёт вызовов LLM ---
+# max_tokens для команды — p95 длины недавних ответов с запасом, в пределах
+# [min, max]. Пока статистики мало — значение по умолчанию. Если ответ обрезан
+# по длине, бюджет сразу увеличивается, не дожидаясь пересчёта.
+LLM_COMMANDS = {
+    # команда -> (системный промпт, срок в секундах, бюджет по умолчанию, минимум, максимум)
+    "training": (TRAINING_SYSTEM, TRAINING_LLM_DEADLINE, 1500, 400, 3000),
+    "food": (FOOD_SYSTEM, FOOD_LLM_DEADLINE, 1200, 300, 3000),
+    "chat": (CHAT_SYSTEM, CHAT_LLM_DEADLINE, 500, 200, 1000),
+    "chat_summary": (CHAT_SUMMARY_SYSTEM, CHAT_LLM_DEADLINE, 300, 200, 500),
+    "diet": (DIET_SYSTEM, DIET_LLM_DEADLINE, 500, 200, 1000),
+}
+TOKEN_BUDGET_SAMPLES = 200
+TOKEN_BUDGET_MIN_SAMPLES = 20
+TOKEN_BUDGET_HEADROOM = 1.25
+TOKEN_BUDGET_BUMP = 1.5
+TOKEN_BUDGET_REFRESH_MINUTES = 10
+
+token_budgets = {command: spec[2] for command, spec in LLM_COMMANDS.items()}
+
+def refresh_token_budgets():
+    for command, (_, _, default, low, high) in LLM_COMMANDS.items():
+        rows = conn.execute("""
+            SELECT completion_tokens FROM llm_calls
+            WHERE command = ? AND error IS NULL AND completion_tokens IS NOT NULL
+            ORDER BY id DESC LIMIT ?
+        """, (command, TOKEN_BUDGET_SAMPLES)).fetchall()
+        if len(rows) < TOKEN_BUDGET_MIN_SAMPLES:
+            token_budgets[command] = default
+            continue
+        p95 = float(np.percentile([r[0] for r in rows], 95))
+        token_budgets[command] = int(min(high, max(low, p95 * TOKEN_BUDGET_HEADROOM)))
+
+async def refresh_token_budgets_job():
+    try:
+        refresh_token_budgets()
+    except Exception as e:
+        logger.error(f"Ошибка при пересчёте бюджетов токенов: {e}")
+
+def record_llm_call(user_id, command, model, max_tokens, latency, completion=None, error=None):
+    usage = getattr(completion, "usage", None)
+    finish_reason = completion.choices[0].finish_reason if completion else None
+    with conn:
+        conn.execute("""
+            INSERT INTO llm_calls (user_id, command, model, prompt_tokens, completion_tokens, max_tokens,
+                                   finish_reason, latency_ms, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, command, model, usage.prompt_tokens if usage else None,
+              usage.completion_tokens if usage else None, max_tokens, finish_reason,
+              int(latency * 1000), None if error is None else type(error).__name__))
+
+# --- Квоты токенов ---
+# Лимит на пользователя в день: из llm_quotas, иначе по тарифу. Расход берётся
+# из llm_usage_daily (одна-две строки по первичному ключу), так что проверка
+# перед каждой генерацией дешёвая. Вызов, начатый до исчерпания, досчитывается
+# целиком — лимит может быть превышен не больше чем на один ответ.
+LLM_QUOTA_TIERS = {"free": LLM_DAILY_TOKENS_FREE, "subscriber": LLM_DAILY_TOKENS_SUBSCRIBER}
+# Служебные вызовы (выжимка чата) учитываются, но не блокируются
+LLM_QUOTA_EXEMPT = {"chat_summary"}
+
+class LLMQuotaExceeded(Exception):
+    def __init__(self, used, quota):
+        super().__init__(f"Дневной лимит токенов исчерпан: {used} из {quota}")
+        self.used = used
+        self.quota = quota
+
+class LLMEmptyAnswer(Exception):
+    """Модель ответила без текста (отказ или пустой ответ); вызов уже учтён."""
+
+def get_llm_quota(user_id):
+    row = conn.execute("SELECT daily_tokens FROM llm_quotas WHERE user_id = ?", (user_id,)).fetchone()
+    if row:
+        return row[0]
+    return LLM_QUOTA_TIERS["subscriber" if is_subscribed(user_id) else "free"]
+
+def get_llm_usage_today(user_id):
+    row = conn.execute("""
+        SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM llm_usage_daily
+        WHERE day = date('now', 'localtime') AND user_id = ?
+    """, (user_id,)).fetchone()
+    return row[0]
+
+def check_llm_quota(command, user_id):
+    if command in LLM_QUOTA_EXEMPT:
+        return
+    quota = get_llm_quota(user_id)
+    used = get_llm_usage_today(user_id)
+    if used >= quota:
+        logger.warning(f"Пользователь {user_id}: дневной лимит токенов исчерпан ({used} из {quota}), /{command} отклонена")
+        raise LLMQuotaExceeded(used, quota)
+
+def set_llm_quota(user_id, daily_tokens):
+    """daily_tokens=None — вернуть лимит по тарифу."""
+    with conn:
+        if daily_tokens is None:
+            conn.execute("DELETE FROM llm_quotas WHERE user_id = ?", (user_id,))
+        else:
+            conn.execute("""
+                INSERT INTO llm_quotas (user_id, daily_tokens) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET daily_tokens = excluded.daily_tokens, updated_at = CURRENT_TIMESTAMP
+            """, (user_id, daily_tokens))
+
+# Сырой журнал вызовов нужен для бюджетов max_tokens и разбора инцидентов;
+# дневные итоги остаются и после чистки
+LLM_CALLS_KEEP_DAYS = 90
+LLM_CALLS_PRUNE_CHUNK = 1000
+
+def prune_llm_calls(older_than_days=LLM_CALLS_KEEP_DAYS):
+    deleted = 0
+    while True:
+        with maint_lock, maint_conn:
+            # created_at — CURRENT_TIMESTAMP (UTC), поэтому и срок считаем в SQLite
+            count = maint_conn.execute("""
+                DELETE FROM llm_calls WHERE id IN (
+                    SELECT id FROM llm_calls WHERE created_at < datetime('now', ?) ORDER BY id LIMIT ?)
+            """, (f"-{older_than_days} days", LLM_CALLS_PRUNE_CHUNK)).rowcount
+        deleted += count
+        if count < LLM_CALLS_PRUNE_CHUNK:
+            break
+        time.sleep(PURGE_PAUSE_SECONDS)
+    logger.info(f"Журнал вызовов LLM: удалено записей старше {older_than_days} дн.: {deleted}")
+    return deleted
+
+async def prune_llm_calls_job():
+    try:
+        await asyncio.to_thread(prune_llm_calls)
+    except Exception as e:
+        logger.error(f"Ошибка при чистке журнала вызовов LLM: {e}")
+
+async def generate(command, user_id, user_prompt, context=()):
+    """Генерация для команды: квота, бюджет токенов, срок, учёт вызова. context —
+    сообщения между системным промптом и user_prompt (например, история чата).
+    Возвращает (текст, endpoint); ошибки роутера, LLMQuotaExceeded и LLMEmptyAnswer пробрасываются."""
+    check_llm_quota(command, user_id)
+    system, deadline, _, _, high = LLM_COMMANDS[command]
+    max_tokens = token_budgets[command]
+    start = time.monotonic()
+    try:
+        completion, endpoint = await llm_router.complete(
+            deadline=deadline,
+            messages=[
+                {"role": "system", "content": system},
+                *context,
+                {"role": "user", "content": user_prompt},
+            ],
+            max_tokens=max_tokens,
+            temperature=0.7,
+        )
+    except Exception as e:
+        record_llm_call(user_id, command, None, max_tokens, time.monotonic() - start, error=e)
+        raise
+    record_llm_call(user_id, command, endpoint.model, max_tokens, time.monotonic() - start, completion)
+    if completion.choices[0].finish_reason == "length":
+        token_budgets[command] = int(min(high, max_tokens * TOKEN_BUDGET_BUMP))
+        logger.warning(f"Ответ для /{command} обрезан на {max_tokens} токенах, бюджет -> {token_budgets[command]}")
+    content = completion.choices[0].message.content
+    if not content or not content.strip():
+        raise LLMEmptyAnswer(f"Модель {endpoint.name} вернула пустой ответ для /{command}")
+    return content, endpoint
+
+async def refresh_stats_job():
+    try:
+        refresh_stats()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении статистики: {e}")
+
+def get_dashboard_stats(days=STATS_HISTORY_DAYS):
+    counters = dict(conn.execute("SELECT name, value FROM stats_counters").fetchall())
+    history = conn.execute("""
+        SELECT day, users, active_subscribers, signups, trials_granted, expirations
+        FROM stats_daily ORDER BY day DESC LIMIT ?
+    """, (days,)).fetchall()
+    today = history[0] if history and history[0][0] == datetime.now().strftime('%Y-%m-%d') else None
+    return {
+        "user_count": counters.get('users', 0),
+        "sub_count": counters.get('active_subscribers', 0),
+        "signups_today": today[3] if today else 0,
+        "trials_today": today[4] if today else 0,
+        "expirations_today": today[5] if today else 0,
+        "history": history,
+    }
+
 def add_message_id(user_id, msg_id):
     if user_id not in user_states:
         user_states[user_id] = {"messages": []}
@@ -286,6 +1926,63 @@ async def delete_old_messages(user_id, keep_last=3):
                 except Exception:
                     pass  # Сообщение уже удалено или не может быть удалено
 
+# --- Отчёты по тренировкам ---
+REPORT_MAX_WEEKS = 104
+REPORT_MAX_WEEK_LINES = 12
+
+def get_recent_training_counts(user_id, days=7):
+    """Все статусы за последние days дней одним сгруппированным запросом."""
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    cur.execute("""
+        SELECT status, COUNT(*) FROM trainings
+        WHERE user_id = ? AND date >= ?
+        GROUP BY status
+    """, (user_id, since))
+    counts = {"completed": 0, "missed": 0, "pending": 0}
+    counts.update(dict(cur.fetchall()))
+    return counts
+
+def get_weekly_report(user_id, weeks):
+    """Итоги по неделям из training_weekly: список (week_start, completed, missed, pending)
+    за последние weeks календарных недель, включая текущую, от новых к старым."""
+    monday = (datetime.now() - timedelta(days=datetime.now().weekday())).date()
+    first_week = monday - timedelta(weeks=weeks - 1)
+    cur.execute("""
+        SELECT week_start, completed, missed, pending FROM training_weekly
+        WHERE user_id = ? AND week_start >= ?
+        ORDER BY week_start DESC
+    """, (user_id, first_week.isoformat()))
+    by_week = {row[0]: row[1:] for row in cur.fetchall()}
+    result = []
+    for i in range(weeks):
+        week = (monday - timedelta(weeks=i)).isoformat()
+        result.append((week,) + tuple(by_week.get(week, (0, 0, 0))))
+    return result
+
+def format_weekly_report(rows, weeks):
+    completed = sum(r[1] for r in rows)
+    missed = sum(r[2] for r in rows)
+    done_or_missed = completed + missed
+    rate = f"{completed * 100 // done_or_missed}%" if done_or_missed else "—"
+    active_weeks = sum(1 for r in rows if r[1] > 0)
+    lines = [
+        f"📊 Отчёт за {weeks} нед.:",
+        f"- Выполнено тренировок: {completed}",
+        f"- Пропущено тренировок: {missed}",
+        f"- Выполнение: {rate}",
+        f"- Недель с тренировками: {active_weeks} из {weeks}",
+    ]
+    shown = rows[:REPORT_MAX_WEEK_LINES]
+    if shown:
+        lines.append("")
+        lines.append("По неделям (с понедельника):")
+        for week, week_completed, week_missed, _ in shown:
+            bar = "▇" * min(week_completed, 7)
+            lines.append(f"{week}: ✅ {week_completed} ❌ {week_missed} {bar}")
+        if len(rows) > len(shown):
+            lines.append(f"… и ещё {len(rows) - len(shown)} нед.")
+    return "\n".join(lines)
+
 # --- Функция проверки достижений ---
 def check_achievements(user_id):
     # "Первая тренировка"
@@ -433,58 +2130,25 @@ async def send_training(message: types.Message):
         return
 
     # --- Адаптивные тренировки ---
-    # Берём историю тренировок
-    cur.execute("""
-        SELECT status FROM trainings
-        WHERE user_id = ? ORDER BY date DESC LIMIT 5
-    """, (user_id,))
-    recent_trainings = cur.fetchall()
-    recent_statuses = [t[0] for t in recent_trainings]
+    # Окно исходов и серия хранятся в users (поддерживаются триггерами)
+    difficulty = compute_difficulty(user['training_window'], user['training_streak'], user['level'])
 
-    # Определим сложность
-    completed_count = recent_statuses.count('completed')
-    if completed_count < 3:
-        difficulty = "лёгкие и простые упражнения"
-    else:
-        difficulty = "средние или сложные упражнения"
+    # Недавние упражнения — короткой строкой вместо целых прошлых текстов
+    recent_exercises = "; ".join(format_exercise(*e) for e in get_recent_exercises(user_id)) or "нет"
 
     try:
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": f"""
-Ты — персональный фитнес-тренер. Составь **индивидуальную тренировку на один день** для пользователя:
-
-- Имя: {user['name']}
-- Пол: {user['gender']}
-- Возраст: {user['age']} лет
-- Рост: {user['height']} см
-- Вес: {user['weight']} кг
-- Цель: {user['goal']}
-- Место тренировки: {user['training_location'] or 'не указано'}
-- Уровень: {user['level'] or 'не указан'}
-- Сложность: {difficulty}
-
-Тренировка должна быть **безопасной**, **эффективной**, **сбалансированной** и **подходящей для указанного пола и возраста**.
-
-Формат ответа:
-- Упражнение: [название]
-- Подходы: [число]
-- Повторы: [число]
-- Вес: [рекомендуемый вес в кг, если нужно]
-- Примечание: [если нужно]
-
-Пиши на **русском языке**.
-"""},  # Новый промт
-                {"role": "user", "content": "Создай тренировку."}
-            ],
-            max_tokens=3000,  # Увеличено
-            temperature=0.7
-        )
-        training = completion.choices[0].message.content
-
-        # Сохраняем тренировку в базу
-        cur.execute("INSERT INTO trainings (user_id, content) VALUES (?, ?)", (user_id, training))
+        training, endpoint = await generate("training", user_id, TRAINING_USER_TEMPLATE.format(
+            **profile_values(user),
+            difficulty=difficulty.description,
+            difficulty_level=difficulty.level,
+            progression=difficulty.progression_text,
+            recent_exercises=recent_exercises,
+        ))
+        logger.info(f"Тренировка для {user_id} сгенерирована моделью {endpoint.name}")
+
+        # Сохраняем тренировку в базу вместе с разобранными упражнениями
+        cur.execute("INSERT INTO trainings (user_id, content) VALUES (?, ?)", (user_id, encode_training_content(training)))
+        save_training_exercises(conn, cur.lastrowid, user_id, training)
         conn.commit()
 
         # Отправляем тренировку с кнопками
@@ -503,7 +2167,7 @@ async def send_training(message: types.Message):
 
     except Exception as e:
         logger.error(f"Ошибка при генерации тренировки: {e}")
-        msg = await message.answer(f"❌ Ошибка при генерации тренировки. Попробуй позже.")
+        msg = await message.answer(llm_error_text(e, "тренировки"))
         add_message_id(user_id, msg.message_id)
 
 @dp.message(Command("food"))
@@ -522,50 +2186,109 @@ async def send_food(message: types.Message):
         return
 
     try:
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": f"""
-Ты — персональный диетолог. Составь **индивидуальное меню на один день** для пользователя:
-
-- Имя: {user['name']}
-- Пол: {user['gender']}
-- Возраст: {user['age']} лет
-- Рост: {user['height']} см
-- Вес: {user['weight']} кг
-- Цель: {user['goal']}
-- Место тренировки: {user['training_location'] or 'не указано'}
-- Уровень: {user['level'] or 'не указан'}
-
-Меню должно быть:
-- Сбалансированным
-- Подходящим для достижения цели
-- Безопасным
-- Подходящим по возрасту и полу
-
-Формат ответа:
-- Завтрак: [описание]
-- Перекус (если нужно): [описание]
-- Обед: [описание]
-- Перекус (если нужно): [описание]
-- Ужин: [описание]
-- Полезные напитки: [если нужно]
-
-Пиши на **русском языке**.
-"""},  # Новый промт
-                {"role": "user", "content": "Создай питание."}
-            ],
-            max_tokens=3000,  # Увеличено
-            temperature=0.7
-        )
-        food = completion.choices[0].message.content
+        food, endpoint = await generate("food", user_id, FOOD_USER_TEMPLATE.format(**profile_values(user)))
+        logger.info(f"Питание для {user_id} сгенерировано моделью {endpoint.name}")
         msg = await message.answer(f"Твоё питание на сегодня:\n\n{food}")
         add_message_id(user_id, msg.message_id)
         await delete_old_messages(user_id)
     except Exception as e:
         logger.error(f"Ошибка при генерации питания: {e}")
-        msg = await message.answer(f"❌ Ошибка при генерации питания. Попробуй позже.")
+        msg = await message.answer(llm_error_text(e, "питания"))
+        add_message_id(user_id, msg.message_id)
+
+# --- Анализ рациона: расчёт по локальной таблице, LLM — только комментарий ---
+food_index = FoodIndex.from_csv(FOODS_PATH)
+DIET_MAX_CHARS = 3000
+# Отчёт должен уложиться в одно сообщение Telegram (4096 символов)
+DIET_MAX_LINES = 40
+DIET_MAX_UNKNOWN = 10
+DIET_UNKNOWN_CHARS = 40
+TELEGRAM_MESSAGE_LIMIT = 4096
+DIET_USAGE = (
+    "Напиши, что ты съел за день, после команды, например:\n"
+    "/diet завтрак: овсянка 200 г, 2 яйца\n"
+    "обед: гречка 250 г, куриная грудка 150 г, огурец\n"
+    "ужин: творог 5% 200 г, ложка мёда"
+)
+
+def format_diet_report(analysis, targets):
+    # Одинаковые продукты в одном приёме пищи — одной строкой
+    grouped = {}
+    for item in analysis["items"]:
+        key = (item["meal"], item["food"], item["score"] == 1.0)
+        line = grouped.setdefault(key, {"grams": 0.0, "kcal": 0.0, "count": 0})
+        line["grams"] += item["grams"]
+        line["kcal"] += item["kcal"]
+        line["count"] += 1
+
+    lines = ["🍽 Анализ рациона:"]
+    meal = None
+    for (item_meal, food, exact), line in list(grouped.items())[:DIET_MAX_LINES]:
+        if item_meal != meal and item_meal:
+            meal = item_meal
+            lines.append(f"\n{meal.capitalize()}:")
+        # ≈ — продукт найден по похожему названию
+        approx = "" if exact else "≈"
+        count = f" ×{line['count']}" if line["count"] > 1 else ""
+        lines.append(f"- {approx}{food}{count}, {line['grams']:.0f} г — {line['kcal']:.0f} ккал")
+    if len(grouped) > DIET_MAX_LINES:
+        lines.append(f"…и ещё {len(grouped) - DIET_MAX_LINES}")
+    totals = analysis["totals"]
+    lines.append(
+        f"\nИтого: {totals['kcal']:.0f} ккал (норма ~{targets['kcal']:.0f}), "
+        f"Б {totals['protein']:.0f} г (норма ~{targets['protein']:.0f}), Ж {totals['fat']:.0f} г, У {totals['carbs']:.0f} г"
+    )
+    unknown = list(dict.fromkeys(analysis["unknown"]))
+    if unknown:
+        shown = [text[:DIET_UNKNOWN_CHARS] + ("…" if len(text) > DIET_UNKNOWN_CHARS else "")
+                 for text in unknown[:DIET_MAX_UNKNOWN]]
+        more = f" и ещё {len(unknown) - DIET_MAX_UNKNOWN}" if len(unknown) > DIET_MAX_UNKNOWN else ""
+        lines.append("\nНе удалось распознать: " + "; ".join(shown) + more)
+    return "\n".join(lines)[:TELEGRAM_MESSAGE_LIMIT]
+
+@dp.message(Command("diet"))
+async def cmd_diet(message: types.Message):
+    user_id = message.from_user.id
+    user = get_user_profile(user_id)
+    if not user:
+        msg = await message.answer("Сначала пройди анкету: /start")
+        add_message_id(user_id, msg.message_id)
+        return
+
+    # Текст после команды — на той же строке или со следующей
+    args = message.text.split(maxsplit=1)
+    analysis = analyze_meals(args[1][:DIET_MAX_CHARS] if len(args) > 1 else "", food_index)
+    if not analysis["items"]:
+        msg = await message.answer(DIET_USAGE)
+        add_message_id(user_id, msg.message_id)
+        return
+
+    # Расчёт уже готов — отправляем сразу, комментарий ИИ придёт следом
+    targets = daily_targets(user)
+    msg = await message.answer(format_diet_report(analysis, targets))
+    add_message_id(user_id, msg.message_id)
+
+    if not is_subscribed(user_id):
+        msg = await message.answer("💡 Комментарий ИИ-диетолога к рациону доступен по подписке: /subscribe")
         add_message_id(user_id, msg.message_id)
+        return
+
+    totals = analysis["totals"]
+    prompt = DIET_USER_TEMPLATE.format(
+        **profile_values(user),
+        target_kcal=f"{targets['kcal']:.0f}", target_protein=f"{targets['protein']:.0f}",
+        kcal=f"{totals['kcal']:.0f}", protein=f"{totals['protein']:.0f}",
+        fat=f"{totals['fat']:.0f}", carbs=f"{totals['carbs']:.0f}",
+        foods=", ".join(f"{item['food']} {item['grams']:.0f} г" for item in analysis["items"]),
+    )
+    await bot.send_chat_action(user_id, "typing")
+    try:
+        comment, _ = await generate("diet", user_id, prompt)
+        msg = await message.answer(f"🧑‍⚕️ Комментарий:\n\n{comment}")
+    except Exception as e:
+        logger.error(f"Ошибка при комментарии к рациону: {e}")
+        msg = await message.answer(llm_error_text(e, "комментария"))
+    add_message_id(user_id, msg.message_id)
 
 @dp.message(Command("weight"))
 async def cmd_weight(message: types.Message):
@@ -586,34 +2309,139 @@ async def cmd_weight(message: types.Message):
 
 # --- Новые команды ---
 
+# Названия замеров в /progress -> колонка таблицы progress
+PROGRESS_ALIASES = {
+    "вес": "weight", "weight": "weight",
+    "грудь": "chest", "chest": "chest",
+    "талия": "waist", "waist": "waist",
+    "бёдра": "hips", "бедра": "hips", "hips": "hips",
+    "руки": "arms", "бицепс": "arms", "arms": "arms",
+    "плечи": "shoulders", "shoulders": "shoulders",
+    "бедро": "thighs", "thighs": "thighs",
+    "икры": "calves", "calves": "calves",
+    "присед": "squat", "squat": "squat",
+    "жим": "bench", "bench": "bench",
+    "становая": "deadlift", "тяга": "deadlift", "deadlift": "deadlift",
+}
+PROGRESS_USAGE = (
+    "Введите команду в формате:\n"
+    "/progress 70.5 (вес в кг)\n"
+    "/progress талия=80 грудь=102 присед=100\n\n"
+    "Замеры (см): грудь, талия, бёдра, руки, плечи, бедро, икры\n"
+    "Силовые (кг): присед, жим, становая\n"
+    "График: /progress_chart"
+)
+
+def _parse_progress_value(text):
+    # float() принимает и inf/nan — такие значения ломают график прогресса
+    value = float(text.replace(',', '.'))
+    if not math.isfinite(value):
+        raise ValueError(f"Нечисловое значение: {text}")
+    return value
+
+def parse_progress_args(args):
+    """'/progress 70.5' или '/progress талия=80 жим=60' -> {колонка: значение}.
+    ValueError при неизвестном замере или нечисловом значении."""
+    if len(args) == 1 and "=" not in args[0] and ":" not in args[0]:
+        return {"weight": _parse_progress_value(args[0])}
+    values = {}
+    for arg in args:
+        key, sep, value = arg.replace(':', '=').partition('=')
+        column = PROGRESS_ALIASES.get(key.strip().lower())
+        if not sep or column is None:
+            raise ValueError(f"Неизвестный замер: {key}")
+        values[column] = _parse_progress_value(value)
+    return values
+
+def save_progress(user_id, values):
+    columns = list(values)
+    cur.execute(
+        f"INSERT INTO progress (user_id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})",
+        [user_id] + [values[c] for c in columns]
+    )
+    conn.commit()
+    progress_dashboard_cache.pop(user_id, None)
+
 @dp.message(Command("progress"))
 async def cmd_progress(message: types.Message):
     user_id = message.from_user.id
     args = message.text.split()
     if len(args) < 2:
-        msg = await message.answer("Введите команду в формате:\n/progress 70.5 (вес в кг)")
+        msg = await message.answer(PROGRESS_USAGE)
         add_message_id(user_id, msg.message_id)
         return
 
     try:
-        weight = float(args[1])
-        save_weight(user_id, weight)
+        values = parse_progress_args(args[1:])
+    except ValueError:
+        msg = await message.answer("Введите корректные значения.\n\n" + PROGRESS_USAGE)
+        add_message_id(user_id, msg.message_id)
+        return
 
-        # Сохраняем в progress
-        cur.execute("""
-            INSERT INTO progress (user_id, weight) VALUES (?, ?)
-        """, (user_id, weight))
-        conn.commit()
+    if "weight" in values:
+        save_weight(user_id, values["weight"])
 
-        msg = await message.answer(f"✅ Вес {weight} кг сохранён в прогресс.")
-        add_message_id(user_id, msg.message_id)
+    # Сохраняем в progress
+    save_progress(user_id, values)
+
+    saved = ", ".join(
+        f"{PROGRESS_METRICS[c][0].lower()} {v:g} {PROGRESS_METRICS[c][1]}" for c, v in values.items()
+    )
+    msg = await message.answer(f"✅ Сохранено в прогресс: {saved}.")
+    add_message_id(user_id, msg.message_id)
 
-        # Проверим достижения
-        check_achievements(user_id)
+    # Проверим достижения
+    check_achievements(user_id)
 
-    except ValueError:
-        msg = await message.answer("Введите корректное число.")
+# --- Дашборд прогресса ---
+PROGRESS_DASHBOARD_CACHE_SIZE = 256
+progress_dashboard_cache = OrderedDict()  # {user_id: (id последней записи, png)}
+
+def load_progress_matrix(user_id):
+    """Вся история замеров одним запросом -> (даты datetime64, матрица float с NaN, колонки)."""
+    columns = list(PROGRESS_METRICS)
+    cur.execute(f"SELECT date, {', '.join(columns)} FROM progress WHERE user_id = ? ORDER BY date, id", (user_id,))
+    rows = cur.fetchall()
+    if not rows:
+        return None, None, columns
+    dates = np.array([r[0] for r in rows], dtype='datetime64[s]')
+    matrix = np.array([r[1:] for r in rows], dtype=np.float64)  # None -> nan
+    return dates, matrix, columns
+
+def get_progress_version(user_id):
+    cur.execute("SELECT id FROM progress WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+async def get_progress_dashboard(user_id):
+    """PNG дашборда. Кэшируется, пока у пользователя не появится новая запись."""
+    version = get_progress_version(user_id)
+    if version is None:
+        return None
+    cached = progress_dashboard_cache.get(user_id)
+    if cached and cached[0] == version:
+        progress_dashboard_cache.move_to_end(user_id)
+        return cached[1]
+    dates, matrix, columns = load_progress_matrix(user_id)
+    png = await asyncio.to_thread(render_dashboard, dates, matrix, columns)
+    progress_dashboard_cache[user_id] = (version, png)
+    progress_dashboard_cache.move_to_end(user_id)
+    while len(progress_dashboard_cache) > PROGRESS_DASHBOARD_CACHE_SIZE:
+        progress_dashboard_cache.popitem(last=False)
+    return png
+
+@dp.message(Command("progress_chart"))
+async def send_progress_chart(message: types.Message):
+    user_id = message.from_user.id
+    png = await get_progress_dashboard(user_id)
+    if png is None:
+        msg = await message.answer("Нет данных о прогрессе. Добавь замеры: /progress талия=80 жим=60")
         add_message_id(user_id, msg.message_id)
+        return
+
+    photo = BufferedInputFile(png, filename='progress.png')
+    msg = await message.answer_photo(photo=photo)
+    add_message_id(user_id, msg.message_id)
 
 @dp.message(Command("schedule"))
 async def cmd_schedule(message: types.Message):
@@ -629,33 +2457,91 @@ async def cmd_schedule(message: types.Message):
 @dp.message(Command("report"))
 async def cmd_report(message: types.Message):
     user_id = message.from_user.id
-    # Пример: недельный отчёт
-    now = datetime.now()
-    week_ago = now - timedelta(days=7)
-
-    # Сколько тренировок выполнено за неделю
-    cur.execute("""
-        SELECT COUNT(*) FROM trainings
-        WHERE user_id = ? AND status = 'completed' AND date >= ?
-    """, (user_id, week_ago.isoformat()))
-    completed_count = cur.fetchone()[0]
-
-    # Сколько тренировок просрочено
-    cur.execute("""
-        SELECT COUNT(*) FROM trainings
-        WHERE user_id = ? AND status = 'missed' AND date >= ?
-    """, (user_id, week_ago.isoformat()))
-    missed_count = cur.fetchone()[0]
+    args = message.text.split()
+    weeks = 1
+    if len(args) > 1:
+        try:
+            weeks = int(args[1])
+        except ValueError:
+            weeks = 0
+        if not 1 <= weeks <= REPORT_MAX_WEEKS:
+            msg = await message.answer(f"Введите команду в формате: /report 4 (число недель от 1 до {REPORT_MAX_WEEKS})")
+            add_message_id(user_id, msg.message_id)
+            return
 
-    report = f"""
+    if weeks == 1:
+        # Пример: недельный отчёт
+        counts = get_recent_training_counts(user_id, days=7)
+        report = f"""
 📊 Недельный отчёт (последние 7 дней):
-- Выполнено тренировок: {completed_count}
-- Пропущено тренировок: {missed_count}
+- Выполнено тренировок: {counts['completed']}
+- Пропущено тренировок: {counts['missed']}
     """
+    else:
+        report = format_weekly_report(get_weekly_report(user_id, weeks), weeks)
 
     msg = await message.answer(report)
     add_message_id(user_id, msg.message_id)
 
+EXERCISES_DEFAULT_DAYS = 30
+EXERCISES_MAX_DAYS = 365
+
+@dp.message(Command("exercises"))
+async def cmd_exercises(message: types.Message):
+    user_id = message.from_user.id
+    args = message.text.split()
+    days = EXERCISES_DEFAULT_DAYS
+    if len(args) > 1:
+        try:
+            days = int(args[1])
+        except ValueError:
+            days = 0
+        if not 1 <= days <= EXERCISES_MAX_DAYS:
+            msg = await message.answer(f"Введите команду в формате: /exercises 30 (число дней от 1 до {EXERCISES_MAX_DAYS})")
+            add_message_id(user_id, msg.message_id)
+            return
+
+    rows = get_exercise_stats(user_id, days)
+    if not rows:
+        msg = await message.answer(f"За последние {days} дн. нет выполненных тренировок с упражнениями.")
+        add_message_id(user_id, msg.message_id)
+        return
+
+    lines = [f"🏋️ Упражнения за {days} дн. (выполненные тренировки):"]
+    total_volume = 0
+    for name, times, sets, reps, volume, max_weight in rows:
+        line = f"- {name}: {times} раз, подходов {sets or 0}"
+        if reps:
+            line += f", повторов {reps}"
+        if volume:
+            line += f", тоннаж {volume:g} кг (макс. {max_weight:g} кг)"
+            total_volume += volume
+        lines.append(line)
+    if total_volume:
+        lines.append(f"\nТоннаж по этим упражнениям: {total_volume:g} кг")
+    msg = await message.answer("\n".join(lines))
+    add_message_id(user_id, msg.message_id)
+
+HISTORY_LIMIT = 10
+TRAINING_STATUS_ICONS = {"completed": "✅", "missed": "❌", "pending": "⏳"}
+
+@dp.message(Command("history"))
+async def cmd_history(message: types.Message):
+    user_id = message.from_user.id
+    cur.execute("SELECT id, date, status FROM trainings WHERE user_id = ? ORDER BY date DESC LIMIT ?", (user_id, HISTORY_LIMIT))
+    rows = cur.fetchall()
+    if not rows:
+        msg = await message.answer("У тебя пока нет тренировок. Получить тренировку: /training")
+        add_message_id(user_id, msg.message_id)
+        return
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{TRAINING_STATUS_ICONS.get(status, '')} {date.split()[0]}", callback_data=f"history_{training_id}")]
+        for training_id, date, status in rows
+    ])
+    msg = await message.answer("Последние тренировки — нажми, чтобы открыть:", reply_markup=keyboard)
+    add_message_id(user_id, msg.message_id)
+
 @dp.message(Command("achievements"))
 async def cmd_achievements(message: types.Message):
     user_id = message.from_user.id
@@ -681,8 +2567,8 @@ async def show_profile(message: types.Message):
         return
 
     sub_status = "Подписка активна" if is_subscribed(user_id) else "Подписка не оформлена"
-    weights = get_weights(user_id)
-    weights_str = "\n".join([f"{w[1].split()[0]}: {w[0]} кг" for w in weights[-5:]])
+    weights = get_weights(user_id, limit=5)
+    weights_str = "\n".join([f"{w[1].split()[0]}: {w[0]} кг" for w in weights])
 
     # Получаем график
     cur.execute("SELECT schedule FROM training_schedule WHERE user_id = ?", (user_id,))
@@ -713,34 +2599,62 @@ async def show_profile(message: types.Message):
     msg = await message.answer(profile)
     add_message_id(user_id, msg.message_id)
 
+WEIGHT_GRAPH_MAX_POINTS = 300
+
+def render_weight_graph(weights):
+    """PNG-график веса. Вызывается в отдельном потоке, поэтому использует
+    объектный API matplotlib (Figure), а не глобальное состояние pyplot."""
+    dates = np.array([w[1] for w in weights], dtype='datetime64[s]')
+    values = np.array([w[0] for w in weights], dtype=np.float64)
+    if len(values) > WEIGHT_GRAPH_MAX_POINTS:
+        idx = lttb(dates.astype(np.int64), values, WEIGHT_GRAPH_MAX_POINTS)
+        dates, values = dates[idx], values[idx]
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(dates.astype('datetime64[s]').tolist(), values, marker='o' if len(values) <= 60 else None)
+    ax.set_title("График изменения веса")
+    ax.set_xlabel("Дата")
+    ax.set_ylabel("Вес (кг)")
+    locator = mdates.AutoDateLocator()
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    img = io.BytesIO()
+    fig.savefig(img, format='png')
+    return img.getvalue()
+
+WEIGHT_GRAPH_MAX_DAYS = 3650
+
 @dp.message(Command("weight_graph"))
 async def send_weight_graph(message: types.Message):
     user_id = message.from_user.id
-    weights = get_weights(user_id)
+    args = message.text.split()
+    since = None
+    if len(args) > 1:
+        try:
+            days = int(args[1])
+            if not 1 <= days <= WEIGHT_GRAPH_MAX_DAYS:
+                raise ValueError(days)
+            since = datetime.now() - timedelta(days=days)
+        except ValueError:
+            msg = await message.answer("Введите команду в формате: /weight_graph или /weight_graph 90 (за последние N дней, до 3650)")
+            add_message_id(user_id, msg.message_id)
+            return
+    weights = get_weights(user_id, since=since)
 
     if not weights:
         msg = await message.answer("Нет данных о весе.")
         add_message_id(user_id, msg.message_id)
         return
 
-    dates = [w[1].split()[0] for w in weights]
-    values = [w[0] for w in weights]
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(dates, values, marker='o')
-    plt.title("График изменения веса")
-    plt.xlabel("Дата")
-    plt.ylabel("Вес (кг)")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
+    # Рисуем вне цикла событий, чтобы не задерживать других пользователей
+    png = await asyncio.to_thread(render_weight_graph, weights)
 
-    img = io.BytesIO()
-    plt.savefig(img, format='png')
-    img.seek(0)
-    plt.close()
-
-    # Оборачиваем BytesIO в BufferedInputFile
-    photo = BufferedInputFile(img.read(), filename='weight_graph.png')
+    # Оборачиваем PNG в BufferedInputFile
+    photo = BufferedInputFile(png, filename='weight_graph.png')
     msg = await message.answer_photo(photo=photo)
     add_message_id(user_id, msg.message_id)
 
@@ -874,6 +2788,7 @@ async def process_level_callback(callback_query: types.CallbackQuery):
         f"✅ Отлично, {profile['name']}! Твой профиль сохранён.\n\nТеперь ты можешь использовать:\n"
         "/training — получить тренировку\n"
         "/food — получить питание\n"
+        "/diet — посчитать калории за день\n"
         "/subscribe — оформить подписку\n"
         "/profile — посмотреть свой профиль"
     )
@@ -914,6 +2829,23 @@ async def training_postpone_callback(callback_query: types.CallbackQuery):
     await callback_query.answer("✅ Тренировка перенесена на завтра.")
     await callback_query.message.edit_reply_markup(reply_markup=None)  # Убираем кнопки
 
+@dp.callback_query(lambda c: c.data.startswith("history_"))
+async def history_callback(callback_query: types.CallbackQuery):
+    user_id = callback_query.from_user.id
+    try:
+        training_id = int(callback_query.data.split('_')[1])
+    except (IndexError, ValueError):
+        await callback_query.answer("❌ Неверный формат данных.")
+        return
+
+    content = get_training_content(training_id, user_id=user_id)
+    if content is None:
+        await callback_query.answer("❌ Тренировка не найдена.", show_alert=True)
+        return
+    await callback_query.answer()
+    msg = await callback_query.message.answer(content)
+    add_message_id(user_id, msg.message_id)
+
 @dp.callback_query(lambda c: c.data.startswith("schedule_"))
 async def process_schedule_callback(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
@@ -931,23 +2863,63 @@ async def process_schedule_callback(callback_query: types.CallbackQuery):
         await callback_query.answer(f"✅ Установлен график: {schedule_data['days_per_week']} раза в неделю.")
         await callback_query.message.edit_text(f"Твой график: {schedule_data['days_per_week']} тренировки в неделю ({', '.join(schedule_data['days'])}).")
 
+@dp.message(Command("chat_reset"))
+async def cmd_chat_reset(message: types.Message):
+    reset_chat(message.from_user.id)
+    await message.answer("🧹 История чата очищена. Можешь задать новый вопрос.")
+
+async def handle_chat_message(message: types.Message):
+    user_id = message.from_user.id
+    user = get_user_profile(user_id)
+    if not user:
+        msg = await message.answer("Сначала пройди анкету: /start")
+        add_message_id(user_id, msg.message_id)
+        return
+    if not is_subscribed(user_id):
+        msg = await message.answer("🔒 Чат с ИИ-тренером доступен только по подписке. Используй /subscribe, чтобы оформить.")
+        add_message_id(user_id, msg.message_id)
+        return
+
+    text = message.text.strip()[:CHAT_MAX_MESSAGE_CHARS]
+    context = [{"role": "system", "content": CHAT_CONTEXT_TEMPLATE.format(
+        profile=PROFILE_TEMPLATE.format(**profile_values(user)),
+        summary=get_chat_summary(user_id) or "нет",
+    )}]
+    context += get_chat_window(user_id, CHAT_WINDOW_TOKENS - estimate_tokens(text))
+    await bot.send_chat_action(user_id, "typing")
+    try:
+        answer, _ = await generate("chat", user_id, text, context)
+    except Exception as e:
+        logger.error(f"Ошибка в чате с ИИ-тренером: {e}")
+        await message.answer(llm_error_text(e, "ответа"))
+        return
+
+    add_chat_message(user_id, "user", text)
+    add_chat_message(user_id, "assistant", answer)
+    # Сообщения чата не добавляем в add_message_id — их не нужно удалять при очистке
+    await message.answer(answer)
+    start_background_task(update_chat_summary(user_id))
+
 # --- Обработчик текста (всегда в конце!) ---
 
 @dp.message()
 async def handle_questionnaire(message: types.Message):
     user_id = message.from_user.id
-    logger.info(f"Получено сообщение от {user_id}: {message.text}")  # Лог
+    # Текст сообщения в лог не пишем — только длину
+    logger.debug(f"Получено сообщение от {user_id}, {len(message.text or '')} симв.")
 
     # Проверяем, является ли сообщение командой
     if message.text and message.text.startswith('/'):
-        logger.info(f"Команда '{message.text}' — пропускаем, пусть обработчик команд сработает")  # Лог
+        logger.debug(f"Команда '{message.text.split()[0]}' — пропускаем, пусть обработчик команд сработает")
         # НЕ вызываем await, просто выходим — пусть другие хендлеры обработают команду
         return
 
-    # Если пользователь в анкете, обрабатываем анкету
-    if user_id in user_states:
-        state = user_states[user_id]
-        step = state["step"]
+    # Если пользователь в анкете, обрабатываем анкету. Запись в user_states
+    # есть и без анкеты (add_message_id хранит там id сообщений), поэтому
+    # смотрим именно на шаг
+    state = user_states.get(user_id)
+    step = state.get("step") if state else None
+    if step is not None:
         data = state["data"]
 
         if step == "name":
@@ -1022,172 +2994,398 @@ async def handle_questionnaire(message: types.Message):
             except ValueError:
                 msg = await message.answer("Пожалуйста, введи число (можно с точкой).")
                 add_message_id(user_id, msg.message_id)
-    # Если пользователь не в анкете и это не команда — игнорируем
 
-# --- Основная функция запуска ---
-async def main():
-    global loop # <-- Указываем, что будем использовать глобальную переменную
-    loop = asyncio.get_running_loop() # <-- Сохраняем текущий цикл
+    # Не анкета и не команда — вопрос ИИ-тренеру
+    elif message.text:
+        await handle_chat_message(message)
 
-    # --- Планировщик ---
-    scheduler.start()
-    logger.info("⏰ Планировщик запущен")
+# --- Flask приложение для вебхука (порт 8000) ---
+webhook_app = Flask(__name__)
 
-    # --- Установка вебхука ---
+@webhook_app.route('/webhook', methods=['POST'])
+def webhook():
+    content_type = request.headers.get('Content-Type', '').lower()
+    if content_type != 'application/json':
+        logger.warning("Получен запрос на /webhook с неправильным Content-Type")
+        return '', 403
+
+    json_string = request.get_data().decode('utf-8')
     try:
-        await bot.set_webhook(WEBHOOK_URL)
-        logger.info(f"📡 Вебхук установлен на {WEBHOOK_URL}")
+        raw = json.loads(json_string)
+        update = types.Update.model_validate(raw)
     except Exception as e:
-        logger.error(f"❌ Ошибка при установке вебхука: {e}")
-        return
-
-    # --- Flask приложение для вебхука (порт 8000) ---
-    webhook_app = Flask(__name__)
+        logger.error(f"Ошибка при десериализации JSON: {e}")
+        return '', 400
 
-    @webhook_app.route('/webhook', methods=['POST'])
-    def webhook():
-        content_type = request.headers.get('Content-Type', '').lower()
-        if content_type != 'application/json':
-            logger.warning("Получен запрос на /webhook с неправильным Content-Type")
-            return '', 403
+    try:
+        # Процесс один (python bot.py) — апдейты идут параллельно, как и раньше;
+        # строгий порядок по пользователю нужен только обработчикам за front.py
+        future = asyncio.run_coroutine_threadsafe(dp.feed_update(bot, update), loop)
+    except Exception as e:
+        logger.error(f"Ошибка при передаче апдейта в aiogram: {e}")
+        return '', 500
+
+    return '', 200
+
+# --- Flask приложение для веб-админки (порт 8001) ---
+admin_app = Flask(__name__)
+admin_app.secret_key = 'your_secret_key_here' # <-- ВАЖНО: замените на случайный ключ
+
+@admin_app.route('/admin/login', methods=['GET', 'POST'])
+def admin_login():
+    if request.method == 'POST':
+        password = request.form.get('password')
+        if password == ADMIN_PASSWORD:
+            session['authenticated'] = True
+            return redirect(url_for('admin_index'))
+        else:
+            return "❌ Неверный пароль", 403
+    return render_template('admin_login.html')
+
+@admin_app.route('/admin')
+def admin_index():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    stats = get_dashboard_stats()
+    return render_template('admin.html', authenticated=True, llm_endpoints=llm_router.snapshot(),
+                           send_classes=send_scheduler.snapshot(),
+                           loop_watchdog=loop_watchdog.snapshot() if loop_watchdog else None, **stats)
+
+@admin_app.route('/admin/users')
+def admin_users():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
 
-        json_string = request.get_data().decode('utf-8')
+    try:
+        page = UsersPage(
+            status=request.args.get('status', 'all'),
+            sort=request.args.get('sort', 'created'),
+            order=request.args.get('order', 'desc'),
+            after=request.args.get('after'),
+            limit=request.args.get('limit', USERS_PAGE_SIZE),
+        )
+    except ValueError as e:
+        return f"❌ {e}", 400
+    # Шаблон рендерится потоком: первые строки уходят браузеру сразу
+    return stream_template('admin_users.html', users=page, page=page)
+
+@admin_app.route('/admin/grant', methods=['GET', 'POST'])
+def admin_grant():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'POST':
+        user_id_str = request.form.get('user_id')
+        days_str = request.form.get('days')
         try:
-            update = types.Update.model_validate_json(json_string)
-        except Exception as e:
-            logger.error(f"Ошибка при десериализации JSON: {e}")
-            return '', 400
+            user_id = int(user_id_str)
+            days = int(days_str)
+            if days <= 0:
+                return "❌ Количество дней должно быть положительным.", 400
+            grant_subscription(user_id, days=days)
+            logger.info(f"Администратор выдал подписку на {days} дней пользователю {user_id}")
+            return redirect(url_for('admin_grant'))
+        except ValueError:
+            return "❌ Неверный формат ID пользователя или дней.", 400
+    return render_template('admin_grant.html')
+
+@admin_app.route('/admin/revoke', methods=['GET', 'POST'])
+def admin_revoke():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'POST':
+        user_id_str = request.form.get('user_id')
+        try:
+            user_id = int(user_id_str)
+            revoke_subscription(user_id)
+            logger.info(f"Администратор отозвал подписку у пользователя {user_id}")
+            return redirect(url_for('admin_revoke'))
+        except ValueError:
+            return "❌ Неверный формат ID пользователя.", 400
+    return render_template('admin_revoke.html')
+
+@admin_app.route('/admin/broadcast', methods=['GET', 'POST'])
+def admin_broadcast():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'POST':
+        message_text = request.form.get('message')
+        if not message_text:
+            return "❌ Сообщение не может быть пустым.", 400
+
+        cur.execute("SELECT user_id FROM users")
+        user_ids = [row[0] for row in cur.fetchall()]
+        # Сообщения уходят через очередь уведомлений с низшим приоритетом,
+        # страница не ждёт окончания рассылки
+        publish_broadcast(user_ids, message_text)
+        return redirect(url_for('admin_broadcast'))
+    return render_template('admin_broadcast.html')
+
+@admin_app.route('/admin/search')
+def admin_search():
+    if not session.get('authenticated'):
+        return jsonify({"error": "unauthorized"}), 401
 
+    try:
+        limit = min(int(request.args.get('limit', USER_SEARCH_LIMIT)), 50)
+    except ValueError:
+        return jsonify({"error": "bad limit"}), 400
+    users = search_users(request.args.get('q', ''), limit=limit)
+    return jsonify([{"user_id": user[0], "name": user[1]} for user in users])
+
+@admin_app.route('/admin/export/<table>.<fmt>')
+def admin_export(table, fmt):
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+        return "❌ Неизвестная таблица или формат.", 404
+    rows = iter_table_rows(table)
+    body = stream_ndjson(rows) if fmt == 'ndjson' else stream_csv(rows, EXPORT_TABLES[table])
+    logger.info(f"Администратор выгружает таблицу {table} ({fmt})")
+    return Response(body, mimetype=EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={table}.{fmt}"})
+
+@admin_app.route('/admin/export/user/<int:user_id>.ndjson')
+def admin_export_user(user_id):
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if not get_user_by_id(user_id):
+        return "❌ Пользователь с таким ID не найден.", 404
+    logger.info(f"Администратор выгружает данные пользователя {user_id}")
+    return Response(stream_ndjson(iter_user_export(user_id)), mimetype=EXPORT_FORMATS['ndjson'],
+                    headers={"Content-Disposition": f"attachment; filename=user_{user_id}.ndjson"})
+
+@admin_app.route('/admin/purge', methods=['GET', 'POST'])
+def admin_purge():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'POST':
         try:
-            future = asyncio.run_coroutine_threadsafe(dp.feed_update(bot, update), loop)
-        except Exception as e:
-            logger.error(f"Ошибка при передаче апдейта в aiogram: {e}")
-            return '', 500
-
-        return '', 200
-
-    # --- Flask приложение для веб-админки (порт 8001) ---
-    admin_app = Flask(__name__)
-    admin_app.secret_key = 'your_secret_key_here' # <-- ВАЖНО: замените на случайный ключ
-
-    @admin_app.route('/admin/login', methods=['GET', 'POST'])
-    def admin_login():
-        if request.method == 'POST':
-            password = request.form.get('password')
-            if password == ADMIN_PASSWORD:
-                session['authenticated'] = True
-                return redirect(url_for('admin_index'))
-            else:
-                return "❌ Неверный пароль", 403
-        return render_template('admin_login.html')
-
-    @admin_app.route('/admin')
-    def admin_index():
-        if not session.get('authenticated'):
-            return redirect(url_for('admin_login'))
-
-        user_count = get_user_count()
-        sub_count = len(get_subscribed_users())
-
-        return render_template('admin.html', authenticated=True, user_count=user_count, sub_count=sub_count)
-
-    @admin_app.route('/admin/users')
-    def admin_users():
-        if not session.get('authenticated'):
-            return redirect(url_for('admin_login'))
-
-        users = get_users_list()
-        return render_template('admin_users.html', users=users)
-
-    @admin_app.route('/admin/grant', methods=['GET', 'POST'])
-    def admin_grant():
-        if not session.get('authenticated'):
-            return redirect(url_for('admin_login'))
-
-        if request.method == 'POST':
-            user_id_str = request.form.get('user_id')
-            days_str = request.form.get('days')
-            try:
-                user_id = int(user_id_str)
-                days = int(days_str)
-                if days <= 0:
-                    return "❌ Количество дней должно быть положительным.", 400
-                grant_subscription(user_id, days=days)
-                logger.info(f"Администратор выдал подписку на {days} дней пользователю {user_id}")
-                return redirect(url_for('admin_grant'))
-            except ValueError:
-                return "❌ Неверный формат ID пользователя или дней.", 400
-        return render_template('admin_grant.html')
+            inactive_days = int(request.form.get('inactive_days', PURGE_DEFAULT_INACTIVE_DAYS))
+            if inactive_days < 30:
+                return "❌ Срок неактивности должен быть не меньше 30 дней.", 400
+        except ValueError:
+            return "❌ Неверный срок неактивности.", 400
+        started = start_purge(
+            inactive_days=inactive_days,
+            include_subscribed=bool(request.form.get('include_subscribed')),
+            dry_run=bool(request.form.get('dry_run')),
+        )
+        if started:
+            logger.info(f"Администратор запустил чистку неактивных (>{inactive_days} дн.)")
+        return redirect(url_for('admin_purge'))
+    return render_template('admin_purge.html', status=purge_status, default_days=PURGE_DEFAULT_INACTIVE_DAYS)
+
+# --- Расход LLM ---
+LLM_USAGE_HISTORY_DAYS = 30
+LLM_TOP_CONSUMERS = 20
+
+def get_llm_usage_report(days=LLM_USAGE_HISTORY_DAYS, top_days=7):
+    """Итоги по дням, по командам за сегодня и самые активные пользователи —
+    всё из llm_usage_daily (диапазон по первичному ключу)."""
+    since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    top_since = (datetime.now() - timedelta(days=top_days - 1)).strftime('%Y-%m-%d')
+    daily = conn.execute("""
+        SELECT day, SUM(calls), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens),
+               SUM(latency_ms) / SUM(calls), COUNT(DISTINCT user_id)
+        FROM llm_usage_daily WHERE day >= ? GROUP BY day ORDER BY day DESC
+    """, (since,)).fetchall()
+    commands = conn.execute("""
+        SELECT command, SUM(calls), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens),
+               SUM(latency_ms) / SUM(calls)
+        FROM llm_usage_daily WHERE day = date('now', 'localtime')
+        GROUP BY command ORDER BY SUM(prompt_tokens + completion_tokens) DESC
+    """).fetchall()
+    top = conn.execute("""
+        SELECT u.user_id, users.name, u.calls, u.tokens, q.daily_tokens
+        FROM (SELECT user_id, SUM(calls) AS calls, SUM(prompt_tokens + completion_tokens) AS tokens
+              FROM llm_usage_daily WHERE day >= ? GROUP BY user_id
+              ORDER BY tokens DESC LIMIT ?) AS u
+        LEFT JOIN users ON users.user_id = u.user_id
+        LEFT JOIN llm_quotas q ON q.user_id = u.user_id
+        ORDER BY u.tokens DESC
+    """, (top_since, LLM_TOP_CONSUMERS)).fetchall()
+    quotas = conn.execute("""
+        SELECT q.user_id, users.name, q.daily_tokens, q.updated_at
+        FROM llm_quotas q LEFT JOIN users ON users.user_id = q.user_id ORDER BY q.user_id
+    """).fetchall()
+    return {"daily": daily, "commands": commands, "top": top, "top_days": top_days, "quotas": quotas}
+
+@admin_app.route('/admin/llm_usage', methods=['GET', 'POST'])
+def admin_llm_usage():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'POST':
+        try:
+            user_id = int(request.form.get('user_id', ''))
+            raw = request.form.get('daily_tokens', '').strip()
+            daily_tokens = int(raw) if raw else None
+        except ValueError:
+            return "❌ Неверный ID пользователя или лимит.", 400
+        if daily_tokens is not None and daily_tokens < 0:
+            return "❌ Лимит не может быть отрицательным.", 400
+        set_llm_quota(user_id, daily_tokens)
+        logger.info(f"Администратор изменил дневной лимит токенов пользователя {user_id}: {daily_tokens}")
+        return redirect(url_for('admin_llm_usage'))
+    return render_template('admin_llm_usage.html', tiers=LLM_QUOTA_TIERS, **get_llm_usage_report())
+
+# Один профиль за раз: сэмплирование само занимает поток админки
+profile_lock = threading.Lock()
+
+@admin_app.route('/admin/profile')
+def admin_profile():
+    """Сэмплирующий профиль всех потоков процесса за seconds секунд в формате
+    collapsed stacks (flamegraph.pl, speedscope). При нескольких процессах —
+    только нулевого обработчика, где работает админка."""
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
 
-    @admin_app.route('/admin/revoke', methods=['GET', 'POST'])
-    def admin_revoke():
-        if not session.get('authenticated'):
-            return redirect(url_for('admin_login'))
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval_ms = float(request.args.get('interval_ms', 5))
+    except ValueError:
+        return "❌ Неверные параметры профилирования.", 400
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return f"❌ Длительность — от 0 до {MAX_PROFILE_SECONDS} секунд.", 400
+    # nan и inf time.sleep не примет — проверяем до захвата блокировки
+    if not (math.isfinite(interval_ms) and MIN_INTERVAL * 1000 <= interval_ms <= MAX_INTERVAL * 1000):
+        return f"❌ Интервал — от {MIN_INTERVAL * 1000:g} до {MAX_INTERVAL * 1000:g} мс.", 400
+    if not profile_lock.acquire(blocking=False):
+        return "❌ Профилирование уже идёт.", 409
+    try:
+        logger.info(f"Администратор запустил профилирование на {seconds:g} с")
+        lines, samples = sample_stacks(seconds, interval_ms / 1000)
+    finally:
+        profile_lock.release()
+    filename = f"profile_{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed"
+    return Response("\n".join(lines) + "\n", mimetype="text/plain",
+                    headers={"Content-Disposition": f"attachment; filename={filename}",
+                             "X-Profile-Samples": str(samples)})
+
+@admin_app.route('/admin/backup', methods=['GET', 'POST'])
+def admin_backup():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'POST':
+        if start_backup():
+            logger.info("Администратор запустил резервное копирование")
+        return redirect(url_for('admin_backup'))
+    backups = []
+    for path in reversed(list_backups(BACKUP_DIR)):
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        backups.append({"path": path, "size_mb": size / 1024 / 1024})
+    return render_template('admin_backup.html', status=backup_status, backups=backups, keep=BACKUP_KEEP)
+
+@admin_app.route('/admin/delete_user')
+def admin_delete_user():
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    query = request.args.get('q', '')
+    users = search_users(query, limit=50)
+    return render_template('admin_delete_user.html', users=users, query=query)
+
+# --- НОВЫЙ маршрут для подтверждения и выполнения удаления ---
+@admin_app.route('/admin/delete_user_confirm/<int:user_id>')
+def admin_delete_user_confirm(user_id):
+    if not session.get('authenticated'):
+        return redirect(url_for('admin_login'))
+
+    # Проверим, существует ли пользователь
+    cur.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+    if not cur.fetchone():
+        return "❌ Пользователь с таким ID не найден.", 404
+    delete_user_from_db(user_id)
+    logger.info(f"Администратор удалил пользователя {user_id}")
+    # После удаления возвращаемся на список пользователей
+    return redirect(url_for('admin_users'))
+
+# --- Диагностика: блокировки цикла asyncio ---
+loop_watchdog = None  # LoopWatchdog, создаётся в main()
+
+def start_loop_watchdog():
+    global loop_watchdog
+    if SLOW_CALLBACK_MS > 0:
+        loop_watchdog = LoopWatchdog(threshold=SLOW_CALLBACK_MS / 1000)
+        loop_watchdog.start(loop)
+
+def start_admin_thread():
+    def run_admin():
+        from waitress import serve
+        logger.info("🌐 Flask (Waitress) админки запускается на 0.0.0.0:8001...")
+        serve(admin_app, host='0.0.0.0', port=8001)
 
-        if request.method == 'POST':
-            user_id_str = request.form.get('user_id')
-            try:
-                user_id = int(user_id_str)
-                revoke_subscription(user_id)
-                logger.info(f"Администратор отозвал подписку у пользователя {user_id}")
-                return redirect(url_for('admin_revoke'))
-            except ValueError:
-                return "❌ Неверный формат ID пользователя.", 400
-        return render_template('admin_revoke.html')
+    admin_thread = threading.Thread(target=run_admin)
+    admin_thread.daemon = True
+    admin_thread.start()
 
-    @admin_app.route('/admin/broadcast', methods=['GET', 'POST'])
-    def admin_broadcast():
-        if not session.get('authenticated'):
-            return redirect(url_for('admin_login'))
+async def run_worker_loop(inbox):
+    """Обработчик: апдейты и служебные сообщения приходят от фронта."""
+    global worker_stop
+    worker_stop = asyncio.Event()
+    if IS_PRIMARY:
+        start_admin_thread()
+    threading.Thread(target=inbox_reader, args=(inbox,), name="shard-inbox", daemon=True).start()
+    shard_bus.put(("ready", WORKER_INDEX))
+    logger.info(f"🤖 Обработчик {WORKER_INDEX} из {WORKER_COUNT} запущен")
+    await worker_stop.wait()
+    # Дожидаемся апдейтов, которые уже в работе
+    while user_update_tails:
+        await asyncio.sleep(0.05)
+    scheduler.shutdown(wait=False)
+    await bot.session.close()
+    logger.info(f"🛑 Обработчик {WORKER_INDEX} остановлен")
 
-        if request.method == 'POST':
-            message_text = request.form.get('message')
-            if not message_text:
-                return "❌ Сообщение не может быть пустым.", 400
+# --- Основная функция запуска ---
+async def main(inbox=None):
+    """inbox — очередь от фронта, если процесс запущен обработчиком (front.py);
+    тогда вебхук принимает фронт, а админку и фоновые задачи ведёт нулевой обработчик."""
+    global loop # <-- Указываем, что будем использовать глобальную переменную
+    loop = asyncio.get_running_loop() # <-- Сохраняем текущий цикл
+    start_loop_watchdog()
 
-            cur.execute("SELECT user_id FROM users")
-            user_ids = [row[0] for row in cur.fetchall()]
-            sent_count = 0
-            failed_count = 0
+    # --- Очередь уведомлений ---
+    global notification_queue
+    notification_queue = asyncio.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+    notification_task = asyncio.create_task(notification_sender())
 
-            for user_id in user_ids:
-                try:
-                    # Нельзя отправить сообщение напрямую из синхронной функции
-                    # asyncio.create_task(bot.send_message(user_id, message_text)) # Это не сработает здесь
-                    # Лучше: сохранить сообщение в очередь и обрабатывать в отдельной задаче
-                    # Или использовать внешний сервис рассылок
-                    # Пока просто логируем
-                    logger.info(f"Broadcast: сообщение для {user_id} готово к отправке.")
-                    # Для отправки в синхронной функции нужно использовать asyncio.run или передавать loop
-                    # Это требует дополнительной логики
-                    # Пример (небезопасно в синхронной функции):
-                    # loop.create_task(bot.send_message(user_id, message_text))
-                    # Правильнее: создать асинхронную задачу и вызвать её через loop.run_until_complete
-                    # или использовать отдельную очередь.
-                    # Пока просто увеличиваем счётчик
-                    sent_count += 1
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке сообщения {user_id}: {e}")
-                    failed_count += 1
-
-            logger.info(f"Рассылка завершена. Успешно: {sent_count}, Ошибок: {failed_count}")
-            return redirect(url_for('admin_broadcast'))
-        return render_template('admin_broadcast.html')
-
-    # --- НОВЫЙ маршрут для подтверждения и выполнения удаления ---
-    @admin_app.route('/admin/delete_user_confirm/<int:user_id>')
-    def admin_delete_user_confirm(user_id):
-        if not session.get('authenticated'):
-            return redirect(url_for('admin_login'))
-
-        # Проверим, существует ли пользователь
-        cur.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-        if not cur.fetchone():
-            return "❌ Пользователь с таким ID не найден.", 404
-        delete_user_from_db(user_id)
-        logger.info(f"Администратор удалил пользователя {user_id}")
-        # После удаления возвращаемся на список пользователей
-        return redirect(url_for('admin_users'))
+    # --- Планировщик ---
+    # Бюджеты токенов — в памяти каждого процесса
+    refresh_token_budgets()
+    scheduler.add_job(refresh_token_budgets_job, 'interval', minutes=TOKEN_BUDGET_REFRESH_MINUTES, id='token_budgets', replace_existing=True)
+    if IS_PRIMARY:
+        refresh_stats()
+        scheduler.add_job(refresh_stats_job, 'interval', minutes=STATS_REFRESH_MINUTES, id='refresh_stats', replace_existing=True)
+        scheduler.add_job(archive_old_trainings_job, CronTrigger(hour=4, minute=0), id='archive_trainings', replace_existing=True)
+        # Копия — до архивации, в самое тихое время
+        scheduler.add_job(backup_job, CronTrigger(hour=3, minute=30), id='backup', replace_existing=True)
+        scheduler.add_job(prune_llm_calls_job, CronTrigger(hour=4, minute=30), id='prune_llm_calls', replace_existing=True)
+        # Без триггера — один раз сразу после старта (доделывает миграцию сжатия)
+        scheduler.add_job(compress_stored_trainings_job, id='compress_trainings', replace_existing=True)
+        scheduler.add_job(backfill_training_exercises_job, id='backfill_exercises', replace_existing=True)
+        scheduler.add_job(sweep_job, 'interval', minutes=SWEEP_INTERVAL_MINUTES, id='sweep', replace_existing=True)
+    scheduler.start()
+    logger.info("⏰ Планировщик запущен")
+
+    if inbox is not None:
+        await run_worker_loop(inbox)
+        return
+
+    # --- Установка вебхука ---
+    try:
+        await bot.set_webhook(WEBHOOK_URL)
+        logger.info(f"📡 Вебхук установлен на {WEBHOOK_URL}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка при установке вебхука: {e}")
+        return
 
     # --- Запуск Flask-серверов в отдельных потоках ---
     def run_webhook():
@@ -1195,19 +3393,10 @@ async def main():
         logger.info("🌐 Flask (Waitress) вебхука запускается на 0.0.0.0:8000...")
         serve(webhook_app, host='0.0.0.0', port=8000)
 
-    def run_admin():
-        from waitress import serve
-        logger.info("🌐 Flask (Waitress) админки запускается на 0.0.0.0:8001...")
-        serve(admin_app, host='0.0.0.0', port=8001)
-
     webhook_thread = threading.Thread(target=run_webhook)
-    admin_thread = threading.Thread(target=run_admin)
-
     webhook_thread.daemon = True
-    admin_thread.daemon = True
-
     webhook_thread.start()
-    admin_thread.start()
+    start_admin_thread()
     logger.info("🧵 Потоки Flask запущены")
 
     logger.info("🤖 Бот запущен и ожидает сообщений...")
@@ -10,11 +10,50 @@ load_dotenv(dotenv_path=env_path)
 API_TOKEN = os.getenv("API_TOKEN")
 if not API_TOKEN:
     raise ValueError("❌ API_TOKEN не найден в key.env файле!")
+# Необязательно: свой Bot API сервер (локальный telegram-bot-api или заглушка для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 # --- OpenRouter ---
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 if not OPENROUTER_API_KEY:
     raise ValueError("❌ OPENROUTER_API_KEY не найден в key.env файле!")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/")  # слэш в конце важен
+# Модели-кандидаты через запятую: «модель» (через OPENROUTER_BASE_URL) или
+# «модель@https://другой/api/v1/». Роутер выбирает самую быструю исправную.
+LLM_MODELS_RAW = os.getenv("LLM_MODELS", "microsoft/wizardlm-2-8x22b")
+LLM_MODELS = []
+for item in LLM_MODELS_RAW.split(','):
+    model, _, base_url = item.strip().partition('@')
+    if model:
+        LLM_MODELS.append((model, base_url or OPENROUTER_BASE_URL))
+if not LLM_MODELS:
+    raise ValueError("❌ LLM_MODELS должен содержать хотя бы одну модель")
+# Дублирующий запрос к следующей модели, если первая не ответила за своё p90
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+# Дневные лимиты токенов (запрос + ответ) на пользователя по тарифу; 0 — без генераций.
+# Отдельным пользователям лимит можно изменить в админке
+LLM_DAILY_TOKENS_FREE = int(os.getenv("LLM_DAILY_TOKENS_FREE", "0"))
+LLM_DAILY_TOKENS_SUBSCRIBER = int(os.getenv("LLM_DAILY_TOKENS_SUBSCRIBER", "60000"))
+
+# --- Исходящие запросы к Telegram ---
+# Запросов в секунду на бота (0 — без ограничения, например для нагрузочного теста).
+# Сверху ещё запас на всплеск (GLOBAL_BURST в utils/send_queue.py): 25 + 5 — лимит Telegram в 30
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "25"))
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+
+# --- Несколько процессов-обработчиков (front.py) ---
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Номер обработчика задаёт front.py; при обычном запуске (python bot.py) — -1
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "-1"))
+
+# --- Логирование ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")   # json или text
+LOG_FILE = os.getenv("LOG_FILE") or None       # по умолчанию stderr
+# Записей INFO/DEBUG в секунду с одного места в коде, 0 — без ограничения
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+# Шаг цикла asyncio дольше стольких миллисекунд пишется в лог со стеком (0 — не следить)
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "100"))
 
 # --- ЮMoney (для API, например, вебхуков/проверки платежей) ---
 YOOMONEY_SHOP_ID = os.getenv("YOOMONEY_SHOP_ID")
@@ -47,3 +86,14 @@ try:
     ADMIN_IDS = [int(x.strip()) for x in ADMIN_IDS_RAW.split(',')]
 except ValueError:
     raise ValueError("❌ ADMIN_IDS должен быть строкой с ID, разделёнными запятой, например: 123,456,789")
+
+# --- База данных ---
+DB_PATH = os.getenv("DB_PATH", "trainer_bot.db")
+# Архив старых тренировок (подключается к основной базе через ATTACH)
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", os.path.splitext(DB_PATH)[0] + "_archive.db")
+# Резервные копии (utils/backup.py): каталог и сколько последних хранить
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+
+# --- Таблица калорийности продуктов для /diet ---
+FOODS_PATH = os.getenv("FOODS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv"))
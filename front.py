@@ -0,0 +1,80 @@
+# front.py
+# Запуск в несколько процессов: этот процесс принимает вебхук Telegram и
+# раздаёт апдейты BOT_WORKERS обработчикам (bot.py) по хешу user_id
+# (utils/sharding.py). Админка (порт 8001) и фоновые задачи — в нулевом обработчике.
+#
+#   BOT_WORKERS=4 python front.py
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from flask import Flask, request, jsonify
+
+from config import API_TOKEN, WEBHOOK_URL, TELEGRAM_API_URL, BOT_WORKERS
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_RATE_LIMIT
+from utils.logging_setup import setup_logging
+from utils.sharding import WorkerPool, WorkerUnavailable
+
+logger = logging.getLogger("front")
+
+webhook_app = Flask(__name__)
+pool = None  # WorkerPool, создаётся в main()
+
+
+@webhook_app.route('/webhook', methods=['POST'])
+def webhook():
+    if request.headers.get('Content-Type', '').lower() != 'application/json':
+        logger.warning("Получен запрос на /webhook с неправильным Content-Type")
+        return '', 403
+    try:
+        pool.dispatch(request.get_data())
+    except ValueError as e:
+        logger.error(f"Ошибка при десериализации JSON: {e}")
+        return '', 400
+    except WorkerUnavailable as e:
+        logger.error(f"Апдейт не передан: {e}")
+        return '', 503
+    return '', 200
+
+
+@webhook_app.route('/workers')
+def workers():
+    # Только для локальной проверки: порт вебхука закрыт снаружи прокси
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return '', 403
+    return jsonify(pool.snapshot())
+
+
+async def set_webhook():
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    else:
+        session = AiohttpSession()
+    bot = Bot(token=API_TOKEN, session=session)
+    try:
+        await bot.set_webhook(WEBHOOK_URL)
+        logger.info(f"📡 Вебхук установлен на {WEBHOOK_URL}")
+    finally:
+        await bot.session.close()
+
+
+def main():
+    global pool
+    setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_RATE_LIMIT, LOG_FILE)
+    pool = WorkerPool(BOT_WORKERS)
+    pool.start()
+    logger.info(f"🧵 Запущено обработчиков: {BOT_WORKERS}")
+    asyncio.run(set_webhook())
+
+    from waitress import serve
+    logger.info("🌐 Flask (Waitress) вебхука запускается на 0.0.0.0:8000...")
+    try:
+        serve(webhook_app, host='0.0.0.0', port=8000)
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# loadtest/compression_bench.py
+# Замер сжатия текстов тренировок: размер базы, время записи и чтения
+# для текста как есть, zlib без словаря, встроенного и обученного словаря.
+# Тексты генерируются в формате ответа модели с разными упражнениями и числами.
+#
+#   python -m loadtest.compression_bench --rows 20000
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import zlib
+
+from utils.text_compression import SEED_DICTIONARY, train_dictionary, compress_text, decompress_text
+
+EXERCISES = [
+    "Приседания", "Приседания с гантелями", "Отжимания от пола", "Отжимания от скамьи", "Выпады",
+    "Выпады назад", "Планка", "Боковая планка", "Подтягивания", "Австралийские подтягивания",
+    "Становая тяга", "Румынская тяга", "Жим лёжа", "Жим гантелей сидя", "Тяга гантели в наклоне",
+    "Тяга верхнего блока", "Скручивания", "Подъём ног в висе", "Берпи", "Ягодичный мостик",
+    "Махи гирей", "Гоблет-присед", "Фермерская прогулка", "Разгибание рук на блоке", "Подъём на носки",
+]
+NOTES = [
+    "плавно, без рывков", "на каждую ногу", "следи за техникой", "отдых между подходами 60 секунд",
+    "держи спину прямой", "колени не выходят за носки", "дыхание ровное", "темп медленный",
+]
+HEADERS = ["**Разминка (5–7 минут)**", "**Основная часть**", "**Заминка (5 минут)**"]
+
+
+def fake_training(rng):
+    lines = [f"Привет! Вот твоя тренировка на сегодня ({rng.choice(['силовая', 'круговая', 'на всё тело'])}).", ""]
+    for header, count in zip(HEADERS, (rng.randint(1, 2), rng.randint(4, 7), rng.randint(1, 2))):
+        lines.append(header)
+        for name in rng.sample(EXERCISES, count):
+            lines.append(f"- Упражнение: {name}")
+            lines.append(f"- Подходы: {rng.randint(1, 5)}")
+            lines.append(f"- Повторы: {rng.choice([8, 10, 12, 15, 20])}")
+            if rng.random() < 0.5:
+                lines.append(f"- Вес: {rng.choice([5, 8, 10, 12.5, 16, 20, 30, 40])} кг")
+            if rng.random() < 0.4:
+                lines.append(f"- Примечание: {rng.choice(NOTES)}")
+            lines.append("")
+    lines.append("Пей воду и не забывай про восстановление. Удачной тренировки! 💪")
+    return "\n".join(lines)
+
+
+def bench(name, texts, encode, decode, reads):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE trainings (id INTEGER PRIMARY KEY, user_id INTEGER, content TEXT)")
+    start = time.perf_counter()
+    with db:
+        db.executemany(
+            "INSERT INTO trainings (user_id, content) VALUES (?, ?)",
+            ((i % 1000, encode(t)) for i, t in enumerate(texts)),
+        )
+    write_s = time.perf_counter() - start
+    db.execute("VACUUM")
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    for row_id in reads:
+        value = db.execute("SELECT content FROM trainings WHERE id = ?", (row_id,)).fetchone()[0]
+        assert decode(value) == texts[row_id - 1]
+    read_us = (time.perf_counter() - start) / len(reads) * 1e6
+    db.close()
+    os.remove(path)
+    return name, size, write_s / len(texts) * 1e6, read_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер сжатия текстов тренировок")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = [fake_training(rng) for _ in range(args.rows)]
+    reads = [rng.randint(1, args.rows) for _ in range(args.reads)]
+    trained = train_dictionary(texts[:1000])
+
+    results = [
+        bench("text", texts, lambda t: t, lambda v: v, reads),
+        bench("zlib", texts, lambda t: zlib.compress(t.encode("utf-8"), 9),
+              lambda v: zlib.decompress(v).decode("utf-8"), reads),
+        bench("seed dict", texts, lambda t: compress_text(t, 0, SEED_DICTIONARY),
+              lambda v: decompress_text(v, SEED_DICTIONARY), reads),
+        bench("trained dict", texts, lambda t: compress_text(t, 1, trained),
+              lambda v: decompress_text(v, trained), reads),
+    ]
+    raw_chars = sum(len(t.encode("utf-8")) for t in texts) / len(texts)
+    print(f"{args.rows} тренировок, в среднем {raw_chars:.0f} байт текста, словарь {len(trained)} байт")
+    print(f"{'вариант':<14}{'база, КБ':>10}{'× к тексту':>12}{'запись, мкс':>13}{'чтение, мкс':>13}")
+    base = results[0][1]
+    for name, size, write_us, read_us in results:
+        print(f"{name:<14}{size / 1024:>10.0f}{base / size:>12.2f}{write_us:>13.1f}{read_us:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
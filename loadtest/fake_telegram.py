@@ -0,0 +1,91 @@
+# loadtest/fake_telegram.py
+# Заглушка Telegram Bot API для нагрузочных тестов.
+# Отвечает на все методы, которые вызывает бот, с настраиваемой задержкой,
+# и считает вызовы по методам. flood_rate > 0 — как настоящий Telegram,
+# отвечает 429 (RetryAfter), если за последнюю секунду запросов больше.
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+
+class FakeTelegramServer:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, flood_rate=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.flood_rate = flood_rate
+        self._recent = deque()
+        self.calls = Counter()
+        self._message_ids = itertools.count(1_000_000)
+        self._runner = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def _message(self, chat_id, **extra):
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "LoadTestBot"},
+        }
+        msg.update(extra)
+        return msg
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if self.flood_rate:
+            now = time.monotonic()
+            while self._recent and self._recent[0] < now - 1:
+                self._recent.popleft()
+            if len(self._recent) >= self.flood_rate:
+                self.calls["429"] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }, status=429)
+            self._recent.append(now)
+        if request.content_type in ("multipart/form-data", "application/x-www-form-urlencoded"):
+            form = await request.post()
+            params = {k: v for k, v in form.items() if isinstance(v, str)}
+        else:
+            raw = await request.read()
+            params = json.loads(raw) if raw else {}
+
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        chat_id = params.get("chat_id", 0)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[{"file_id": "p", "file_unique_id": "p", "width": 1000, "height": 500}])
+        elif method == "editMessageReplyMarkup":
+            result = self._message(chat_id, text="")
+        else:
+            # deleteMessage, answerCallbackQuery, setWebhook и т.п.
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port=0):
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
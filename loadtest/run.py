@@ -0,0 +1,374 @@
+# loadtest/run.py
+# Нагрузочный тест бота: прогоняет синтетические апдейты через dp.feed_update
+# и через Flask-эндпоинт /webhook против локальной заглушки Bot API и
+# заглушки OpenAI-совместимого сервера.
+#
+# Запуск из корня репозитория:
+#   python -m loadtest.run --users 20 --repeat 5 --llm-latency 300
+#   python -m loadtest.run --scenarios training,food --mode webhook --compare latest
+#   python -m loadtest.run --workers 4   # апдейты через front-процессы (utils/sharding.py)
+#
+# Результаты сохраняются в loadtest/results/<время>_<коммит>.json.
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .fake_telegram import FakeTelegramServer
+from .stub_llm import StubLLMServer
+from .scenarios import SCENARIOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "loadtest", "results")
+
+# Пользователи для каждого сценария берутся из своего диапазона ID
+USER_ID_BASE = 10_000_000
+USER_ID_STEP = 1_000_000
+BULK_USER_BASE = 90_000_000  # получатели рассылки (--bulk), не пересекаются со сценариями
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Нагрузочный тест Telegram-бота")
+    p.add_argument("--scenarios", default=",".join(SCENARIOS), help="Список сценариев через запятую")
+    p.add_argument("--mode", choices=["feed", "webhook", "both"], default="both")
+    p.add_argument("--users", type=int, default=20, help="Пользователей на сценарий")
+    p.add_argument("--repeat", type=int, default=3, help="Повторов сценария на пользователя")
+    p.add_argument("--concurrency", type=int, default=20, help="Одновременно активных пользователей")
+    p.add_argument("--think-ms", type=float, default=0.0, help="Пауза пользователя между апдейтами, мс")
+    p.add_argument("--history", type=int, default=365, help="Записей веса на пользователя при подготовке")
+    p.add_argument("--llm-latency", type=float, default=200.0, help="Базовая задержка LLM, мс")
+    p.add_argument("--llm-jitter", type=float, default=50.0, help="Случайная добавка к задержке LLM, мс")
+    p.add_argument("--llm-per-token", type=float, default=0.0, help="Задержка LLM на токен ответа, мс")
+    p.add_argument("--llm-error-rate", type=float, default=0.0, help="Доля ответов LLM с ошибкой 503")
+    p.add_argument("--llm-models", default=None,
+                   help="Модели для роутера через запятую (LLM_MODELS), например fast,slow")
+    p.add_argument("--llm-model-latency", default="",
+                   help="Задержки отдельных моделей: модель=мс[:разброс_мс],... например slow=200:5000")
+    p.add_argument("--no-hedge", action="store_true", help="Отключить дублирующие запросы к LLM")
+    p.add_argument("--tg-latency", type=float, default=5.0, help="Задержка Bot API, мс")
+    p.add_argument("--tg-jitter", type=float, default=5.0, help="Случайная добавка к задержке Bot API, мс")
+    p.add_argument("--tg-rate", type=float, default=0.0,
+                   help="Лимит бота на запросы к Bot API в секунду (TELEGRAM_RATE_LIMIT, 0 — без лимита)")
+    p.add_argument("--tg-flood-rate", type=int, default=0,
+                   help="Заглушка Bot API отвечает 429, если запросов в секунду больше (0 — никогда)")
+    p.add_argument("--bulk", type=int, default=0,
+                   help="Сообщений рассылки, поставленных в очередь в начале каждого сценария")
+    p.add_argument("--workers", type=int, default=0,
+                   help="Процессов-обработчиков как у front.py (режим workers; 0 — один процесс)")
+    p.add_argument("--log-level", default="WARNING", help="Уровень логов бота во время теста")
+    p.add_argument("--db", default=None, help="Путь к БД (по умолчанию временная)")
+    p.add_argument("--label", default="", help="Метка прогона (попадает в имя файла)")
+    p.add_argument("--no-save", action="store_true", help="Не сохранять результаты")
+    p.add_argument("--compare", default=None, help="Файл результатов для сравнения или 'latest'")
+    return p.parse_args(argv)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(latencies, errors, wall):
+    ms = [x * 1000 for x in latencies]
+    return {
+        "count": len(ms),
+        "errors": errors,
+        "p50_ms": round(percentile(ms, 0.50), 2),
+        "p95_ms": round(percentile(ms, 0.95), 2),
+        "p99_ms": round(percentile(ms, 0.99), 2),
+        "mean_ms": round(statistics.fmean(ms), 2) if ms else 0.0,
+        "updates_per_s": round(len(ms) / wall, 2) if wall else 0.0,
+        "wall_s": round(wall, 3),
+    }
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def parse_model_latency(spec):
+    """'slow=200:5000,fast=150' -> {'slow': (200.0, 5000.0), 'fast': 150.0}"""
+    result = {}
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        model, _, value = item.partition("=")
+        base, _, jitter = value.partition(":")
+        result[model] = (float(base), float(jitter)) if jitter else float(base)
+    return result
+
+
+def start_backends(args):
+    """Поднимает заглушки в отдельном потоке со своим циклом, чтобы их
+    задержки не зависели от нагрузки на цикл бота."""
+    tg = FakeTelegramServer(latency_ms=args.tg_latency, jitter_ms=args.tg_jitter, flood_rate=args.tg_flood_rate)
+    llm = StubLLMServer(latency_ms=args.llm_latency, jitter_ms=args.llm_jitter,
+                        per_token_ms=args.llm_per_token, error_rate=args.llm_error_rate,
+                        model_latency=parse_model_latency(args.llm_model_latency))
+    backend_loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(backend_loop)
+        backend_loop.run_until_complete(tg.start())
+        backend_loop.run_until_complete(llm.start())
+        ready.set()
+        backend_loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return tg, llm, backend_loop
+
+
+def import_bot(args, tg, llm, workdir):
+    """Импортирует bot.py, направив его на заглушки и временную БД."""
+    os.environ["API_TOKEN"] = "123456:LOADTEST"
+    os.environ["TELEGRAM_API_URL"] = tg.base_url
+    os.environ["OPENROUTER_API_KEY"] = "loadtest"
+    os.environ["OPENROUTER_BASE_URL"] = llm.base_url
+    if args.llm_models:
+        os.environ["LLM_MODELS"] = args.llm_models
+    os.environ["LLM_HEDGE"] = "0" if args.no_hedge else "1"
+    os.environ["TELEGRAM_RATE_LIMIT"] = str(args.tg_rate)
+    os.environ["DB_PATH"] = args.db or os.path.join(workdir, "loadtest.db")
+    os.environ["LOG_LEVEL"] = args.log_level.upper()  # для процессов-обработчиков
+    for key, value in {
+        "YOOMONEY_SHOP_ID": "0", "YOOMONEY_SECRET_KEY": "0", "WEBHOOK_URL": "http://127.0.0.1/webhook",
+        "SECRET_KEY": "loadtest", "ADMIN_IDS": "1",
+    }.items():
+        os.environ.setdefault(key, value)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import bot as app
+    logging.getLogger().setLevel(args.log_level.upper())
+    return app
+
+
+def seed_users(app, user_ids, history):
+    """Профиль, подписка и история веса для сценариев, которым нужен готовый пользователь."""
+    from datetime import datetime, timedelta
+    start = datetime.now() - timedelta(days=history)
+    for uid in user_ids:
+        app.save_user_profile(uid, {
+            "name": f"Тест{uid}", "age": 30, "gender": "мужской", "height": 180, "weight": 80.0,
+            "goal": "похудеть", "training_location": "зал", "level": "новичок",
+        })
+        app.grant_subscription(uid, days=30)
+        rows = [(uid, 80.0 - d * 0.01, (start + timedelta(days=d)).strftime("%Y-%m-%d %H:%M:%S")) for d in range(history)]
+        app.cur.executemany("INSERT INTO weights (user_id, weight, date) VALUES (?, ?, ?)", rows)
+    app.conn.commit()
+
+
+class CompletionTracker:
+    """Outer-middleware диспетчера: отмечает момент завершения обработки апдейта."""
+
+    def __init__(self):
+        self.waiting = {}
+
+    async def __call__(self, handler, event, data):
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            fut = self.waiting.pop(event.update_id, None)
+            if fut is not None and not fut.done():
+                fut.set_result((time.perf_counter(), error))
+
+
+async def run_scenario(app, tracker, name, mode, user_ids, args, pool=None):
+    from aiogram import types
+    builder, _ = SCENARIOS[name]
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+    loop = asyncio.get_running_loop()
+    client = app.webhook_app.test_client() if mode == "webhook" else None
+
+    async def send(raw):
+        nonlocal errors
+        if mode == "feed":
+            t0 = time.perf_counter()
+            try:
+                await app.dp.feed_update(app.bot, types.Update.model_validate(raw))
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+            return
+        fut = loop.create_future()
+        tracker.waiting[raw["update_id"]] = fut
+        body = json.dumps(raw)
+        t0 = time.perf_counter()
+        if mode == "workers":
+            pool.dispatch(body)
+        else:
+            resp = await loop.run_in_executor(None, lambda: client.post("/webhook", data=body, content_type="application/json"))
+            if resp.status_code != 200:
+                tracker.waiting.pop(raw["update_id"], None)
+                errors += 1
+                return
+        done_at, error = await fut
+        if error is not None:
+            errors += 1
+        latencies.append(done_at - t0)
+
+    async def user_flow(uid):
+        async with sem:
+            for i in range(args.repeat):
+                for raw in builder(uid, i):
+                    await send(raw)
+                    if args.think_ms:
+                        await asyncio.sleep(args.think_ms / 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(uid) for uid in user_ids))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def start_pool(args, tracker):
+    """Процессы-обработчики как у front.py; окончание апдейта приходит по шине."""
+    from utils.sharding import WorkerPool
+    loop = asyncio.get_running_loop()
+    pool = WorkerPool(args.workers)
+
+    def resolve(update_id, error):
+        fut = tracker.waiting.pop(update_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result((time.perf_counter(), error))
+
+    pool.on_done = lambda update_id, error: loop.call_soon_threadsafe(resolve, update_id, error)
+    await loop.run_in_executor(None, pool.start)
+    await loop.run_in_executor(None, pool.ready.wait)
+    return pool
+
+
+async def run_all(args, app, tg, llm):
+    tracker = CompletionTracker()
+    app.dp.update.outer_middleware(tracker)
+    app.loop = asyncio.get_running_loop()  # используется эндпоинтом /webhook
+    app.notification_queue = asyncio.Queue(maxsize=app.NOTIFY_QUEUE_SIZE)
+    sender = asyncio.create_task(app.notification_sender())
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    modes = ["feed", "webhook"] if args.mode == "both" else [args.mode]
+    pool = None
+    if args.workers:
+        if args.bulk:
+            raise SystemExit("--bulk в режиме --workers не поддерживается")
+        # Этот процесс только готовит базу и раздаёт апдейты, как front.py
+        modes = ["workers"]
+        pool = await start_pool(args, tracker)
+    results = {}
+    try:
+        for m_idx, mode in enumerate(modes):
+            for s_idx, name in enumerate(names):
+                if name not in SCENARIOS:
+                    raise SystemExit(f"Неизвестный сценарий: {name}")
+                base = USER_ID_BASE + (m_idx * len(SCENARIOS) + s_idx) * USER_ID_STEP
+                user_ids = list(range(base, base + args.users))
+                if SCENARIOS[name][1]:
+                    seed_users(app, user_ids, args.history)
+                tg.calls.clear()
+                llm.calls.clear()
+                if args.bulk:
+                    # Рассылка идёт фоном, пока сценарий меряет задержку ответов
+                    bulk_ids = range(BULK_USER_BASE, BULK_USER_BASE + args.bulk)
+                    asyncio.create_task(app.enqueue_broadcast(list(bulk_ids), "Рассылка нагрузочного теста"))
+                stats = await run_scenario(app, tracker, name, mode, user_ids, args, pool)
+                if args.bulk:
+                    stats["bulk_pending"] = app.notification_queue.qsize()
+                    while not app.notification_queue.empty():
+                        app.notification_queue.get_nowait()
+                        app.notification_queue.task_done()
+                stats["telegram_calls"] = dict(tg.calls)
+                stats["llm_calls"] = sum(llm.calls.values())
+                results.setdefault(mode, {})[name] = stats
+                if pool:
+                    stats["per_worker"] = [w["dispatched"] for w in pool.snapshot()]
+                print(f"{mode:8} {name:14} n={stats['count']:5} err={stats['errors']:3} "
+                      f"p50={stats['p50_ms']:9.2f} p95={stats['p95_ms']:9.2f} p99={stats['p99_ms']:9.2f} ms "
+                      f"{stats['updates_per_s']:8.2f} upd/s", flush=True)
+    finally:
+        sender.cancel()
+        if pool:
+            await asyncio.get_running_loop().run_in_executor(None, pool.stop)
+        await app.bot.session.close()
+    return results
+
+
+def load_previous(ref):
+    if ref == "latest":
+        files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+        if not files:
+            return None, None
+        ref = files[-1]
+    with open(ref, encoding="utf-8") as f:
+        return ref, json.load(f)
+
+
+def print_comparison(prev_path, prev, current):
+    print(f"\nСравнение с {os.path.basename(prev_path)} (коммит {prev.get('revision')}):")
+    for mode, scenarios in current.items():
+        for name, stats in scenarios.items():
+            old = prev.get("results", {}).get(mode, {}).get(name)
+            if not old:
+                continue
+            parts = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "updates_per_s"):
+                before, after = old[key], stats[key]
+                delta = (after - before) / before * 100 if before else 0.0
+                parts.append(f"{key}: {before} → {after} ({delta:+.1f}%)")
+            print(f"  {mode:8} {name:14} " + "; ".join(parts))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    prev_path, prev = (None, None)
+    if args.compare:
+        prev_path, prev = load_previous(args.compare)
+
+    tg, llm, backend_loop = start_backends(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        app = import_bot(args, tg, llm, workdir)
+        results = asyncio.run(run_all(args, app, tg, llm))
+        app.conn.close()
+    asyncio.run_coroutine_threadsafe(tg.stop(), backend_loop).result()
+    asyncio.run_coroutine_threadsafe(llm.stop(), backend_loop).result()
+    backend_loop.call_soon_threadsafe(backend_loop.stop)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("compare", "no_save")},
+        "results": results,
+    }
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        label = f"_{args.label}" if args.label else ""
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{report['revision']}{label}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены: {path}")
+    if prev:
+        print_comparison(prev_path, prev, results)
+
+
+if __name__ == "__main__":
+    main()
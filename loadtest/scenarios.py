@@ -0,0 +1,124 @@
+# loadtest/scenarios.py
+# Синтетические апдейты Telegram. Каждый сценарий для одного пользователя
+# возвращает список апдейтов, которые нужно отправить строго по порядку
+# (как их отправил бы живой пользователь); разные пользователи идут параллельно.
+import itertools
+import time
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+
+def message_update(user_id, text):
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id, data):
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "LoadTestBot"},
+                "text": "...",
+            },
+        },
+    }
+
+
+def questionnaire(user_id, i):
+    return [
+        message_update(user_id, "/start"),
+        message_update(user_id, f"Тест{user_id}"),
+        message_update(user_id, "30"),
+        callback_update(user_id, "gender_male"),
+        message_update(user_id, "180"),
+        message_update(user_id, "80.5"),
+        callback_update(user_id, "goal_lose_weight"),
+        callback_update(user_id, "location_gym"),
+        callback_update(user_id, "level_beginner"),
+    ]
+
+
+def training(user_id, i):
+    return [message_update(user_id, "/training")]
+
+
+def food(user_id, i):
+    return [message_update(user_id, "/food")]
+
+
+def weight(user_id, i):
+    return [message_update(user_id, f"/weight {70 + (i % 20) / 10}")]
+
+
+def weight_graph(user_id, i):
+    return [message_update(user_id, "/weight_graph")]
+
+
+def profile(user_id, i):
+    return [message_update(user_id, "/profile")]
+
+
+def report(user_id, i):
+    return [message_update(user_id, "/report")]
+
+
+def progress(user_id, i):
+    return [
+        message_update(user_id, f"/progress вес={80 - i / 10} талия={90 - i / 10} жим={60 + i}"),
+        message_update(user_id, "/progress_chart"),
+        message_update(user_id, "/progress_chart"),
+    ]
+
+
+def chat(user_id, i):
+    # Команда перед вопросом: после ответа бота у пользователя есть запись
+    # в user_states без шага анкеты
+    return [
+        message_update(user_id, "/profile"),
+        message_update(user_id, f"Как мне восстановиться после тренировки {i}?"),
+    ]
+
+
+def callbacks(user_id, i):
+    return [
+        callback_update(user_id, "training_completed"),
+        callback_update(user_id, "training_postpone"),
+        callback_update(user_id, "schedule_3"),
+    ]
+
+
+# name -> (builder, нужен ли заранее созданный профиль с подпиской)
+SCENARIOS = {
+    "questionnaire": (questionnaire, False),
+    "training": (training, True),
+    "food": (food, True),
+    "weight": (weight, True),
+    "weight_graph": (weight_graph, True),
+    "profile": (profile, True),
+    "report": (report, True),
+    "progress": (progress, True),
+    "callbacks": (callbacks, True),
+    "chat": (chat, True),
+}
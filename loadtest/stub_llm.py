@@ -0,0 +1,143 @@
+# loadtest/stub_llm.py
+# Заглушка OpenAI-совместимого API (/chat/completions) с настраиваемой задержкой.
+# Задержка = latency_ms + jitter + per_token_ms * completion_tokens, чтобы
+# длина ответа влияла на время генерации так же, как у настоящей модели.
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+TRAINING_TEXT = """**Разминка (5–7 минут)**
+- Упражнение: Суставная гимнастика
+- Подходы: 1
+- Повторы: 10
+- Примечание: плавно, без рывков
+
+**Основная часть**
+- Упражнение: Приседания
+- Подходы: 3
+- Повторы: 12
+- Вес: 20 кг
+
+- Упражнение: Отжимания от пола
+- Подходы: 3
+- Повторы: 10
+
+- Упражнение: Тяга гантели в наклоне
+- Подходы: 3
+- Повторы: 12
+- Вес: 10 кг
+
+- Упражнение: Выпады
+- Подходы: 3
+- Повторы: 10
+- Примечание: на каждую ногу
+
+- Упражнение: Планка
+- Подходы: 3
+- Повторы: 1
+- Примечание: 40 секунд
+
+**Заминка**
+- Упражнение: Растяжка
+- Подходы: 1
+- Повторы: 1
+- Примечание: 5 минут, дыхание ровное
+"""
+
+FOOD_TEXT = """- Завтрак: овсяная каша на молоке (60 г хлопьев), банан, 2 яйца всмятку, чай без сахара
+- Перекус (если нужно): греческий йогурт 150 г, горсть орехов
+- Обед: куриная грудка 150 г, гречка 80 г (сухой вес), салат из свежих овощей с оливковым маслом
+- Перекус (если нужно): творог 5% 150 г, яблоко
+- Ужин: запечённая рыба 150 г, тушёные овощи 200 г
+- Полезные напитки: вода 1.5–2 л, зелёный чай
+"""
+
+CHAT_TEXT = "Хороший вопрос! Главное — регулярность и постепенная прогрессия нагрузки. Следи за техникой и сном."
+
+
+def _estimate_tokens(text):
+    # Грубая оценка: ~4 символа на токен
+    return max(1, len(text) // 4)
+
+
+class StubLLMServer:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, per_token_ms=0.0, error_rate=0.0, model_latency=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_token_ms = per_token_ms
+        self.error_rate = error_rate
+        # {model: latency_ms или (latency_ms, jitter_ms)} — переопределение для отдельных моделей
+        self.model_latency = model_latency or {}
+        self.calls = Counter()
+        self._runner = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1/"
+
+    def _pick_text(self, messages):
+        # Только первый системный промпт: дальше может идти контекст (профиль, выжимка беседы)
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        if "диетолог" in system:
+            return FOOD_TEXT
+        if "тренер" in system and "тренировк" in system:
+            return TRAINING_TEXT
+        return CHAT_TEXT
+
+    async def _completions(self, request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        self.calls[model] += 1
+        messages = body.get("messages", [])
+        text = self._pick_text(messages)
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens")
+        if max_tokens and _estimate_tokens(text) > max_tokens:
+            text = text[:max_tokens * 4]
+            finish_reason = "length"
+        completion_tokens = _estimate_tokens(text)
+        prompt_tokens = sum(_estimate_tokens(m.get("content", "")) for m in messages)
+
+        base = self.model_latency.get(model, (self.latency_ms, self.jitter_ms))
+        base, jitter = base if isinstance(base, tuple) else (base, self.jitter_ms)
+        delay = base + (random.uniform(0, jitter) if jitter else 0.0) + self.per_token_ms * completion_tokens
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "stub overloaded", "type": "server_error"}}, status=503)
+
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
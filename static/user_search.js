@@ -0,0 +1,35 @@
+// Подсказки при вводе ID пользователя: <input data-user-search list="...">
+// Запрашивает /admin/search и заполняет связанный <datalist>.
+(function () {
+    function debounce(fn, ms) {
+        var timer = null;
+        return function () {
+            var args = arguments, self = this;
+            clearTimeout(timer);
+            timer = setTimeout(function () { fn.apply(self, args); }, ms);
+        };
+    }
+
+    document.querySelectorAll('input[data-user-search]').forEach(function (input) {
+        var list = document.getElementById(input.getAttribute('list'));
+        var lastQuery = null;
+        input.addEventListener('input', debounce(function () {
+            var q = input.value.trim();
+            if (!q || q === lastQuery) return;
+            lastQuery = q;
+            fetch('/admin/search?q=' + encodeURIComponent(q))
+                .then(function (r) { return r.ok ? r.json() : []; })
+                .then(function (users) {
+                    if (q !== lastQuery) return;  // пришёл устаревший ответ
+                    list.innerHTML = '';
+                    users.forEach(function (u) {
+                        var option = document.createElement('option');
+                        option.value = u.user_id;
+                        option.label = u.name || '';
+                        option.textContent = u.user_id + ' — ' + (u.name || '');
+                        list.appendChild(option);
+                    });
+                });
+        }, 150));
+    });
+})();
@@ -0,0 +1,180 @@
+# utils/backup.py
+# Резервные копии базы на ходу. Копирование идёт через backup API SQLite
+# небольшими порциями страниц с паузой между ними, на отдельном соединении:
+# обработчики бота между порциями пишут как обычно. Копия — согласованный
+# снимок основной базы и архива тренировок на момент начала: всё время
+# копирования держится одна читающая транзакция (WAL), поэтому чужие записи
+# не перезапускают копирование. Цена — WAL не сворачивается до конца копии.
+#
+# Каждая копия — каталог <dir>/<время>/ с файлами основной базы и архива.
+# Копия пишется во временный каталог, проверяется (PRAGMA integrity_check)
+# и только потом получает своё имя; старые копии сверх keep удаляются.
+#
+# Восстановление (бот должен быть остановлен):
+#   python -m utils.backup list
+#   python -m utils.backup restore backups/20261019-033000
+#   python -m utils.backup create
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PAGES = 256           # страниц за шаг (1 МБ при странице 4 КБ)
+BACKUP_PAUSE_SECONDS = 0.01  # пауза между шагами
+BACKUP_KEEP = 7
+NAME_FORMAT = "%Y%m%d-%H%M%S"
+TMP_SUFFIX = ".tmp"
+
+
+class BackupError(Exception):
+    pass
+
+
+def _copy_schema(source, target_path, name, pages, pause):
+    """Копирует схему name соединения source в файл target_path порциями по pages страниц."""
+    target = sqlite3.connect(target_path)
+    try:
+        # progress вызывается после каждого шага: здесь и уступаем остальным
+        source.backup(target, pages=pages, name=name, progress=lambda *_: time.sleep(pause))
+    finally:
+        target.close()
+
+
+def check_integrity(path):
+    """Возвращает None, если файл базы цел, иначе текст первой ошибки."""
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = db.execute("PRAGMA integrity_check(1)").fetchone()[0]
+    finally:
+        db.close()
+    return None if result == "ok" else result
+
+
+def create_backup(db_path, archive_path, backup_dir, keep=BACKUP_KEEP, pages=BACKUP_PAGES,
+                  pause=BACKUP_PAUSE_SECONDS):
+    """Делает копию основной базы и архива, проверяет её и удаляет старые.
+    Возвращает путь к каталогу копии; при ошибке — BackupError, временные файлы удаляются."""
+    started = time.monotonic()
+    final_dir = os.path.join(backup_dir, datetime.now().strftime(NAME_FORMAT))
+    tmp_dir = final_dir + TMP_SUFFIX
+    os.makedirs(tmp_dir, exist_ok=True)
+    files = {"main": os.path.basename(db_path), "archive": os.path.basename(archive_path)}
+    try:
+        source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)
+        try:
+            source.execute("ATTACH DATABASE ? AS archive", (f"file:{archive_path}?mode=ro",))
+            # Читающая транзакция по обеим базам — снимок на текущий момент
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM main.sqlite_master")
+            source.execute("SELECT count(*) FROM archive.sqlite_master")
+            for schema, filename in files.items():
+                _copy_schema(source, os.path.join(tmp_dir, filename), schema, pages, pause)
+            source.execute("COMMIT")
+        finally:
+            source.close()
+        for filename in files.values():
+            error = check_integrity(os.path.join(tmp_dir, filename))
+            if error:
+                raise BackupError(f"Копия {filename} повреждена: {error}")
+        os.replace(tmp_dir, final_dir)
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if isinstance(e, BackupError):
+            raise
+        raise BackupError(f"Ошибка резервного копирования: {e}") from e
+
+    removed = rotate_backups(backup_dir, keep)
+    size = sum(os.path.getsize(os.path.join(final_dir, f)) for f in files.values())
+    logger.info(f"Резервная копия {final_dir}: {size / 1024 / 1024:.1f} МБ за "
+                f"{time.monotonic() - started:.1f} с, удалено старых: {len(removed)}")
+    return final_dir
+
+
+def list_backups(backup_dir):
+    """Готовые копии (без незавершённых), от старых к новым."""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = []
+    for name in os.listdir(backup_dir):
+        try:
+            datetime.strptime(name, NAME_FORMAT)
+        except ValueError:
+            continue
+        names.append(name)
+    return [os.path.join(backup_dir, name) for name in sorted(names)]
+
+
+def rotate_backups(backup_dir, keep):
+    """Удаляет копии сверх keep последних и брошенные временные каталоги."""
+    removed = list_backups(backup_dir)[:-keep] if keep > 0 else []
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    for name in os.listdir(backup_dir):
+        if name.endswith(TMP_SUFFIX):
+            shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+    return removed
+
+
+def restore_backup(backup_path, db_path, archive_path):
+    """Заменяет базу и архив копией из каталога backup_path. Бот должен быть
+    остановлен. Запись идёт через backup API, поэтому WAL целевой базы
+    учитывается корректно; копия перед этим проверяется."""
+    pairs = [(os.path.join(backup_path, os.path.basename(path)), path) for path in (db_path, archive_path)]
+    for source_path, _ in pairs:
+        if not os.path.exists(source_path):
+            raise BackupError(f"В копии нет файла {source_path}")
+        error = check_integrity(source_path)
+        if error:
+            raise BackupError(f"Копия {source_path} повреждена: {error}")
+    for source_path, target_path in pairs:
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(target_path, timeout=0)
+        try:
+            source.backup(target)
+            target.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError as e:
+            raise BackupError(f"Не удалось записать {target_path} (бот остановлен?): {e}") from e
+        finally:
+            target.close()
+            source.close()
+        logger.info(f"Восстановлено: {source_path} -> {target_path}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Резервные копии базы бота")
+    sub = p.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Показать копии")
+    sub.add_parser("create", help="Сделать копию сейчас")
+    restore = sub.add_parser("restore", help="Восстановить базу из копии (бот должен быть остановлен)")
+    restore.add_argument("path", help="Каталог копии (или 'latest')")
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from config import DB_PATH, ARCHIVE_DB_PATH, BACKUP_DIR, BACKUP_KEEP as keep
+
+    try:
+        if args.command == "list":
+            for path in list_backups(BACKUP_DIR):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                print(f"{path}  {size / 1024 / 1024:.1f} МБ")
+        elif args.command == "create":
+            print(create_backup(DB_PATH, ARCHIVE_DB_PATH, BACKUP_DIR, keep))
+        elif args.command == "restore":
+            path = args.path
+            if path == "latest":
+                backups = list_backups(BACKUP_DIR)
+                if not backups:
+                    raise BackupError("Копий нет")
+                path = backups[-1]
+            restore_backup(path, DB_PATH, ARCHIVE_DB_PATH)
+    except BackupError as e:
+        raise SystemExit(f"❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# utils/difficulty.py
+# Адаптивная сложность тренировок. Считается по состоянию, которое хранится
+# в users и поддерживается триггерами на trainings (см. bot.py):
+# training_window — исходы последних тренировок, новые первыми
+# ('c' — выполнена, 'm' — пропущена), training_streak — выполнено подряд.
+WINDOW_SIZE = 10
+MIN_LEVEL, MAX_LEVEL = 1, 5
+
+# Стартовый уровень по самооценке из анкеты
+BASE_LEVELS = {"новичок": 1, "средний": 2, "продвинутый": 3}
+
+LEVEL_DESCRIPTIONS = {
+    1: "лёгкие и простые упражнения",
+    2: "лёгкие упражнения с постепенным усложнением",
+    3: "средние упражнения",
+    4: "средние или сложные упражнения",
+    5: "сложные упражнения с высокой интенсивностью",
+}
+
+
+class Difficulty:
+    """level — 1–5, completion_rate — доля выполненных в окне (None — мало данных),
+    progression — рекомендуемое изменение нагрузки (+0.05 = +5%)."""
+
+    def __init__(self, level, completion_rate, progression):
+        self.level = level
+        self.completion_rate = completion_rate
+        self.progression = progression
+
+    @property
+    def description(self):
+        return LEVEL_DESCRIPTIONS[self.level]
+
+    @property
+    def progression_text(self):
+        if self.progression > 0:
+            return f"повысь нагрузку примерно на {self.progression:.0%} относительно недавних тренировок"
+        if self.progression < 0:
+            return f"снизь нагрузку примерно на {-self.progression:.0%}, пользователь пропускает тренировки"
+        return "сохрани нагрузку на уровне недавних тренировок"
+
+
+def compute_difficulty(window, streak, self_level=None):
+    """Уровень 1–5 и темп прогрессии по окну исходов и серии выполненных."""
+    window = (window or "")[:WINDOW_SIZE]
+    rate = window.count("c") / len(window) if len(window) >= 3 else None
+    level = BASE_LEVELS.get(self_level, 1)
+    if rate is not None:
+        level += (rate >= 0.8) - (rate < 0.5)
+    level += (streak >= 3) + (streak >= 8)
+    if window.startswith("mm"):
+        level -= 1
+    level = max(MIN_LEVEL, min(MAX_LEVEL, level))
+
+    if window.startswith("mm") or (rate is not None and rate < 0.5):
+        progression = -0.10
+    elif streak >= 3 and (rate is None or rate >= 0.8):
+        progression = 0.05 if streak < 8 else 0.10
+    else:
+        progression = 0.0
+    return Difficulty(level, rate, progression)
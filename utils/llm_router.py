@@ -0,0 +1,316 @@
+# utils/llm_router.py
+# Выбор модели для запроса к LLM. Для каждой модели (эндпоинта) хранится
+# скользящее окно задержек и исходов; запрос уходит самой быстрой исправной,
+# а если ответа нет дольше p90 — дублируется следующей ("hedged request"),
+# и берётся тот ответ, что пришёл первым. Ошибка одной модели сразу запускает
+# следующую, так что деградация провайдера бьёт только по хвосту задержек.
+# У каждой модели свой автомат отключения (circuit breaker): после серии ошибок
+# или таймаутов запросы к ней не отправляются, пока пробный запрос не пройдёт.
+# Весь вызов ограничен сроком (deadline); если все модели отключены — сразу LLMUnavailable.
+import asyncio
+import logging
+import random
+import time
+from collections import Counter, deque
+
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 50                 # последних запросов в статистике модели
+MIN_SAMPLES = 5             # меньше — p90 и доля ошибок ещё не считаются
+MAX_ERROR_RATE = 0.5
+FAILURE_THRESHOLD = 3       # ошибок/таймаутов подряд, после которых цепь размыкается
+RECOVERY_TIMEOUT = 30.0     # через сколько секунд пропустить пробный запрос
+MAX_RECOVERY_TIMEOUT = 300.0  # каждая неудачная проба удваивает паузу, но не больше
+EXPLORE_RATE = 0.05         # доля запросов, где первой идёт не лучшая модель (чтобы обновлять статистику)
+HEDGE_DEFAULT_DELAY = 8.0   # пока статистики мало
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MAX_DELAY = 30.0
+REQUEST_TIMEOUT = 120.0     # срок по умолчанию, если вызывающий не задал свой
+MIN_REQUEST_TIME = 0.5      # меньше — новую модель уже не запускаем
+
+
+class LLMUnavailable(Exception):
+    """Все модели отключены автоматом — запрос даже не отправлялся."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM недоступна, повтор через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Ни одна модель не ответила до срока."""
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, recovery_timeout=RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_recovery_timeout = recovery_timeout
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.transitions = Counter()  # "closed->open" -> сколько раз
+
+    def _move(self, state):
+        self.transitions[f"{self._state}->{state}"] += 1
+        logger.warning(f"LLM {self.name}: цепь {self._state} -> {state}")
+        self._state = state
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and time.monotonic() >= self.opened_at + self.recovery_timeout:
+            self._move(self.HALF_OPEN)
+        return self._state
+
+    @property
+    def retry_after(self):
+        """Сколько секунд до пробного запроса (0 — можно отправлять)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+
+    def available(self):
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self.probe_in_flight)
+
+    def acquire(self):
+        """Разрешение на запрос; в полуоткрытом состоянии — только один пробный."""
+        if not self.available():
+            return False
+        if self._state == self.HALF_OPEN:
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_in_flight = False
+        if self._state != self.CLOSED:
+            self.recovery_timeout = self.base_recovery_timeout
+            self._move(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.HALF_OPEN:
+            self.probe_in_flight = False
+            self.recovery_timeout = min(MAX_RECOVERY_TIMEOUT, self.recovery_timeout * 2)
+            self._open()
+        elif self._state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def release(self):
+        """Запрос отменён без результата (ответила другая модель) — проба не состоялась."""
+        self.probe_in_flight = False
+
+    def release_if_cancelled(self, task):
+        """Колбэк задачи запроса: отменённая до первого шага задача в _call не входит,
+        и без этого проба полуоткрытой цепи осталась бы занятой навсегда."""
+        if task.cancelled():
+            self.release()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._move(self.OPEN)
+
+
+class Endpoint:
+    def __init__(self, model, client, name=None):
+        self.model = model
+        self.client = client
+        self.name = name or model
+        self.latencies = deque(maxlen=WINDOW)  # только запросы, дождавшиеся ответа
+        self.outcomes = deque(maxlen=WINDOW)  # True — успех
+        # Отменённые, потому что другая модель ответила раньше: их задержка известна
+        # лишь снизу, поэтому в процентили не входит, а учитывается в оценке отдельно
+        self.lost = deque(maxlen=WINDOW)  # True — проиграл гонку, False — дождался ответа
+        self.lost_elapsed = deque(maxlen=WINDOW)
+        self.breaker = CircuitBreaker(self.name)
+        self.in_flight = 0
+
+    def record(self, latency, ok):
+        self.latencies.append(latency)
+        self.lost.append(False)
+        self.outcomes.append(ok)
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def record_timeout(self):
+        """Не ответила до срока всего вызова — для автомата это ошибка."""
+        self.outcomes.append(False)
+        self.breaker.record_failure()
+
+    def record_lost(self, elapsed):
+        """Запрос отменён, потому что другая модель ответила раньше: задержка не меньше elapsed."""
+        self.lost.append(True)
+        self.lost_elapsed.append(elapsed)
+        self.breaker.release()
+
+    @property
+    def error_rate(self):
+        if len(self.outcomes) < MIN_SAMPLES:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def lost_rate(self):
+        if len(self.lost) < MIN_SAMPLES:
+            return 0.0
+        return self.lost.count(True) / len(self.lost)
+
+    def percentile(self, q):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def healthy(self):
+        return self.breaker.available() and self.error_rate <= MAX_ERROR_RATE
+
+    @property
+    def score(self):
+        """Ожидаемая задержка; модели без статистики идут первыми, чтобы её набрать.
+        Проигранные гонки штрафуют оценку так же, как ошибки; модель, которая
+        только проигрывает, оценивается по самой долгой из проигранных попыток."""
+        p50 = self.percentile(0.5)
+        if p50 is None:
+            if not self.lost_elapsed:
+                return 0.0
+            p50 = max(self.lost_elapsed)
+        return p50 / max(0.05, (1 - self.error_rate) * (1 - self.lost_rate))
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "samples": len(self.latencies),
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "error_rate": self.error_rate,
+            "lost_rate": self.lost_rate,
+            "in_flight": self.in_flight,
+            "state": self.breaker.state,
+            "retry_after": self.breaker.retry_after,
+            "transitions": dict(self.breaker.transitions),
+        }
+
+
+class LLMRouter:
+    def __init__(self, endpoints, hedge=True):
+        self.endpoints = endpoints
+        self.hedge = hedge
+
+    @classmethod
+    def from_config(cls, models, api_key, hedge=True):
+        """models — список (модель, base_url). Клиенты с одинаковым base_url общие."""
+        clients = {}
+        endpoints = []
+        for model, base_url in models:
+            if base_url not in clients:
+                # Повторы делает сам роутер — через другую модель, а не ту же самую
+                clients[base_url] = AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                                max_retries=0, timeout=REQUEST_TIMEOUT)
+            name = model if len(set(url for _, url in models)) == 1 else f"{model}@{base_url}"
+            endpoints.append(Endpoint(model, clients[base_url], name))
+        return cls(endpoints, hedge=hedge)
+
+    def ranked(self):
+        """Модели, которым можно отправить запрос, лучшие первыми. Модели
+        с разомкнутой цепью сюда не попадают; с высокой долей ошибок — в конце."""
+        available = [e for e in self.endpoints if e.breaker.available()]
+        # При равной оценке (например, пока статистики нет ни у кого) — менее загруженная
+        healthy = sorted((e for e in available if e.healthy), key=lambda e: (e.score, e.in_flight))
+        if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        sick = sorted((e for e in available if not e.healthy), key=lambda e: e.error_rate)
+        return healthy + sick
+
+    def hedge_delay(self):
+        """p90 самой быстрой исправной модели: так дорого обходится и медленный
+        ответ лучшей модели, и пробный запрос к худшей."""
+        known = [p90 for p90 in (e.percentile(0.9) for e in self.endpoints if e.healthy) if p90 is not None]
+        if not known:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, min(known)))
+
+    async def _call(self, endpoint, kwargs, timeout):
+        endpoint.in_flight += 1
+        start = time.monotonic()
+        try:
+            completion = await endpoint.client.chat.completions.create(
+                model=endpoint.model, timeout=timeout, **kwargs
+            )
+        except asyncio.CancelledError:
+            endpoint.record_lost(time.monotonic() - start)
+            raise
+        except Exception:
+            endpoint.record(time.monotonic() - start, ok=False)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+        endpoint.record(time.monotonic() - start, ok=True)
+        return completion
+
+    async def complete(self, deadline=REQUEST_TIMEOUT, **kwargs):
+        """chat.completions.create(**kwargs) у лучшей модели не дольше deadline секунд.
+        Возвращает (completion, endpoint). LLMUnavailable — все цепи разомкнуты,
+        LLMDeadlineExceeded — не успели; иначе последняя ошибка моделей."""
+        deadline_at = time.monotonic() + deadline
+        candidates = self.ranked()
+        running = {}  # task -> endpoint, в порядке запуска
+        last_error = None
+
+        def launch():
+            timeout = deadline_at - time.monotonic()
+            if timeout < MIN_REQUEST_TIME:
+                return
+            # Цепь могла разомкнуться, пока ждали предыдущую модель
+            while candidates:
+                endpoint = candidates.pop(0)
+                if endpoint.breaker.acquire():
+                    task = asyncio.create_task(self._call(endpoint, kwargs, timeout))
+                    task.add_done_callback(endpoint.breaker.release_if_cancelled)
+                    running[task] = endpoint
+                    return
+
+        try:
+            launch()
+            if not running:
+                raise LLMUnavailable(min((e.breaker.retry_after for e in self.endpoints), default=0.0))
+            while running:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    # Срок вышел — для моделей, что не успели, это таймаут (считается ошибкой)
+                    for endpoint in running.values():
+                        endpoint.record_timeout()
+                    raise LLMDeadlineExceeded(f"LLM не ответила за {deadline:.0f} с")
+                # Следующую модель подключаем, если ответа нет дольше p90 (hedge)
+                # или сразу после ошибки
+                timeout = min(self.hedge_delay(), remaining) if self.hedge and candidates else remaining
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if self.hedge and candidates and time.monotonic() < deadline_at:
+                        launch()
+                    continue
+                for task in done:
+                    endpoint = running.pop(task)
+                    try:
+                        return task.result(), endpoint
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f"LLM {endpoint.name}: {e}")
+                        launch()
+        finally:
+            for task in running:
+                task.cancel()
+        raise last_error or LLMUnavailable(min((e.breaker.retry_after for e in self.endpoints), default=0.0))
+
+    def snapshot(self):
+        return [e.snapshot() for e in self.endpoints]
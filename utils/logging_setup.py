@@ -0,0 +1,140 @@
+# utils/logging_setup.py
+# Логирование без дискового ввода-вывода в обработчиках: записи кладутся
+# в очередь (QueueHandler), в поток/файл их пишет отдельный поток
+# (QueueListener). Каждая запись — одна строка JSON; поля update_id, user_id,
+# handler берутся из контекста апдейта (см. log_context и middleware в bot.py).
+# Частые INFO/DEBUG-строки ограничиваются по месту вызова: не больше
+# rate_limit в секунду, число пропущенных попадает в следующую запись.
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Поля текущего апдейта: {"update_id": ..., "user_id": ..., "handler": ...}
+log_context = contextvars.ContextVar("log_context", default={})
+
+CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+
+
+def bind_log_context(**fields):
+    """Добавляет поля к контексту логов; возвращает токен для log_context.reset()."""
+    return log_context.set({**log_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля контекста в запись — в потоке, где она создана
+    (поток записи контекста апдейта уже не видит)."""
+
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            setattr(record, key, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше rate записей в секунду с одного места вызова (файл:строка)
+    для уровней ниже WARNING. Предупреждения и ошибки проходят всегда."""
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self.buckets = {}  # (путь, строка) -> [токены, время, пропущено]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS + ("suppressed",):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний формат строк, с полями контекста в конце."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        extra = " ".join(f"{key}={getattr(record, key)}" for key in CONTEXT_FIELDS + ("suppressed",)
+                         if getattr(record, key, None) is not None)
+        return f"{line} [{extra}]" if extra else line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """В очередь уходит запись с готовым текстом, но без форматирования:
+    JSON собирает поток записи."""
+
+    def emit(self, record):
+        try:
+            # Текст сообщения собираем сразу: аргументы могут измениться,
+            # пока запись ждёт в очереди
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging(level="INFO", fmt="json", rate_limit=20, path=None):
+    """Настраивает корневой логгер: очередь + фоновый поток записи в файл path
+    (или stderr). Возвращает запущенный QueueListener (останавливается при выходе)."""
+    target = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    target.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(RateLimitFilter(rate_limit))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,197 @@
+# utils/nutrition.py
+# Анализ рациона без сети: свободный текст («завтрак: овсянка 200 г, 2 яйца»)
+# разбирается на продукты и количества, продукты ищутся в локальной таблице
+# (data/foods.csv, на 100 г) с нечётким сравнением русских названий,
+# калории и БЖУ считаются здесь же. LLM нужна только для комментария.
+import csv
+import re
+from collections import defaultdict
+
+MIN_SCORE = 0.5           # ниже — продукт считаем не найденным
+DEFAULT_PORTION_G = 200   # если количество не указано и обычной порции в таблице нет
+MAX_PIECES = 10           # «2 банана» — штуки, «банан 120» — граммы
+MATCH_CACHE_SIZE = 10000
+
+# Граммы на единицу; None — вес одной штуки/порции продукта
+_UNITS = (
+    (r"кг|килограмм\w*", 1000), (r"г|гр|грамм\w*", 1), (r"мл|миллилитр\w*", 1), (r"л|литр\w*", 1000),
+    (r"стакан\w*|кружк\w*|чашк\w*", 250), (r"ст\.?\s*л\.?|столов\w+\s+ложк\w*|ложк\w*", 15),
+    (r"ч\.?\s*л\.?|чайн\w+\s+ложк\w*", 5), (r"шт\.?|штук\w*|кус\w*|порци\w*|тарелк\w*", None),
+)
+_UNIT_RE = "|".join(f"(?:{pattern})" for pattern, _ in _UNITS)
+_NUMBER_WORDS = {
+    "пол": 0.5, "половина": 0.5, "половинка": 0.5, "один": 1, "одна": 1, "одно": 1,
+    "два": 2, "две": 2, "три": 3, "четыре": 4, "пять": 5, "шесть": 6,
+}
+_QUANTITY_RE = re.compile(
+    r"(?<![\w.,])(?:(\d+(?:[.,]\d+)?(?![\d.,%])|" + "|".join(_NUMBER_WORDS) + r")\s*-?\s*)?"
+    r"(?:(" + _UNIT_RE + r")(?![а-яё]))?",
+    re.IGNORECASE,
+)
+_MEAL_RE = re.compile(r"^\s*(завтрак|обед|ужин|перекус|полдник)\w*\s*[:—–-]?\s*", re.IGNORECASE)
+_SPLIT_RE = re.compile(r"\s*(?:[;+\n]|,(?!\d)|\s+и\s+)\s*")
+_FILLER_RE = re.compile(r"\b(?:примерно|около|где-то|немного|ещё|еще|плюс)\b")
+_ENDINGS = sorted((
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ой", "ей", "ий", "ый", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ую", "юю",
+    "а", "я", "о", "е", "и", "ы", "у", "ю", "ь",
+), key=len, reverse=True)
+
+NUTRIENTS = ("kcal", "protein", "fat", "carbs")
+
+
+def _stem(word):
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def food_key(name):
+    """Ключ сравнения: нижний регистр, «ё» -> «е», без знаков, слова без окончаний."""
+    words = re.findall(r"[а-яa-z]+|\d+(?:[.,]\d+)?%?", name.lower().replace("ё", "е"))
+    return " ".join(_stem(word) for word in words)
+
+
+def _trigrams(key):
+    grams = set()
+    for word in key.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class FoodIndex:
+    """Таблица продуктов в памяти: точный поиск по ключу названия и синонимов,
+    иначе — по совпадению триграмм (Dice) через обратный индекс."""
+
+    def __init__(self, foods):
+        self.foods = foods
+        self.exact = {}
+        self.keys = []                    # (ключ, триграммы, продукт)
+        self.postings = defaultdict(set)  # триграмма -> номера в self.keys
+        self.cache = {}
+        for food in foods:
+            for name in [food["name"], *food["aliases"]]:
+                key = food_key(name)
+                if not key or key in self.exact:
+                    continue
+                self.exact[key] = food
+                grams = _trigrams(key)
+                for gram in grams:
+                    self.postings[gram].add(len(self.keys))
+                self.keys.append((key, grams, food))
+
+    @classmethod
+    def from_csv(cls, path):
+        """CSV: name, kcal, protein, fat, carbs (на 100 г), portion_g — вес штуки
+        или обычной порции, aliases — синонимы через «|»."""
+        foods = []
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                food = {"name": row["name"], "portion_g": float(row["portion_g"]) if row["portion_g"] else None,
+                        "aliases": [alias for alias in row["aliases"].split("|") if alias]}
+                food.update((nutrient, float(row[nutrient])) for nutrient in NUTRIENTS)
+                foods.append(food)
+        return cls(foods)
+
+    def match(self, name):
+        """(продукт, сходство 0..1) или (None, лучшее сходство)."""
+        key = food_key(name)
+        if key in self.exact:
+            return self.exact[key], 1.0
+        if key in self.cache:
+            return self.cache[key]
+        grams = _trigrams(key)
+        hits = defaultdict(int)
+        for gram in grams:
+            for i in self.postings.get(gram, ()):
+                hits[i] += 1
+        best, best_score = None, 0.0
+        for i, common in hits.items():
+            score = 2 * common / (len(grams) + len(self.keys[i][1]))
+            if score > best_score:
+                best, best_score = self.keys[i][2], score
+        result = (best, best_score) if best_score >= MIN_SCORE else (None, best_score)
+        if len(self.cache) >= MATCH_CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = result
+        return result
+
+
+def _unit_grams(unit):
+    for pattern, grams in _UNITS:
+        if re.fullmatch(pattern, unit, re.IGNORECASE):
+            return grams
+    return None
+
+
+def _parse_item(text):
+    """'гречка 200 г' -> ('гречка', 200, 'г'); '2 яйца' -> ('яйца', 2, None)."""
+    amount, unit, rest = None, None, text
+    for match in _QUANTITY_RE.finditer(text):
+        number, unit_text = match.group(1), match.group(2)
+        if not number and not unit_text:
+            continue
+        if number:
+            amount = _NUMBER_WORDS.get(number.lower()) or float(number.replace(",", "."))
+        unit = unit_text
+        rest = text[:match.start()] + " " + text[match.end():]
+        break
+    name = " ".join(_FILLER_RE.sub(" ", rest.lower()).split()).strip(" .,:-")
+    return name, amount, unit
+
+
+def _grams(food, amount, unit):
+    portion = food["portion_g"] or DEFAULT_PORTION_G
+    if unit:
+        per_unit = _unit_grams(unit)
+        return (amount or 1) * (per_unit if per_unit is not None else portion)
+    if amount is None:
+        return portion
+    return amount * portion if amount <= MAX_PIECES else amount
+
+
+def analyze_meals(text, index):
+    """Разбор дневника питания. Возвращает dict: items — найденные продукты
+    (meal, text, food, grams, score и nutrients на эту порцию), unknown —
+    нераспознанные строки, totals — сумма по NUTRIENTS."""
+    items, unknown = [], []
+    totals = dict.fromkeys(NUTRIENTS, 0.0)
+    meal = None
+    for line in (text or "").splitlines():
+        header = _MEAL_RE.match(line)
+        if header:
+            meal = header.group(1).lower()
+            line = line[header.end():]
+        for part in _SPLIT_RE.split(line):
+            if not part.strip():
+                continue
+            name, amount, unit = _parse_item(part)
+            food, score = index.match(name) if name else (None, 0.0)
+            if food is None:
+                unknown.append(part.strip())
+                continue
+            grams = _grams(food, amount, unit)
+            item = {"meal": meal, "text": part.strip(), "food": food["name"], "grams": grams, "score": score}
+            for nutrient in NUTRIENTS:
+                item[nutrient] = food[nutrient] * grams / 100
+                totals[nutrient] += item[nutrient]
+            items.append(item)
+    return {"items": items, "unknown": unknown, "totals": totals}
+
+
+# Коэффициент активности — тренировки 3–4 раза в неделю
+ACTIVITY_FACTOR = 1.4
+GOAL_FACTORS = {"похудеть": 0.85, "набрать массу": 1.1, "поддерживать": 1.0}
+PROTEIN_PER_KG = {"похудеть": 1.8, "набрать массу": 2.0, "поддерживать": 1.4}
+
+
+def daily_targets(user):
+    """Норма калорий (Миффлин — Сан-Жеор) и белка по профилю, с поправкой на цель."""
+    bmr = 10 * user["weight"] + 6.25 * user["height"] - 5 * user["age"]
+    bmr += 5 if user["gender"] == "мужской" else -161
+    return {
+        "kcal": bmr * ACTIVITY_FACTOR * GOAL_FACTORS.get(user["goal"], 1.0),
+        "protein": user["weight"] * PROTEIN_PER_KG.get(user["goal"], 1.4),
+    }
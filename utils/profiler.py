@@ -0,0 +1,108 @@
+# utils/profiler.py
+# Диагностика производительности на работающем боте, без перезапуска и без
+# заметных накладных расходов, когда ничего не замеряется.
+# sample_stacks — сэмплирующий профилировщик: раз в interval снимает стеки
+# всех потоков (цикл asyncio, потоки Waitress, планировщик, to_thread)
+# через sys._current_frames() и отдаёт их в «свёрнутом» формате
+# (collapsed stacks), который понимают flamegraph.pl и speedscope.
+# LoopWatchdog — детектор блокировок цикла: цикл раз в interval отмечается,
+# отдельный поток замечает, что отметки давно не было, снимает стек потока
+# цикла и пишет его в лог вместе с длительностью блокировки.
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILE_SECONDS = 60
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 1.0
+DEFAULT_INTERVAL = 0.005
+SLOW_CALLBACK_THRESHOLD = 0.1
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=DEFAULT_INTERVAL):
+    """Сэмплирует стеки всех потоков (кроме вызывающего) seconds секунд.
+    Возвращает (строки «поток;кадр;...;кадр число», число снимков)."""
+    seconds = min(max(seconds, 0), MAX_PROFILE_SECONDS)
+    interval = max(interval, MIN_INTERVAL)
+    own = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(labels))] += 1
+        samples += 1
+        time.sleep(interval)
+    return [f"{stack} {count}" for stack, count in stacks.most_common()], samples
+
+
+class LoopWatchdog:
+    """Пишет в лог шаги цикла asyncio, занявшие больше threshold секунд, со стеком
+    кода, который держал цикл. Стоимость — одна отметка времени в цикле раз
+    в interval и проверка в отдельном потоке; можно держать включённым всегда."""
+
+    def __init__(self, threshold=SLOW_CALLBACK_THRESHOLD, interval=None):
+        self.threshold = threshold
+        self.interval = interval or threshold / 2
+        self.beat = time.monotonic()
+        self.loop_thread = None
+        self.blocked_stack = None  # стек, снятый во время текущей блокировки
+        self.slow_count = 0
+        self.max_blocked = 0.0
+        self.last_slow = None
+
+    def start(self, loop):
+        self.loop_thread = threading.get_ident()
+        loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def _heartbeat(self):
+        while True:
+            now = time.monotonic()
+            blocked = now - self.beat - self.interval
+            if self.blocked_stack is not None:
+                if blocked >= self.threshold:
+                    self._report(blocked)
+                else:
+                    # Стек сняли, когда цикл уже освобождался
+                    self.blocked_stack = None
+            self.beat = now
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            if self.blocked_stack is None and time.monotonic() - self.beat - self.interval > self.threshold:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.blocked_stack = "".join(traceback.format_stack(frame))
+
+    def _report(self, blocked):
+        stack, self.blocked_stack = self.blocked_stack, None
+        self.slow_count += 1
+        self.max_blocked = max(self.max_blocked, blocked)
+        self.last_slow = time.strftime('%Y-%m-%d %H:%M:%S')
+        logger.warning(f"Цикл asyncio заблокирован на {blocked * 1000:.0f} мс, стек в момент блокировки:\n{stack}")
+
+    def snapshot(self):
+        return {"threshold_ms": self.threshold * 1000, "slow_count": self.slow_count,
+                "max_blocked_ms": self.max_blocked * 1000, "last_slow": self.last_slow}
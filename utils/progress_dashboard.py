@@ -0,0 +1,129 @@
+# utils/progress_dashboard.py
+# Статистика и картинка-дашборд по таблице progress: по одному маленькому
+# графику на каждый замер (вес, обхваты, силовые), скользящее среднее и тренд.
+# Все метрики считаются за один проход по матрице «записи × метрики».
+import io
+import math
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+
+from utils.downsample import lttb
+
+# колонка таблицы progress -> (подпись, единица)
+PROGRESS_METRICS = {
+    "weight": ("Вес", "кг"),
+    "chest": ("Грудь", "см"),
+    "waist": ("Талия", "см"),
+    "hips": ("Бёдра", "см"),
+    "arms": ("Руки", "см"),
+    "shoulders": ("Плечи", "см"),
+    "thighs": ("Бедро (нога)", "см"),
+    "calves": ("Икры", "см"),
+    "squat": ("Присед", "кг"),
+    "bench": ("Жим лёжа", "кг"),
+    "deadlift": ("Становая", "кг"),
+}
+
+ROLLING_WINDOW = 7
+RECENT_DAYS = 28
+MAX_POINTS_PER_METRIC = 300
+SECONDS_PER_DAY = 86400
+
+
+def compute_stats(dates, matrix, window=ROLLING_WINDOW, recent_days=RECENT_DAYS):
+    """dates — datetime64[s] длины n, matrix — float (n, k) с NaN там, где замера нет.
+
+    Возвращает словарь массивов по всем k метрикам сразу:
+    rolling — скользящее среднее по последним window записям (пропуски метрики
+    не учитываются), (n, k),
+    slope_week / recent_slope_week — наклон тренда за всё время и за последние
+    recent_days дней (единиц в неделю), last — последнее значение, count — число замеров.
+    """
+    valid = ~np.isnan(matrix)
+    values = np.where(valid, matrix, 0.0)
+
+    # Скользящее среднее через кумулятивные суммы, пропуски не учитываются
+    cs = np.cumsum(values, axis=0)
+    cc = np.cumsum(valid, axis=0)
+    shifted_cs = np.vstack([np.zeros((window, matrix.shape[1])), cs])[:-window] if len(cs) else cs
+    shifted_cc = np.vstack([np.zeros((window, matrix.shape[1])), cc])[:-window] if len(cc) else cc
+    win_sum = cs - shifted_cs
+    win_cnt = cc - shifted_cc
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rolling = np.where(win_cnt > 0, win_sum / win_cnt, np.nan)
+    rolling[~valid] = np.nan
+
+    days = (dates - dates[0]).astype(np.float64) / SECONDS_PER_DAY if len(dates) else np.zeros(0)
+    slope_week = _masked_slope(days, values, valid) * 7
+    recent = valid & (days >= (days[-1] - recent_days if len(days) else 0))[:, None]
+    recent_slope_week = _masked_slope(days, values, recent) * 7
+
+    count = valid.sum(axis=0)
+    last_idx = np.where(count > 0, len(matrix) - 1 - np.argmax(valid[::-1], axis=0), 0)
+    last = np.where(count > 0, matrix[last_idx, np.arange(matrix.shape[1])], np.nan)
+    return {
+        "rolling": rolling,
+        "slope_week": slope_week,
+        "recent_slope_week": recent_slope_week,
+        "last": last,
+        "count": count,
+    }
+
+
+def _masked_slope(x, values, mask):
+    """Наклон МНК по каждой колонке с учётом маски, без цикла по колонкам."""
+    m = mask.astype(np.float64)
+    n = m.sum(axis=0)
+    xm = x[:, None] * m
+    sx = xm.sum(axis=0)
+    sy = (values * m).sum(axis=0)
+    sxx = (xm * x[:, None]).sum(axis=0)
+    sxy = (xm * values).sum(axis=0)
+    denom = n * sxx - sx * sx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where((n >= 2) & (denom > 0), (n * sxy - sx * sy) / denom, np.nan)
+
+
+def render_dashboard(dates, matrix, columns):
+    """PNG с маленькими графиками по каждой метрике, у которой есть данные."""
+    stats = compute_stats(dates, matrix)
+    present = [i for i in range(len(columns)) if stats["count"][i] > 0]
+    cols = 3 if len(present) > 4 else max(1, min(2, len(present)))
+    rows = max(1, math.ceil(len(present) / cols))
+    fig = Figure(figsize=(4.2 * cols, 2.8 * rows))
+    axes = np.atleast_1d(fig.subplots(rows, cols, squeeze=False)).ravel()
+
+    for ax, i in zip(axes, present):
+        label, unit = PROGRESS_METRICS[columns[i]]
+        mask = ~np.isnan(matrix[:, i])
+        x = dates[mask]
+        y = matrix[mask, i]
+        smooth = stats["rolling"][mask, i]
+        if len(y) > MAX_POINTS_PER_METRIC:
+            idx = lttb(x.astype(np.int64), y, MAX_POINTS_PER_METRIC)
+            x, y, smooth = x[idx], y[idx], smooth[idx]
+        xs = x.tolist()
+        ax.plot(xs, y, linestyle='none', marker='.', alpha=0.35)
+        ax.plot(xs, smooth, linewidth=2)
+        slope = stats["recent_slope_week"][i]
+        if np.isnan(slope):
+            slope = stats["slope_week"][i]
+        trend = "" if np.isnan(slope) else f" ({slope:+.2f} {unit}/нед)"
+        ax.set_title(f"{label}: {stats['last'][i]:.1f} {unit}{trend}", fontsize=10)
+        locator = mdates.AutoDateLocator(minticks=2, maxticks=5)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        ax.tick_params(labelsize=8)
+        ax.grid(True, alpha=0.3)
+    for ax in axes[len(present):]:
+        ax.set_visible(False)
+
+    fig.suptitle("Прогресс")
+    fig.tight_layout()
+    img = io.BytesIO()
+    fig.savefig(img, format='png', dpi=90)
+    return img.getvalue()
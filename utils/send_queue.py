@@ -0,0 +1,211 @@
+# utils/send_queue.py
+# Планировщик исходящих запросов к Bot API. Подключается как middleware сессии
+# aiogram, поэтому через него проходят все вызовы (message.answer, edit_text,
+# delete_message, answer_photo, send_message) без правок в обработчиках.
+# Запросы делятся на классы: ответы пользователю > правки > удаление старых
+# сообщений > массовые рассылки. Общий лимит (token bucket) — около 30
+# запросов в секунду на бота; новые сообщения в одном чате — около 1 в секунду
+# с небольшим запасом (правки, удаления и «печатает...» тратят только общий
+# лимит); рассылкам достаётся только часть общего лимита, так что ответы
+# не ждут за рассылкой. На RetryAfter запрос повторяется после паузы,
+# а чат (или весь бот) придерживается на это время.
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from collections import Counter, defaultdict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, EDIT, CLEANUP, BULK = 0, 1, 2, 3
+PRIORITY_NAMES = {INTERACTIVE: "ответы", EDIT: "правки", CLEANUP: "удаление", BULK: "рассылки"}
+
+# Класс по методу Bot API; методы не из списка (getMe, setWebhook, getFile...)
+# идут без очереди
+METHOD_PRIORITIES = {
+    "sendMessage": INTERACTIVE, "sendPhoto": INTERACTIVE, "sendDocument": INTERACTIVE,
+    "sendInvoice": INTERACTIVE, "answerCallbackQuery": INTERACTIVE, "answerPreCheckoutQuery": INTERACTIVE,
+    "editMessageText": EDIT, "editMessageReplyMarkup": EDIT, "editMessageCaption": EDIT, "sendChatAction": EDIT,
+    "deleteMessage": CLEANUP, "deleteMessages": CLEANUP,
+}
+# Лимит чата Telegram считает по новым сообщениям — только они тратят токены ведра чата
+CHAT_LIMITED_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "sendInvoice"}
+
+# Telegram считает запросы в скользящем окне: за любую секунду уходит не больше
+# GLOBAL_RATE + GLOBAL_BURST, поэтому сумма держится в пределах ~30
+GLOBAL_RATE = 25.0      # запросов в секунду на бота
+GLOBAL_BURST = 5
+CHAT_RATE = 1.0         # в одном чате
+CHAT_BURST = 3          # ответ из нескольких сообщений уходит без задержки
+BULK_SHARE = 0.6        # доля общего лимита, доступная рассылкам
+MAX_RETRIES = 3
+MAX_GLOBAL_PAUSE = 1.0  # 429 в одном чате притормаживает и остальные, но ненадолго
+MAX_CHAT_BUCKETS = 10000
+
+# Класс запросов текущей задачи; рассылки выставляют BULK (см. bulk_sends)
+send_priority = contextvars.ContextVar("send_priority", default=None)
+
+
+def bulk_sends():
+    """Все запросы текущей задачи (и созданных из неё) — массовая рассылка."""
+    send_priority.set(BULK)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд появится токен (0 — уже есть)."""
+        self.refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+
+
+class SendScheduler:
+    """Выдаёт разрешения на запросы: сначала более приоритетным, в порядке
+    поступления внутри класса. rate <= 0 — без ограничения скорости
+    ни общей, ни по чатам (остаётся только обработка RetryAfter)."""
+
+    def __init__(self, rate=GLOBAL_RATE, burst=GLOBAL_BURST, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 bulk_share=BULK_SHARE):
+        self.enabled = rate > 0
+        self.global_bucket = TokenBucket(rate, burst) if self.enabled else None
+        self.bulk_bucket = TokenBucket(rate * bulk_share, max(1, int(burst * bulk_share))) if self.enabled else None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats = {}     # chat_id -> TokenBucket
+        self.waiting = []   # [priority, seq, chat_id, chat_limited] ждущих запросов
+        self.paused_until = 0.0
+        self.seq = itertools.count()
+        self.sent = Counter()
+        self.retries = Counter()
+        self.wait_total = defaultdict(float)
+
+    def _chat(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= MAX_CHAT_BUCKETS:
+                # Ведра давно молчащих чатов полные — их можно забыть
+                now = time.monotonic()
+                self.chats = {k: b for k, b in self.chats.items()
+                              if now - b.updated < self.chat_burst / self.chat_rate or now < b.blocked_until}
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _chat_wait(self, entry, now):
+        """Сколько запросу entry ждать из-за своего чата: сообщениям — токена
+        ведра чата, остальным — только конца паузы после RetryAfter."""
+        _, _, chat_id, chat_limited = entry
+        if chat_id is None:
+            return 0.0
+        chat = self._chat(chat_id)
+        if chat_limited and self.enabled:
+            return chat.wait_time(now)
+        return max(0.0, chat.blocked_until - now)
+
+    def _delay(self, entry, now):
+        """0 — запросу entry можно идти, иначе сколько подождать до новой попытки."""
+        priority = entry[0]
+        if not self.enabled:
+            # Без лимитов — только паузы после RetryAfter
+            return max(0.0, self.paused_until - now, self._chat_wait(entry, now))
+        delay = max(self.paused_until - now, self._chat_wait(entry, now), self.global_bucket.wait_time(now))
+        if priority == BULK:
+            delay = max(delay, self.bulk_bucket.wait_time(now))
+        if delay > 0:
+            return delay
+        # Токен есть, но сначала — более приоритетные, которым не мешает лимит их чата
+        for other in self.waiting:
+            if other < entry and self._chat_wait(other, now) == 0:
+                return 1 / self.global_bucket.rate
+        return 0.0
+
+    async def acquire(self, priority, chat_id=None, chat_limited=True):
+        entry = [priority, next(self.seq), chat_id, chat_limited]
+        self.waiting.append(entry)
+        start = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                delay = self._delay(entry, now)
+                if delay == 0:
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            self.waiting.remove(entry)
+        if self.enabled:
+            if chat_id is not None and chat_limited:
+                self._chat(chat_id).take()
+            self.global_bucket.take()
+            if priority == BULK:
+                self.bulk_bucket.take()
+        self.sent[priority] += 1
+        self.wait_total[priority] += time.monotonic() - start
+
+    def retry_after(self, chat_id, seconds):
+        """Telegram ответил 429: придерживаем чат на весь срок, остальных —
+        не дольше MAX_GLOBAL_PAUSE (по ответу не понять, чей лимит превышен)."""
+        now = time.monotonic()
+        if chat_id is not None:
+            self._chat(chat_id).block(now, seconds)
+            seconds = min(seconds, MAX_GLOBAL_PAUSE)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def snapshot(self):
+        waiting = Counter(entry[0] for entry in self.waiting)
+        return [{
+            "name": PRIORITY_NAMES[priority],
+            "waiting": waiting[priority],
+            "sent": self.sent[priority],
+            "retries": self.retries[priority],
+            "avg_wait_ms": 1000 * self.wait_total[priority] / self.sent[priority] if self.sent[priority] else None,
+        } for priority in PRIORITY_NAMES]
+
+
+class SendQueueMiddleware(BaseRequestMiddleware):
+    """Middleware сессии: ждёт разрешения планировщика, повторяет после RetryAfter."""
+
+    def __init__(self, scheduler, max_retries=MAX_RETRIES):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request, bot, method):
+        priority = METHOD_PRIORITIES.get(method.__api_method__)
+        if priority is None:
+            return await make_request(bot, method)
+        # Правки и удаления из рассылки остаются своими классами, сообщения — BULK
+        if send_priority.get() == BULK and priority == INTERACTIVE:
+            priority = BULK
+        chat_id = getattr(method, "chat_id", None)
+        chat_limited = method.__api_method__ in CHAT_LIMITED_METHODS
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(priority, chat_id, chat_limited)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.scheduler.retries[priority] += 1
+                logger.warning(f"Telegram просит подождать {e.retry_after} с ({method.__api_method__}, чат {chat_id})")
+                self.scheduler.retry_after(chat_id, e.retry_after)
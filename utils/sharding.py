@@ -0,0 +1,149 @@
+# utils/sharding.py
+# Режим нескольких процессов. Фронт (front.py) принимает вебхук и раздаёт
+# апдейты N процессам-обработчикам по хешу user_id: все апдейты одного
+# пользователя попадают в один процесс, поэтому анкета (user_states) и кеши
+# пользователя остаются локальными, а порядок апдейтов сохраняется.
+# Общее хранилище — та же база SQLite (WAL). Межпроцессные операции админки
+# (сброс кешей после выдачи/отзыва подписки, удаление, рассылка, уведомления)
+# идут через общую шину: обработчик кладёт сообщение в bus, фронт пересылает
+# его процессу-владельцу пользователя. Очереди multiprocessing здесь —
+# локальная замена брокера сообщений.
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Поля апдейта, в которых есть отправитель
+UPDATE_EVENTS = (
+    "message", "edited_message", "callback_query", "pre_checkout_query", "shipping_query",
+    "inline_query", "chosen_inline_result", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+class WorkerUnavailable(Exception):
+    """Процесс-обработчик пользователя не работает — апдейт не принят."""
+
+
+def shard_for(user_id, workers):
+    """Номер процесса для пользователя; апдейты без пользователя — в нулевой."""
+    if workers <= 1 or user_id is None:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+def update_user_id(update):
+    """user_id отправителя из апдейта (dict) или None."""
+    for key in UPDATE_EVENTS:
+        event = update.get(key)
+        if event:
+            sender = event.get("from") or event.get("chat") or {}
+            return sender.get("id")
+    return None
+
+
+def worker_main(index, workers, inbox, bus):
+    """Точка входа процесса-обработчика (запускается через spawn)."""
+    os.environ["WORKER_INDEX"] = str(index)
+    os.environ["BOT_WORKERS"] = str(workers)
+    import bot
+    bot.run_worker(inbox, bus)
+
+
+class WorkerPool:
+    """Процессы-обработчики и маршрутизация между ними (на стороне фронта).
+
+    Сообщения в inbox обработчика: ("update", json), ("invalidate", user_id),
+    ("forget", user_id), ("notify", user_id, text), ("broadcast", [user_id], text),
+    None — завершиться. Сообщения от обработчиков в bus: ("ready", index),
+    ("done", index, update_id, error), остальные — переслать владельцу."""
+
+    def __init__(self, workers, target=worker_main):
+        context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.bus = context.Queue()
+        self.inboxes = [context.Queue() for _ in range(workers)]
+        self.processes = [
+            context.Process(target=target, args=(i, workers, self.inboxes[i], self.bus),
+                            name=f"bot-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self.in_flight = [0] * workers
+        self.dispatched = [0] * workers
+        self.ready = threading.Event()
+        self._first_ready = threading.Event()
+        self.on_done = None  # callback(update_id, error) — для нагрузочного теста
+        self._ready_count = 0
+        self._lock = threading.Lock()
+        self._router = threading.Thread(target=self._route_bus, name="shard-bus", daemon=True)
+
+    def start(self, timeout=120):
+        # Сначала нулевой: при импорте bot.py он создаёт и мигрирует схему базы,
+        # остальные стартуют на готовой
+        self._router.start()
+        self.processes[0].start()
+        if not self._first_ready.wait(timeout):
+            raise RuntimeError("Обработчик 0 не запустился")
+        for process in self.processes[1:]:
+            process.start()
+
+    def dispatch(self, body):
+        """Отдаёт апдейт (JSON-строка или bytes) процессу его пользователя."""
+        update = json.loads(body)
+        if not isinstance(update, dict):
+            raise ValueError("апдейт должен быть JSON-объектом")
+        shard = shard_for(update_user_id(update), self.workers)
+        # Умерший обработчик очередь не разбирает: пусть Telegram повторит апдейт позже
+        if not self.processes[shard].is_alive():
+            raise WorkerUnavailable(f"обработчик {shard} не работает")
+        with self._lock:
+            self.in_flight[shard] += 1
+            self.dispatched[shard] += 1
+        self.inboxes[shard].put(("update", body))
+        return shard
+
+    def _route_bus(self):
+        while True:
+            message = self.bus.get()
+            if message is None:
+                return
+            kind = message[0]
+            if kind == "done":
+                _, index, update_id, error = message
+                with self._lock:
+                    self.in_flight[index] -= 1
+                if self.on_done:
+                    self.on_done(update_id, error)
+            elif kind == "ready":
+                self._ready_count += 1
+                self._first_ready.set()
+                logger.info(f"Обработчик {message[1]} готов")
+                if self._ready_count == self.workers:
+                    self.ready.set()
+            elif kind == "broadcast":
+                _, user_ids, text = message
+                groups = defaultdict(list)
+                for user_id in user_ids:
+                    groups[shard_for(user_id, self.workers)].append(user_id)
+                for shard, group in groups.items():
+                    self.inboxes[shard].put(("broadcast", group, text))
+            else:
+                self.inboxes[shard_for(message[1], self.workers)].put(message)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"worker": i, "alive": p.is_alive(), "in_flight": self.in_flight[i],
+                     "dispatched": self.dispatched[i]} for i, p in enumerate(self.processes)]
+
+    def stop(self, timeout=10):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.bus.put(None)
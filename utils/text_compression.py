@@ -0,0 +1,62 @@
+# utils/text_compression.py
+# Сжатие текстов тренировок: deflate с общим предустановленным словарём.
+# Тексты от LLM короткие (несколько КБ) и очень похожи друг на друга, поэтому
+# обычный zlib почти ничего не выигрывает, а словарь из типичных строк
+# («- Упражнение: », «- Подходы: », названия упражнений…) даёт основной эффект.
+import struct
+import zlib
+from collections import Counter
+
+# Максимальный полезный размер словаря для deflate — размер окна (32 КБ)
+MAX_DICT_SIZE = 32 * 1024
+COMPRESSION_LEVEL = 9
+_HEADER = struct.Struct(">H")  # id словаря
+
+# Словарь № 0 — встроенный, пока нет обученного на реальных данных
+SEED_DICTIONARY = "\n".join([
+    "Разминка", "Основная часть", "Заминка", "Растяжка", "Суставная гимнастика",
+    "Приседания", "Отжимания", "Выпады", "Планка", "Подтягивания", "Становая тяга",
+    "Жим лёжа", "Жим гантелей", "Тяга гантели в наклоне", "Скручивания", "Берпи",
+    "Ягодичный мостик", "Бег на месте", "Прыжки", "Махи гирей",
+    "- Примечание: ", "- Вес: ", " кг", "- Повторы: ", "- Подходы: ", "- Упражнение: ",
+    "на каждую ногу", "секунд", "минут", "отдых между подходами",
+    "Следи за техникой", "без рывков", "дыхание ровное",
+]).encode("utf-8")
+
+
+def train_dictionary(samples, size=MAX_DICT_SIZE):
+    """Строит словарь из образцов текста: самые «выгодные» строки (частота ×
+    длина), встречающиеся хотя бы в двух образцах. Самые ценные — в конце:
+    deflate дешевле кодирует близкие ссылки."""
+    counts = Counter()
+    for text in samples:
+        counts.update({line.strip() for line in text.splitlines() if len(line.strip()) >= 4})
+    scored = sorted(
+        ((count * len(line.encode("utf-8")), line) for line, count in counts.items() if count >= 2),
+        reverse=True,
+    )
+    chosen = []
+    total = len(SEED_DICTIONARY) + 1
+    for _, line in scored:
+        length = len(line.encode("utf-8")) + 1
+        if total + length > size:
+            break
+        chosen.append(line)
+        total += length
+    # Наименее ценные первыми, самые ценные — ближе к концу словаря
+    return SEED_DICTIONARY + b"\n" + "\n".join(reversed(chosen)).encode("utf-8")
+
+
+def compress_text(text, dict_id, zdict):
+    """str -> bytes: 2 байта id словаря + raw deflate."""
+    c = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=zdict)
+    return _HEADER.pack(dict_id) + c.compress(text.encode("utf-8")) + c.flush()
+
+
+def dictionary_id(blob):
+    return _HEADER.unpack_from(blob)[0]
+
+
+def decompress_text(blob, zdict):
+    d = zlib.decompressobj(-15, zdict=zdict)
+    return (d.decompress(blob[_HEADER.size:]) + d.flush()).decode("utf-8")
@@ -0,0 +1,89 @@
+# utils/training_parser.py
+# Разбор текста тренировки от модели в список упражнений. Промпт просит формат
+# «- Упражнение / - Подходы / - Повторы / - Вес / - Примечание», но модель
+# добавляет markdown, нумерацию, диапазоны («10–12») и время («30 секунд»),
+# поэтому разбор терпимый: что не распознано — остаётся None.
+import re
+
+FIELDS = {
+    "упражнение": "name",
+    "подходы": "sets",
+    "подход": "sets",
+    "повторы": "reps",
+    "повторения": "reps",
+    "повторений": "reps",
+    "вес": "weight",
+    "примечание": "note",
+}
+
+# «- **Подходы:** 3», «1. Упражнение: Присед», «* Вес — 20 кг»
+_FIELD_RE = re.compile(
+    r"^\s*(?:[-*•]|\d+[.)])?\s*\**\s*(" + "|".join(FIELDS) + r")\s*\**\s*[:—–-]\s*\**\s*(.*?)\s*\**\s*$",
+    re.IGNORECASE,
+)
+# «**Разминка (5–7 минут)**», «### Основная часть», «**Заминка:**»
+_SECTION_RE = re.compile(r"^\s*(?:#+\s*(.+?)|\*\*(.+?)\*\*:?)\s*$")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_DURATION_UNITS = (("мин", 60), ("сек", 1))
+_EMPTY_VALUES = {"", "-", "—", "–", "нет"}
+
+
+def normalize_exercise_name(name):
+    """Ключ для группировки: нижний регистр, «ё» -> «е», без пояснений в скобках и markdown."""
+    key = re.sub(r"\(.*?\)", "", name.lower().replace("ё", "е"))
+    key = re.sub(r"[*_`\"«».,:;!]", "", key)
+    return " ".join(key.split())
+
+
+def _first_number(value):
+    match = _NUMBER_RE.search(value or "")
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def _parse_reps(value):
+    """'12' -> (12, None); '10–12' -> (10, None); '30 секунд' -> (None, 30); '1 мин' -> (None, 60)."""
+    number = _first_number(value)
+    if number is None:
+        return None, None
+    rest = value[_NUMBER_RE.search(value).end():].strip().lower()
+    for unit, seconds in _DURATION_UNITS:
+        if rest.startswith(unit):
+            return None, int(number * seconds)
+    return int(number), None
+
+
+def parse_training(text):
+    """Список упражнений в порядке текста: dict с ключами position, section,
+    name, name_key, sets, reps, duration_sec, weight, note."""
+    exercises = []
+    section = None
+    current = None
+    for line in (text or "").splitlines():
+        field = _FIELD_RE.match(line)
+        if not field:
+            header = _SECTION_RE.match(line)
+            if header:
+                section = re.sub(r"\s*\(.*?\)", "", header.group(1) or header.group(2)).strip(" :*") or section
+            continue
+        kind, value = FIELDS[field.group(1).lower()], field.group(2).strip()
+        if kind == "name":
+            if not value:
+                continue
+            current = {
+                "position": len(exercises), "section": section,
+                "name": value, "name_key": normalize_exercise_name(value),
+                "sets": None, "reps": None, "duration_sec": None, "weight": None, "note": None,
+            }
+            exercises.append(current)
+        elif current is None:
+            continue
+        elif kind == "sets":
+            sets = _first_number(value)
+            current["sets"] = int(sets) if sets is not None else None
+        elif kind == "reps":
+            current["reps"], current["duration_sec"] = _parse_reps(value)
+        elif kind == "weight":
+            current["weight"] = _first_number(value)
+        else:
+            current["note"] = None if value.lower() in _EMPTY_VALUES else value
+    return exercises